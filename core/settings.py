@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "django_filters",
     "corsheaders",
     "rest_framework",
@@ -148,6 +149,56 @@ CHANNEL_LAYERS = {
     }
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{config('REDIS_HOST')}:{config('REDIS_PORT')}",
+    }
+}
+
+PRESENCE = {
+    "BACKEND": "messaging.utils.presence.RedisPresenceStore",
+    "TTL": config("PRESENCE_TTL", default=60, cast=int),
+}
+
+# Newest-page cache of ChatRoomMessageViewSet.list. Set MESSAGE_CACHE_BACKEND
+# to an empty value to turn it off.
+MESSAGE_CACHE = {
+    "BACKEND": config(
+        "MESSAGE_CACHE_BACKEND",
+        default="messaging.utils.recent.RedisRecentMessagesStore",
+    ),
+    "SIZE": config("MESSAGE_CACHE_SIZE", default=50, cast=int),
+    "TTL": config("MESSAGE_CACHE_TTL", default=3600, cast=int),
+}
+
+# Per-connection limits for typing, focus and seen signals: at most RATE frames
+# a second (bursts up to BURST), one publish per room and kind every INTERVAL
+# seconds, and unchanged values repeated no more than every REFRESH seconds.
+EPHEMERAL_EVENTS = {
+    "RATE": config("EPHEMERAL_RATE", default=10, cast=float),
+    "BURST": config("EPHEMERAL_BURST", default=20, cast=int),
+    "INTERVAL": config("EPHEMERAL_INTERVAL", default=0.5, cast=float),
+    "REFRESH": config("EPHEMERAL_REFRESH", default=3.0, cast=float),
+}
+
+# Per-socket outbound queues. A socket is closed once MAX_SIZE frames that may
+# not be dropped are waiting or its oldest frame is older than MAX_LAG seconds.
+# Event types default to "keep"; see messaging.utils.sendqueue.SendQueue.
+# Sockets opened with `?batch=1` get up to BATCH_SIZE events per frame, held
+# back at most BATCH_WINDOW seconds.
+SEND_QUEUE = {
+    "MAX_SIZE": config("SEND_QUEUE_MAX_SIZE", default=500, cast=int),
+    "MAX_LAG": config("SEND_QUEUE_MAX_LAG", default=30.0, cast=float),
+    "POLICIES": {
+        "chat_message_edit": "collapse",
+        "presence": "collapse",
+        "ephemeral": "drop",
+    },
+    "BATCH_WINDOW": config("SEND_QUEUE_BATCH_WINDOW", default=0.005, cast=float),
+    "BATCH_SIZE": config("SEND_QUEUE_BATCH_SIZE", default=100, cast=int),
+}
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": ("users.authorization.JWTAuthorization",),
     "DEFAULT_FILTER_BACKENDS": [
@@ -167,6 +218,9 @@ CUSTOM_AUTH = {
     "TOKEN_VALID_DURATION_HOURS": 5,
     "REFRESH_TOKEN_VALID_DURATION_HOURS": 24,
     "AUTH_HEADER_KEY": "HTTP_AUTHORIZATION",
+    "TOKEN_CACHE_TTL_SECONDS": 300,
+    "TOKEN_LOCAL_CACHE_TTL_SECONDS": 5,
+    "TOKEN_LOCAL_CACHE_SIZE": 10000,
     "BASE_AUTH_SERVICE_URL": config("BASE_AUTH_SERVICE_URL"),
     "BASE_AUTH_ISSUED_API_KEY": config("BASE_AUTH_ISSUED_API_KEY"),
     "BASE_AUTH_ISSUED_SERVICE_NAME": config("BASE_AUTH_ISSUED_SERVICE_NAME"),
@@ -174,4 +228,12 @@ CUSTOM_AUTH = {
     "BASE_AUTH_SERVICE_VERIFICATION_ENDPOINT": config(
         "BASE_AUTH_SERVICE_VERIFICATION_ENDPOINT"
     ),
+    "BASE_AUTH_SERVICE_POOL_SIZE": 20,
+    "BASE_AUTH_SERVICE_CONNECT_TIMEOUT_SECONDS": 3,
+    "BASE_AUTH_SERVICE_READ_TIMEOUT_SECONDS": 5,
+    "HQ_TOKEN_CACHE_SECONDS": 30,
+}
+
+MESSAGE_SEARCH = {
+    "TRIGRAM": config("MESSAGE_SEARCH_TRIGRAM", default=False, cast=bool),
 }
@@ -1,47 +1,71 @@
-import jwt
 import logging
-from typing import Any, cast
+from typing import Any, Optional
+from urllib.parse import parse_qs
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from django.conf import settings
-from users.models.users import User
+from rest_framework import exceptions
+
+from users.utils.auth import AuthManager, AuthTokenCache
 
 logger = logging.getLogger(__name__)
 
+TOKEN_QUERY_PARAM = "token"
+TOKEN_SUBPROTOCOL = "bearer"
+
+
+def get_token(scope: dict[str, Any]) -> tuple[Optional[str], Optional[str]]:
+    """
+    Returns the access token of a WebSocket connection and the subprotocol to
+    accept it with. Browsers cannot set headers on WebSockets, so the token is
+    read from the `Sec-WebSocket-Protocol` pair `bearer, <token>` or from the
+    `token` query parameter.
+    """
+    subprotocols: list[str] = scope.get("subprotocols") or []
+    for index, subprotocol in enumerate(subprotocols[:-1]):
+        if subprotocol.lower() == TOKEN_SUBPROTOCOL:
+            return subprotocols[index + 1], subprotocol
+
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    tokens = query.get(TOKEN_QUERY_PARAM)
+    if tokens:
+        return tokens[0], None
+    return None, None
+
 
 @database_sync_to_async
 def get_user_from_token(token: str):
     try:
-        decoded = cast(
-            dict[str, Any], jwt.decode(token, cast(str, settings.SECRET_KEY), ["HS256"])
-        )
-        user = User.objects.filter(email=decoded.get("email")).first()
-        if not user:
-            logger.warning("Token payload missing user email identifier.")
-            return AnonymousUser()
-        return user
-
-    except jwt.ExpiredSignatureError:
-        logger.warning("JWT signature expired")
+        user = AuthManager.user_for_token(token)
+    except exceptions.AuthenticationFailed as error:
+        logger.warning("WebSocket token rejected: %s", error.detail)
+        return AnonymousUser()
+
+    if user is None:
+        logger.warning("WebSocket token unknown or revoked.")
         return AnonymousUser()
+    return user
 
 
 class TokenAuthMiddleWare:
     """
-    Custom middleware to authenticate users based on a token in the WS_AUTHORIZATION header.
-    (No changes needed in TokenAuthMiddleWare class itself, assuming you've already set it up)
+    Authenticates WebSocket connections with the same access tokens, cache and
+    revocation rules as `JWTAuthorization`. Tokens in the in-process cache are
+    resolved without a thread hop, and shared-cache hits without a query.
     """
 
     def __init__(self, inner: Any) -> None:
         self.inner = inner
 
     async def __call__(self, scope: dict[str, Any], receive: Any, send: Any):
-        token = str(scope["query_string"]).split("=").pop().replace("'", "")
+        token, subprotocol = get_token(scope)
+        scope = dict(scope, auth_subprotocol=subprotocol)
 
-        try:
-            scope["user"] = await get_user_from_token(str(token))
-        except ValueError:
+        if not token:
             scope["user"] = AnonymousUser()
+        else:
+            scope["user"] = AuthTokenCache.get_local_user(
+                token
+            ) or await get_user_from_token(token)
 
         return await self.inner(scope, receive, send)
 
@@ -1,3 +1,4 @@
 from .chat import ChatConsumer
+from .inbox import InboxConsumer
 
-__all__ = ["ChatConsumer"]
+__all__ = ["ChatConsumer", "InboxConsumer"]
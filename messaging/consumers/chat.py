@@ -1,78 +1,364 @@
+import asyncio
 import json
 from typing import Any, Optional, cast
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.layers import BaseChannelLayer
 from channels.sessions import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
+from rest_framework import exceptions
 
 from messaging.models.chat import ChatRoomMember
+from messaging.serializers.chat import (
+    ChatRoomMessageDetailSerializer,
+    ChatRoomMessageCreateRequestSerializer,
+)
+from messaging.utils.chat import ChatMembershipCache, ChatMessageManager
+from messaging.utils.ephemeral import EphemeralCoalescer
+from messaging.utils.presence import PresenceManager
+from messaging.utils.sendqueue import SendQueue, SendQueueMetrics
 from users.models.users import User
 
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class BaseChatConsumer(AsyncWebsocketConsumer):
+    """
+    Sending, presence and room event delivery shared by the per-room and inbox
+    sockets. Room events carry a `room_id` so multiplexed clients can route them.
+
+    Every authenticated connection also joins its user's `user_{id}` group,
+    which carries `unread` and `membership` events for all of the user's rooms.
+
+    Presence entries expire after `settings.PRESENCE["TTL"]` seconds, so clients
+    should send a `{"type": "heartbeat"}` frame well within that interval.
+
+    Typing, focus and seen signals are sent as
+    `{"type": "ephemeral", "kind": ..., "value": ...}` frames. They are rate
+    limited and coalesced per connection (see EphemeralCoalescer), relayed to
+    the other sockets in the room and never stored. Clients should expire a
+    peer's typing indicator when it is not refreshed within a few seconds.
+
+    Group events are written to the socket from a bounded SendQueue (see
+    `settings.SEND_QUEUE`), so a slow client never holds up its channel. A
+    client that falls too far behind is closed with `slow_close_code` and
+    should reconnect and catch up from the REST history.
+
+    Sockets opened with `?batch=1` receive group events as JSON arrays of up
+    to `SEND_QUEUE["BATCH_SIZE"]` events, each held back at most
+    `SEND_QUEUE["BATCH_WINDOW"]` seconds. Replies to the socket's own frames
+    (acks, errors) are never batched.
+    """
+
+    slow_close_code = 4008
+
     def __init__(self, *args: Any, **kwargs: Any):
         self.user: AnonymousUser | User
+        self.channel_layer: BaseChannelLayer
+        self.user_group_name: Optional[str] = None
+        self.ephemeral_coalescer = EphemeralCoalescer.from_settings()
+        self.ephemeral_flushes: dict[tuple[str, str], asyncio.Task[None]] = {}
+        self.send_queue: Optional[SendQueue] = SendQueue.from_settings()
+        self.frames_ready = asyncio.Event()
+        self.writer: Optional[asyncio.Task[None]] = None
+        self.batching = False
+        super().__init__(*args, **kwargs)
+
+    async def accept(self, subprotocol: Optional[str] = None, headers: Any = None):
+        """
+        Echoes the subprotocol the client authenticated with, if any.
+        """
+        await super().accept(
+            subprotocol or self.scope.get("auth_subprotocol"), headers=headers
+        )
+        query = parse_qs(self.scope.get("query_string", b"").decode("latin-1"))
+        self.batching = query.get("batch", [""])[0] in {"1", "true"}
+        self.writer = asyncio.create_task(self.write_frames())
+
+    async def websocket_disconnect(self, message: dict[str, Any]):
+        if self.writer is not None:
+            _ = self.writer.cancel()
+        await super().websocket_disconnect(message)
+
+    async def join_user_group(self):
+        self.user_group_name = ChatMessageManager.user_group_name(self.user.pk)
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+
+    async def leave_user_group(self):
+        if self.user_group_name is not None:
+            await self.channel_layer.group_discard(
+                self.user_group_name, self.channel_name
+            )
+            self.user_group_name = None
+
+    async def join_presence(self, room_ids: list[str]):
+        came_online = await sync_to_async(
+            PresenceManager.store().connect, thread_sensitive=False
+        )(room_ids, self.user.pk, self.channel_name)
+        await self.publish_presence(came_online, True)
+
+    async def leave_presence(self, room_ids: list[str]):
+        went_offline = await sync_to_async(
+            PresenceManager.store().disconnect, thread_sensitive=False
+        )(room_ids, self.user.pk, self.channel_name)
+        await self.publish_presence(went_offline, False)
+
+    async def heartbeat(self, room_ids: list[str]):
+        await sync_to_async(PresenceManager.store().heartbeat, thread_sensitive=False)(
+            room_ids, self.user.pk, self.channel_name
+        )
+        await self.send(text_data=json.dumps({"type": "heartbeat_ack"}))
+
+    async def publish_presence(self, room_ids: list[str], online: bool):
+        for room_id in room_ids:
+            await self.channel_layer.group_send(
+                ChatMessageManager.group_name(room_id),
+                ChatMessageManager.group_event(
+                    PresenceManager.group_event(room_id, self.user.pk, online)
+                ),
+            )
+
+    async def send_ephemeral(self, room_id: str, frame: dict[str, Any]):
+        kind, value = frame.get("kind"), frame.get("value")
+        if not EphemeralCoalescer.is_valid(kind, value):
+            await self.send_error(frame.get("request_id"), "Invalid ephemeral signal.")
+            return
+        if not self.ephemeral_coalescer.allow():
+            return
+
+        kind = cast(str, kind)
+        delay = self.ephemeral_coalescer.offer(room_id, kind, value)
+        if delay == 0:
+            await self.publish_ephemeral(room_id, kind, value)
+        elif delay is not None:
+            self.ephemeral_flushes[(room_id, kind)] = asyncio.create_task(
+                self.flush_ephemeral(room_id, kind, delay)
+            )
+
+    async def flush_ephemeral(self, room_id: str, kind: str, delay: float):
+        await asyncio.sleep(delay)
+        _ = self.ephemeral_flushes.pop((room_id, kind), None)
+        publish, value = self.ephemeral_coalescer.flush(room_id, kind)
+        if publish:
+            await self.publish_ephemeral(room_id, kind, value)
+
+    async def publish_ephemeral(self, room_id: str, kind: str, value: Any):
+        await self.channel_layer.group_send(
+            ChatMessageManager.group_name(room_id),
+            {
+                **ChatMessageManager.group_event(
+                    {
+                        "type": "ephemeral",
+                        "room_id": room_id,
+                        "user_id": str(self.user.pk),
+                        "kind": kind,
+                        "value": value,
+                    }
+                ),
+                # Lets the sending socket skip its own signal.
+                "channel": self.channel_name,
+            },
+        )
+
+    def cancel_ephemeral(self, room_ids: Optional[list[str]] = None):
+        for key in list(self.ephemeral_flushes):
+            if room_ids is None or key[0] in room_ids:
+                _ = self.ephemeral_flushes.pop(key).cancel()
+
+    async def send_message(self, room_id: str, frame: dict[str, Any]):
+        request_id = frame.get("request_id")
+        try:
+            data = await self.create_message(room_id, frame.get("data") or {})
+        except (exceptions.ValidationError, exceptions.PermissionDenied) as error:
+            await self.send(
+                text_data=json.dumps(
+                    {"type": "error", "request_id": request_id, "errors": error.detail}
+                )
+            )
+            return
+
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "send_message_ack",
+                    "request_id": request_id,
+                    "room_id": room_id,
+                    "data": data,
+                }
+            )
+        )
+
+    @database_sync_to_async
+    def create_message(self, room_id: str, data: dict[str, Any]) -> dict[str, Any]:
+        user = cast(User, self.user)
+        if not "can_send_message" in user.hq_permissions:
+            raise exceptions.PermissionDenied()
+
+        request_serializer = ChatRoomMessageCreateRequestSerializer(data=data)
+        _ = request_serializer.is_valid(raise_exception=True)
+
+        sender = (
+            ChatRoomMember.objects.select_related("chat_room", "user__profile")
+            .filter(chat_room__id=room_id, user=user)
+            .first()
+        )
+        if not sender or not sender.active:
+            raise exceptions.PermissionDenied()
+
+        message, _ = ChatMessageManager.create_message(
+            sender.chat_room,
+            sender,
+            cast(dict[str, Any], request_serializer.validated_data),
+        )
+        return ChatRoomMessageDetailSerializer(message).data
+
+    async def send_error(self, request_id: Any, detail: str):
+        await self.send(
+            text_data=json.dumps(
+                {"type": "error", "request_id": request_id, "errors": detail}
+            )
+        )
+
+    async def forward(self, event: dict[str, Any]):
+        """
+        Queues a group event for the socket, reusing its pre-encoded payload.
+        """
+        if self.send_queue is None:
+            return
+
+        payload = event.get("payload")
+        frame = payload.decode() if payload is not None else json.dumps(event)
+        if not self.send_queue.put(event["type"], event.get("key"), frame):
+            await self.close_slow_consumer()
+            return
+        self.frames_ready.set()
+
+    async def write_frames(self):
+        send_queue = cast(SendQueue, self.send_queue)
+        while True:
+            if self.batching and send_queue.batch_window > 0:
+                # Let the rest of the batch arrive.
+                await asyncio.sleep(send_queue.batch_window)
+            while send_queue:
+                if self.batching:
+                    # Queued frames are JSON already; join instead of re-encoding.
+                    frames = ",".join(send_queue.pop_batch())
+                    await self.send(text_data=f"[{frames}]")
+                else:
+                    await self.send(text_data=send_queue.pop())
+            self.frames_ready.clear()
+            if SendQueueMetrics.due():
+                await sync_to_async(SendQueueMetrics.flush, thread_sensitive=False)()
+            _ = await self.frames_ready.wait()
+
+    async def close_slow_consumer(self):
+        # Stop queueing; whatever is still queued is abandoned with the socket.
+        self.send_queue = None
+        if self.writer is not None:
+            _ = self.writer.cancel()
+        SendQueueMetrics.record("disconnected")
+        await sync_to_async(SendQueueMetrics.flush, thread_sensitive=False)()
+        await self.close(code=self.slow_close_code)
+
+    async def chat_message(self, event):
+        """
+        Handles incoming messages sent to the room group.
+        """
+        await self.forward(event)
+
+    async def chat_message_batch(self, event):
+        await self.forward(event)
+
+    async def chat_message_edit(self, event):
+        await self.forward(event)
+
+    async def chat_message_delete(self, event):
+        await self.forward(event)
+
+    async def clear_unread(self, event):
+        await self.forward(event)
+
+    async def presence(self, event):
+        await self.forward(event)
+
+    async def ephemeral(self, event):
+        if event.get("channel") != self.channel_name:
+            await self.forward(event)
+
+    async def unread(self, event):
+        await self.forward(event)
+
+    async def membership(self, event):
+        await self.forward(event)
+
+
+class ChatConsumer(BaseChatConsumer):
+    def __init__(self, *args: Any, **kwargs: Any):
         self.room_id: str
         self.room_group_name: str
-        self.channel_layer: BaseChannelLayer
+        self.is_member = False
         super().__init__(*args, **kwargs)
 
     async def connect(self):
         self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
-        self.room_group_name = f"chat_{self.room_id}"
+        self.room_group_name = ChatMessageManager.group_name(self.room_id)
         self.user = self.scope["user"]
 
         if not self.user.is_authenticated:
             await self.close()
             return
 
-        if not "can_view_chat" in cast(User, self.user).hq_user_data["permissions"]:
+        if not "can_view_chat" in cast(User, self.user).hq_permissions:
             await self.close()
             return
 
-        await self.set_online_status(True)
+        self.is_member = await self.check_membership()
+        if self.is_member:
+            await self.join_presence([self.room_id])
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.join_user_group()
         await self.accept()
 
     async def disconnect(self, code: str):
-        await self.set_online_status(False)
-
+        self.cancel_ephemeral()
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await self.leave_user_group()
+
+        if self.is_member:
+            await self.leave_presence([self.room_id])
 
     async def receive(
         self, text_data: Optional[str] = None, bytes_data: Optional[bytes] = None
     ):
         """
-        When a message is received from WebSocket, send it to the chat room group.
+        Handles `send_message`, `heartbeat` and `ephemeral` frames. Anything
+        else is rejected instead of being relayed to the room.
         """
-        if text_data:
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat_message",
-                    "message": text_data,
-                },
-            )
-
-    @database_sync_to_async
-    def set_online_status(self, online: bool):
         try:
-            chat_member = ChatRoomMember.objects.get(
-                chat_room__id=self.room_id, user=self.user
-            )
-            print("===Before", self.user, self.room_id, chat_member.online)
-            chat_member.online = online
-            chat_member.save(update_fields=["online", "last_updated"])
-            print("===After", self.user, self.room_id, chat_member.online)
-        except ChatRoomMember.DoesNotExist:
-            pass
+            frame = json.loads(text_data or "")
+        except ValueError:
+            frame = None
 
-    async def chat_message(self, event):
-        """
-        Handles incoming messages sent to the room group.
-        """
-        await self.send(text_data=json.dumps(event))
+        if not isinstance(frame, dict):
+            await self.send_error(None, "Frames must be JSON objects.")
+            return
 
-    async def clear_unread(self, event):
-        await self.send(text_data=json.dumps(event))
+        frame = cast(dict[str, Any], frame)
+        frame_type = frame.get("type")
+        if frame_type == "send_message":
+            await self.send_message(self.room_id, frame)
+        elif frame_type == "heartbeat":
+            await self.heartbeat([self.room_id] if self.is_member else [])
+        elif frame_type == "ephemeral":
+            if not self.is_member:
+                await self.send_error(
+                    frame.get("request_id"), "Not a member of this room."
+                )
+                return
+            await self.send_ephemeral(self.room_id, frame)
+        else:
+            await self.send_error(frame.get("request_id"), "Unknown frame type.")
+
+    @database_sync_to_async
+    def check_membership(self) -> bool:
+        return ChatMembershipCache.is_member(self.room_id, self.user.pk)
@@ -0,0 +1,146 @@
+import json
+import uuid
+from typing import Any, Optional, cast
+from channels.sessions import database_sync_to_async
+
+from messaging.consumers.chat import BaseChatConsumer
+from messaging.models.chat import ChatRoomMember
+from messaging.utils.chat import ChatMessageManager
+from users.models.users import User
+
+
+class InboxConsumer(BaseChatConsumer):
+    """
+    One authenticated socket for all of a user's rooms. Clients manage
+    subscriptions with control frames:
+
+        {"type": "subscribe", "room_ids": [...]}
+        {"type": "unsubscribe", "room_ids": [...]}
+        {"type": "heartbeat"}
+        {"type": "send_message", "room_id": ..., "request_id": ..., "data": {...}}
+        {"type": "ephemeral", "room_id": ..., "kind": ..., "value": ...}
+
+    Room events are forwarded with their `room_id`. `unread` and `membership`
+    events arrive for every room, subscribed or not.
+    Connect with `?batch=1` to receive events in batches (see BaseChatConsumer).
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        self.room_ids: set[str] = set()
+        super().__init__(*args, **kwargs)
+
+    async def connect(self):
+        self.user = self.scope["user"]
+
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        if not "can_view_chat" in cast(User, self.user).hq_permissions:
+            await self.close()
+            return
+
+        await self.join_user_group()
+        await self.accept()
+
+    async def disconnect(self, code: str):
+        self.cancel_ephemeral()
+        await self.leave_user_group()
+        _ = await self.leave_rooms(list(self.room_ids))
+
+    async def receive(
+        self, text_data: Optional[str] = None, bytes_data: Optional[bytes] = None
+    ):
+        try:
+            frame = json.loads(text_data or "")
+        except ValueError:
+            frame = None
+
+        if not isinstance(frame, dict):
+            await self.send_error(None, "Frames must be JSON objects.")
+            return
+
+        frame = cast(dict[str, Any], frame)
+        frame_type = frame.get("type")
+        if frame_type == "subscribe":
+            await self.subscribe(self.parse_room_ids(frame))
+        elif frame_type == "unsubscribe":
+            await self.unsubscribe(self.parse_room_ids(frame))
+        elif frame_type == "heartbeat":
+            await self.heartbeat(list(self.room_ids))
+        elif frame_type == "send_message":
+            room_id = str(frame.get("room_id"))
+            if room_id not in self.room_ids:
+                await self.send_error(
+                    frame.get("request_id"), "Not subscribed to this room."
+                )
+                return
+            await self.send_message(room_id, frame)
+        elif frame_type == "ephemeral":
+            room_id = str(frame.get("room_id"))
+            if room_id not in self.room_ids:
+                await self.send_error(
+                    frame.get("request_id"), "Not subscribed to this room."
+                )
+                return
+            await self.send_ephemeral(room_id, frame)
+        else:
+            await self.send_error(frame.get("request_id"), "Unknown frame type.")
+
+    async def subscribe(self, room_ids: list[str]):
+        room_ids = [room_id for room_id in room_ids if room_id not in self.room_ids]
+        subscribed = await self.member_room_ids(room_ids)
+        await self.join_presence(subscribed)
+
+        for room_id in subscribed:
+            await self.channel_layer.group_add(
+                ChatMessageManager.group_name(room_id), self.channel_name
+            )
+        self.room_ids.update(subscribed)
+
+        await self.send(
+            text_data=json.dumps({"type": "subscribed", "room_ids": subscribed})
+        )
+
+    async def unsubscribe(self, room_ids: list[str]):
+        unsubscribed = await self.leave_rooms(room_ids)
+
+        await self.send(
+            text_data=json.dumps({"type": "unsubscribed", "room_ids": unsubscribed})
+        )
+
+    async def leave_rooms(self, room_ids: list[str]) -> list[str]:
+        room_ids = [room_id for room_id in room_ids if room_id in self.room_ids]
+
+        for room_id in room_ids:
+            await self.channel_layer.group_discard(
+                ChatMessageManager.group_name(room_id), self.channel_name
+            )
+        self.room_ids.difference_update(room_ids)
+        self.cancel_ephemeral(room_ids)
+        await self.leave_presence(room_ids)
+        return room_ids
+
+    @database_sync_to_async
+    def member_room_ids(self, room_ids: list[str]) -> list[str]:
+        """
+        Returns the ids of the given rooms the user is a member of.
+        """
+        if not room_ids:
+            return []
+
+        return [
+            str(room_id)
+            for room_id in ChatRoomMember.objects.filter(
+                chat_room__id__in=room_ids, user=self.user
+            ).values_list("chat_room_id", flat=True)
+        ]
+
+    def parse_room_ids(self, frame: dict[str, Any]) -> list[str]:
+        room_ids: list[str] = []
+        for room_id in frame.get("room_ids") or []:
+            try:
+                room_ids.append(str(uuid.UUID(str(room_id))))
+            except ValueError:
+                continue
+        return room_ids
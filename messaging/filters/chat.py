@@ -1,11 +1,72 @@
+from typing import Any, cast
 import django_filters
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, QuerySet
+from django.db.models.functions import Cast
+from django.db.models.lookups import Contains
+from rest_framework import filters
+from rest_framework.views import Request
 
-from messaging.models.chat import ChatRoom
+from messaging.models.chat import MESSAGE_SEARCH_CONFIG, ChatRoomMessage
+
+
+class TrigramContains(Contains):
+    """
+    Case-insensitive substring match written as `text ILIKE '%term%'`, the
+    form the pg_trgm index on the bare column serves; `icontains` wraps both
+    sides in UPPER() and misses it.
+    """
+
+    def get_rhs_op(self, connection: Any, rhs: str) -> str:
+        return f"ILIKE {rhs}"
+
+
+def search_messages(queryset: QuerySet[ChatRoomMessage], term: str):
+    """
+    Filters messages matching `term` through the search_vector GIN index and
+    annotates them with a `rank`. With MESSAGE_SEARCH["TRIGRAM"] enabled,
+    substring matches served by the pg_trgm index are included as well.
+    """
+    query = SearchQuery(term, config=MESSAGE_SEARCH_CONFIG, search_type="websearch")
+    matches = queryset.filter(search_vector=query)
+    if cast(dict[str, Any], settings.MESSAGE_SEARCH).get("TRIGRAM"):
+        # An OR of the two conditions can use neither index; each half of
+        # the union is served by its own.
+        ids = (
+            matches.order_by()
+            .values("pk")
+            .union(
+                queryset.filter(TrigramContains(F("text"), term))
+                .order_by()
+                .values("pk")
+            )
+        )
+        matches = queryset.filter(pk__in=ids)
+
+    # ts_rank returns a real; widening it to double precision keeps the value
+    # exact across the round trip through ChatMessagesSearchPagination cursors.
+    return matches.annotate(
+        rank=Cast(SearchRank(F("search_vector"), query), FloatField())
+    )
+
+
+class ChatRoomMessageSearchFilter(filters.SearchFilter):
+    def filter_queryset(
+        self, request: Request, queryset: QuerySet[ChatRoomMessage], view: Any
+    ):
+        term = str(request.query_params.get(cast(str, self.search_param), "")).strip()
+        if not term:
+            return queryset
+        return search_messages(queryset, term)
 
 
 class ChatRoomMessageFilter(django_filters.FilterSet):
-    text = django_filters.CharFilter(lookup="icontains")
+    text = django_filters.CharFilter(method="filter_text")
 
     class Meta:
-        model = ChatRoom
+        model = ChatRoomMessage
         fields = ["text"]
+
+    def filter_text(self, queryset: QuerySet[ChatRoomMessage], name: str, value: str):
+        return search_messages(queryset, value)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+import uuid
+from typing import Any, Callable, cast
+import msgpack
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand, CommandParser
+from django.utils import timezone
+
+from messaging.consumers.chat import BaseChatConsumer
+from messaging.utils.chat import ChatMessageManager
+
+
+class CountingConsumer(BaseChatConsumer):
+    """
+    Runs the real event handlers but counts frames instead of writing them to
+    a socket.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.frames = 0
+        self.bytes = 0
+
+    async def send(
+        self, text_data: Any = None, bytes_data: Any = None, close: Any = False
+    ):
+        self.frames += 1
+        self.bytes += len(text_data or bytes_data or "")
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures CPU time per delivered message when broadcasting to a room, "
+        "comparing per-receiver json.dumps with a payload encoded once, sent "
+        "one frame per event or batched."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--members", type=int, default=500)
+        parser.add_argument("--messages", type=int, default=200)
+
+    def handle(self, *args: Any, **options: Any):
+        events = [self.sample_event(i) for i in range(options["messages"])]
+
+        self.report(
+            "dict event, json.dumps per receiver",
+            options["members"],
+            events,
+            lambda event: event,
+        )
+        self.report(
+            "pre-encoded payload",
+            options["members"],
+            events,
+            ChatMessageManager.group_event,
+        )
+        self.report(
+            "pre-encoded payload, batched frames",
+            options["members"],
+            events,
+            ChatMessageManager.group_event,
+            batching=True,
+        )
+
+    def sample_event(self, index: int) -> dict[str, Any]:
+        now = timezone.now().isoformat()
+        return {
+            "type": "chat_message",
+            "room_id": str(uuid.uuid4()),
+            "data": {
+                "id": str(uuid.uuid4()),
+                "text": f"message {index} " + "lorem ipsum " * 10,
+                "url": None,
+                "url_content_type": None,
+                "date_added": now,
+                "edited": False,
+                "sequence": index,
+                "sender": {
+                    "id": str(uuid.uuid4()),
+                    "date_added": now,
+                    "active": True,
+                    "user": {
+                        "email": "sender@example.com",
+                        "subscription_payment_paid": True,
+                        "profile": {
+                            "id": str(uuid.uuid4()),
+                            "username": "sender",
+                            "first_name": "Sender",
+                            "last_name": "Example",
+                            "other_names": None,
+                            "bio": "",
+                            "phone_number": None,
+                            "profile_image_url": None,
+                        },
+                    },
+                },
+            },
+        }
+
+    def report(
+        self,
+        label: str,
+        members: int,
+        events: list[dict[str, Any]],
+        build: Callable[[dict[str, Any]], dict[str, Any]],
+        batching: bool = False,
+    ):
+        async def deliver():
+            for receiver in receivers:
+                receiver.writer = asyncio.create_task(receiver.write_frames())
+            for event in events:
+                # The channel layer msgpacks the group message once and every
+                # receiving channel unpacks its own copy.
+                packed = msgpack.packb(build(event))
+                for receiver in receivers:
+                    await receiver.chat_message(msgpack.unpackb(packed))
+                # Let the writers drain their send queues.
+                await asyncio.sleep(0)
+            while any(receiver.send_queue for receiver in receivers):
+                await asyncio.sleep(0.001)
+            for receiver in receivers:
+                _ = cast(asyncio.Task[None], receiver.writer).cancel()
+
+        # Each run gets its own event loop, so the consumers are fresh too.
+        receivers = [CountingConsumer() for _ in range(members)]
+        for receiver in receivers:
+            receiver.batching = batching
+
+        start = time.process_time()
+        async_to_sync(deliver)()
+        elapsed = time.process_time() - start
+
+        delivered = len(events) * members
+        frames = sum(receiver.frames for receiver in receivers)
+        self.stdout.write(
+            f"{label}: {elapsed / delivered * 1_000_000:.2f}us CPU per delivered "
+            f"message ({delivered} deliveries in {frames} frames, {elapsed:.2f}s)"
+        )
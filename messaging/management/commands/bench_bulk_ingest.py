@@ -0,0 +1,76 @@
+import time
+from typing import Any, Callable
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from messaging.models.chat import ChatRoom, ChatRoomMember, ChatRoomType
+from messaging.utils.chat import ChatMessageManager
+from messaging.views.chat import ChatRoomMessageViewSet
+from users.models.users import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares ingesting messages through one request per message (plus the "
+        "outbox worker) with the bulk endpoint. All data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--members", type=int, default=50)
+        parser.add_argument("--messages", type=int, default=2000)
+
+    def handle(self, *args: Any, **options: Any):
+        with transaction.atomic():
+            self.run(options["members"], options["messages"])
+            transaction.set_rollback(True)
+
+    def run(self, member_count: int, message_count: int):
+        user = User.objects.create_user(email="bench-ingest@example.com")
+        user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message"],
+            "subscription_payment_paid": True,
+        }
+        user.save()
+        room = ChatRoom.objects.create(name="bench", type=ChatRoomType.GroupChat)
+        _ = ChatRoomMember.objects.create(chat_room=room, user=user)
+        _ = ChatRoomMember.objects.bulk_create(
+            [ChatRoomMember(chat_room=room) for _ in range(member_count - 1)]
+        )
+
+        factory = APIRequestFactory()
+        create = ChatRoomMessageViewSet.as_view({"post": "create"})
+        bulk_create = ChatRoomMessageViewSet.as_view({"post": "bulk_create"})
+
+        def send_one_by_one():
+            for i in range(message_count):
+                request = factory.post("/", {"text": f"message {i}"}, format="json")
+                force_authenticate(request, user)
+                response = create(request, chat_pk=str(room.pk))
+                assert response.status_code == 201, response.data
+            while ChatMessageManager.process_outbox():
+                pass
+
+        def send_in_bulk():
+            request = factory.post(
+                "/",
+                {"messages": [{"text": f"message {i}"} for i in range(message_count)]},
+                format="json",
+            )
+            force_authenticate(request, user)
+            response = bulk_create(request, chat_pk=str(room.pk))
+            assert response.status_code == 201, response.data
+
+        self.stdout.write(f"{member_count} members, {message_count} messages")
+        single = self.report("one request per message", message_count, send_one_by_one)
+        bulk = self.report("bulk endpoint", message_count, send_in_bulk)
+        self.stdout.write(f"speedup: {single / bulk:.1f}x")
+
+    def report(self, label: str, message_count: int, run: Callable[[], None]) -> float:
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{label}: {elapsed:.2f}s, {message_count / elapsed:.0f} messages/s"
+        )
+        return elapsed
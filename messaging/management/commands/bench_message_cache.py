@@ -0,0 +1,108 @@
+import random
+import time
+from typing import Any
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from messaging.models.chat import (
+    ChatRoom,
+    ChatRoomMember,
+    ChatRoomMessage,
+    ChatRoomType,
+)
+from messaging.utils.recent import RecentMessagesCache
+from messaging.views.chat import ChatRoomMessageViewSet
+from users.models.users import Profile, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares newest-page reads of ChatRoomMessageViewSet.list with the "
+        "recent messages cache off and with the configured backend. Most reads "
+        "go to a few hot rooms. All data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--rooms", type=int, default=50)
+        parser.add_argument("--messages", type=int, default=200)
+        parser.add_argument("--reads", type=int, default=2000)
+        parser.add_argument("--page-size", type=int, default=20)
+
+    def handle(self, *args: Any, **options: Any):
+        with transaction.atomic():
+            self.run(
+                options["rooms"],
+                options["messages"],
+                options["reads"],
+                options["page_size"],
+            )
+            transaction.set_rollback(True)
+
+    def run(self, room_count: int, message_count: int, reads: int, page_size: int):
+        user = User.objects.create_user(email="bench-cache@example.com")
+        user.hq_user_data = {
+            "permissions": ["can_view_chat"],
+            "subscription_payment_paid": True,
+        }
+        user.save()
+        _ = Profile.objects.create(user=user, username="bench-cache")
+
+        rooms: list[ChatRoom] = []
+        for _ in range(room_count):
+            room = ChatRoom.objects.create(name="bench", type=ChatRoomType.GroupChat)
+            member = ChatRoomMember.objects.create(chat_room=room, user=user)
+            first_sequence = ChatRoom.allocate_sequence(room.pk, message_count)
+            _ = ChatRoomMessage.objects.bulk_create(
+                [
+                    ChatRoomMessage(
+                        chat_room=room,
+                        sender=member,
+                        text=f"message {i}",
+                        sequence=first_sequence + i,
+                        change_sequence=first_sequence + i,
+                    )
+                    for i in range(message_count)
+                ],
+                batch_size=1000,
+            )
+            rooms.append(room)
+
+        # 80% of reads go to the hottest 20% of rooms.
+        hot = rooms[: max(1, room_count // 5)]
+        random.seed(0)
+        targets = [
+            random.choice(hot if random.random() < 0.8 else rooms) for _ in range(reads)
+        ]
+
+        factory = APIRequestFactory()
+        view = ChatRoomMessageViewSet.as_view({"get": "list"})
+
+        def read_all():
+            start = time.perf_counter()
+            for room in targets:
+                request = factory.get("/", {"page_size": page_size})
+                force_authenticate(request, user)
+                response = view(request, chat_pk=str(room.pk))
+                assert response.status_code == 200, response.data
+                response.render()
+            return time.perf_counter() - start
+
+        self.stdout.write(
+            f"{room_count} rooms, {message_count} messages each, {reads} reads"
+        )
+        with override_settings(MESSAGE_CACHE={"BACKEND": None}):
+            elapsed = read_all()
+        self.stdout.write(f"cache off: {reads / elapsed:.0f} reads/s")
+
+        _ = RecentMessagesCache.stats(reset=True)
+        elapsed = read_all()
+        stats = RecentMessagesCache.stats(reset=True)
+        self.stdout.write(
+            f"{settings.MESSAGE_CACHE['BACKEND']}: {reads / elapsed:.0f} reads/s, "
+            f"hit rate {stats['hit_rate']:.1%}"
+            if stats
+            else "cache is turned off"
+        )
@@ -0,0 +1,132 @@
+import random
+import time
+from typing import Any, Callable
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.test.utils import override_settings
+
+from messaging.filters.chat import search_messages
+from messaging.models.chat import (
+    ChatRoom,
+    ChatRoomMember,
+    ChatRoomMessage,
+    ChatRoomType,
+)
+
+WORDS = (
+    "hello meeting tomorrow lunch project deadline invoice report budget design "
+    "review coffee weekend travel flight hotel birthday party football match "
+    "release deploy server database backup holiday schedule call notes draft"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a synthetic message corpus and compares ILIKE scans with the "
+        "full-text and trigram search paths. All data is rolled back afterwards "
+        "unless --keep is given."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--messages", type=int, default=2_000_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--keep", action="store_true")
+
+    def handle(self, *args: Any, **options: Any):
+        with transaction.atomic():
+            room = self.generate_corpus(options["messages"])
+            self.run(room, options["repeat"])
+            if not options["keep"]:
+                transaction.set_rollback(True)
+
+    def generate_corpus(self, message_count: int):
+        room = ChatRoom.objects.create(name="bench", type=ChatRoomType.GroupChat)
+        member = ChatRoomMember.objects.create(chat_room=room)
+        first_sequence = ChatRoom.allocate_sequence(room.pk, message_count)
+
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {ChatRoomMessage._meta.db_table}
+                    (id, chat_room_id, sender_id, text, date_added, last_updated,
+                     sequence, change_sequence)
+                SELECT gen_random_uuid(), %s, %s,
+                    array_to_string(ARRAY(
+                        SELECT (%s::text[])[1 + floor(random() * %s)::int]
+                        FROM generate_series(1, 8) WHERE g IS NOT NULL
+                    ), ' '),
+                    now() - g * interval '1 second', now(),
+                    %s + g - 1, %s + g - 1
+                FROM generate_series(1, %s) g
+                """,
+                [
+                    room.pk,
+                    member.pk,
+                    WORDS,
+                    len(WORDS),
+                    first_sequence,
+                    first_sequence,
+                    message_count,
+                ],
+            )
+            cursor.execute(f"ANALYZE {ChatRoomMessage._meta.db_table}")
+
+        self.stdout.write(
+            f"generated {message_count} messages in {time.perf_counter() - start:.1f}s"
+        )
+        return room
+
+    def run(self, room: ChatRoom, repeat: int):
+        messages = ChatRoomMessage.objects.filter(chat_room=room)
+        terms = random.sample(WORDS, k=min(repeat, len(WORDS)))
+
+        self.report(
+            "ILIKE scan",
+            terms,
+            lambda term: messages.filter(text__icontains=term).order_by("-date_added"),
+        )
+        with override_settings(MESSAGE_SEARCH={"TRIGRAM": False}):
+            self.report(
+                "full-text",
+                terms,
+                lambda term: search_messages(messages, term).order_by("-rank", "-id"),
+            )
+        if self.has_trigram_index():
+            with override_settings(MESSAGE_SEARCH={"TRIGRAM": True}):
+                self.report(
+                    "full-text + trigram",
+                    terms,
+                    lambda term: search_messages(messages, term).order_by(
+                        "-rank", "-id"
+                    ),
+                )
+        else:
+            self.stdout.write("trigram: pg_trgm index not installed, skipped")
+
+    def report(
+        self,
+        label: str,
+        terms: list[str],
+        build: Callable[[str], QuerySet[ChatRoomMessage]],
+    ):
+        timings: list[float] = []
+        for term in terms:
+            start = time.perf_counter()
+            _ = list(build(term)[:20])
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        self.stdout.write(
+            f"{label}: median {timings[len(timings) // 2] * 1000:.1f}ms, "
+            f"max {timings[-1] * 1000:.1f}ms over {len(timings)} queries"
+        )
+
+    def has_trigram_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_indexes WHERE indexname = %s",
+                ["messaging_chatroommessage_text_trgm"],
+            )
+            return cursor.fetchone() is not None
@@ -0,0 +1,95 @@
+import time
+from typing import Any
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import connection, transaction
+
+from messaging.models.chat import (
+    ChatRoom,
+    ChatRoomMember,
+    ChatRoomMessage,
+    ChatRoomMessageReadReciepts,
+    ChatRoomType,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares storage and clear_unread latency of per-message read receipts "
+        "against per-member read watermarks on a synthetic room. "
+        "All data is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--members", type=int, default=200)
+        parser.add_argument("--messages", type=int, default=2000)
+
+    def handle(self, *args: Any, **options: Any):
+        with transaction.atomic():
+            self.run(options["members"], options["messages"])
+            transaction.set_rollback(True)
+
+    def run(self, member_count: int, message_count: int):
+        room = ChatRoom.objects.create(name="bench", type=ChatRoomType.GroupChat)
+        members = ChatRoomMember.objects.bulk_create(
+            [ChatRoomMember(chat_room=room) for _ in range(member_count)]
+        )
+        first_sequence = ChatRoom.allocate_sequence(room.pk, message_count)
+        _ = ChatRoomMessage.objects.bulk_create(
+            [
+                ChatRoomMessage(
+                    chat_room=room,
+                    sender=members[0],
+                    text=f"message {i}",
+                    sequence=first_sequence + i,
+                    change_sequence=first_sequence + i,
+                )
+                for i in range(message_count)
+            ],
+            batch_size=1000,
+        )
+        latest = ChatRoomMessage.objects.filter(chat_room=room).latest("date_added")
+
+        receipts_size = self.table_size(ChatRoomMessageReadReciepts)
+        start = time.perf_counter()
+        for member in members:
+            _ = ChatRoomMessageReadReciepts.objects.bulk_create(
+                [
+                    ChatRoomMessageReadReciepts(message=message, member=member)
+                    for message in ChatRoomMessage.objects.filter(chat_room=room)
+                ],
+                batch_size=1000,
+            )
+        receipts_elapsed = time.perf_counter() - start
+        receipts_rows = ChatRoomMessageReadReciepts.objects.filter(
+            member__chat_room=room
+        ).count()
+        receipts_size = self.table_size(ChatRoomMessageReadReciepts) - receipts_size
+
+        watermark_size = self.table_size(ChatRoomMember)
+        start = time.perf_counter()
+        for member in members:
+            member.mark_read(latest)
+        watermark_elapsed = time.perf_counter() - start
+        # Updated rows leave dead tuples behind until vacuumed, so this is an
+        # upper bound on what the watermarks cost.
+        watermark_size = self.table_size(ChatRoomMember) - watermark_size
+        watermark_rows = ChatRoomMember.objects.filter(
+            chat_room=room, last_read_at__isnull=False
+        ).count()
+
+        self.stdout.write(f"{member_count} members, {message_count} messages")
+        self.stdout.write(
+            f"receipts:   {receipts_rows} rows, {receipts_size} bytes, "
+            f"clear_unread {receipts_elapsed / member_count * 1000:.2f}ms/member"
+        )
+        self.stdout.write(
+            f"watermarks: {watermark_rows} rows, {watermark_size} bytes, "
+            f"clear_unread {watermark_elapsed / member_count * 1000:.2f}ms/member"
+        )
+
+    def table_size(self, model: Any) -> int:
+        if connection.vendor != "postgresql":
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_total_relation_size(%s)", [model._meta.db_table])
+            return cursor.fetchone()[0]
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+import uuid
+from types import SimpleNamespace
+from typing import Any
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand, CommandParser
+
+from messaging.consumers.chat import ChatConsumer
+from messaging.utils.chat import ChatMessageManager
+
+
+class CountingChannelLayer(InMemoryChannelLayer):
+    """
+    In-memory layer that counts group sends and the deliveries they fan out to.
+    """
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.group_sends = 0
+        self.deliveries = 0
+
+    async def group_send(self, group: str, message: dict[str, Any]):
+        self.group_sends += 1
+        self.deliveries += len(self.groups.get(group, {}))
+        # Nobody reads the channels, so skip queueing the copies.
+
+
+class TypingConsumer(ChatConsumer):
+    """
+    Joined room member whose outgoing frames are counted instead of sent.
+    """
+
+    def __init__(self, room_id: str, channel_layer: CountingChannelLayer):
+        super().__init__()
+        self.room_id = room_id
+        self.room_group_name = ChatMessageManager.group_name(room_id)
+        self.user = SimpleNamespace(pk=uuid.uuid4())
+        self.channel_layer = channel_layer
+        self.channel_name = f"typing.{uuid.uuid4().hex}"
+        self.is_member = True
+        self.frames = 0
+
+    async def send(
+        self, text_data: Any = None, bytes_data: Any = None, close: Any = False
+    ):
+        self.frames += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates many members typing in one room and compares the inbound "
+        "keystroke frames with the channel layer traffic left after rate "
+        "limiting and coalescing."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--members", type=int, default=200)
+        parser.add_argument("--typists", type=int, default=50)
+        parser.add_argument(
+            "--rate", type=float, default=15, help="Keystrokes per second per typist."
+        )
+        parser.add_argument("--seconds", type=float, default=3)
+
+    def handle(self, *args: Any, **options: Any):
+        room_id = str(uuid.uuid4())
+        layer = CountingChannelLayer()
+        consumers = [TypingConsumer(room_id, layer) for _ in range(options["members"])]
+
+        async def run() -> int:
+            for consumer in consumers:
+                await layer.group_add(consumer.room_group_name, consumer.channel_name)
+            typists = consumers[: options["typists"]]
+            counts = await asyncio.gather(
+                *(
+                    self.type(consumer, options["rate"], options["seconds"])
+                    for consumer in typists
+                )
+            )
+            # Let deferred flushes go out before counting.
+            await asyncio.sleep(
+                max(consumer.ephemeral_coalescer.interval for consumer in typists)
+            )
+            return sum(counts)
+
+        start = time.perf_counter()
+        inbound = async_to_sync(run)()
+        elapsed = time.perf_counter() - start
+
+        members = options["members"]
+        self.stdout.write(
+            f"inbound: {inbound} frames ({inbound / elapsed:.0f}/s), "
+            f"{inbound * members} deliveries if relayed one by one"
+        )
+        self.stdout.write(
+            f"coalesced: {layer.group_sends} group sends "
+            f"({layer.group_sends / elapsed:.0f}/s), {layer.deliveries} deliveries "
+            f"({inbound / max(layer.group_sends, 1):.1f}x fewer)"
+        )
+
+    async def type(self, consumer: TypingConsumer, rate: float, seconds: float):
+        keystroke = json.dumps({"type": "ephemeral", "kind": "typing", "value": True})
+        stopped = json.dumps({"type": "ephemeral", "kind": "typing", "value": False})
+
+        sent = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            await consumer.receive(text_data=keystroke)
+            sent += 1
+            await asyncio.sleep(1 / rate)
+        await consumer.receive(text_data=stopped)
+        return sent + 1
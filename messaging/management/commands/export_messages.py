@@ -0,0 +1,64 @@
+import sys
+from datetime import datetime
+from typing import Any, BinaryIO, Optional
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from messaging.models.chat import ChatRoom
+from messaging.utils.export import ChatHistoryExporter
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams a chat room's messages, optionally within a date range, to a "
+        "NDJSON or CSV file."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("room_id")
+        parser.add_argument(
+            "--format",
+            dest="file_format",
+            choices=list(ChatHistoryExporter.CONTENT_TYPES),
+            default="ndjson",
+        )
+        parser.add_argument("--since", help="ISO 8601 date or datetime, inclusive.")
+        parser.add_argument("--until", help="ISO 8601 date or datetime, exclusive.")
+        parser.add_argument(
+            "--output", "-o", default="-", help='Output file, or "-" for stdout.'
+        )
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args: Any, **options: Any):
+        if not ChatRoom.objects.filter(pk=options["room_id"]).exists():
+            raise CommandError("Chat room not found.")
+
+        chunks = ChatHistoryExporter.export(
+            options["room_id"],
+            options["file_format"],
+            since=self.parse_datetime(options["since"]),
+            until=self.parse_datetime(options["until"]),
+            chunk_size=options["chunk_size"],
+        )
+
+        if options["output"] == "-":
+            self.write(chunks, sys.stdout.buffer)
+            sys.stdout.flush()
+        else:
+            with open(options["output"], "wb") as file:
+                self.write(chunks, file)
+
+    def write(self, chunks: Any, file: BinaryIO):
+        for chunk in chunks:
+            _ = file.write(chunk)
+
+    def parse_datetime(self, value: Optional[str]) -> Optional[datetime]:
+        if value is None:
+            return None
+        parsed = parse_datetime(value) or parse_datetime(f"{value}T00:00:00")
+        if parsed is None:
+            raise CommandError(f"Invalid date: {value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
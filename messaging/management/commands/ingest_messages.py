@@ -0,0 +1,80 @@
+import json
+import sys
+from itertools import islice
+from typing import Any, Iterator, TextIO, cast
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from messaging.models.chat import ChatRoomMember
+from messaging.serializers.chat import ChatRoomMessageCreateRequestSerializer
+from messaging.utils.chat import ChatMessageManager
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports messages into a chat room from a JSON lines file, one message "
+        "object (text, url, url_content_type, client_key) per line. Messages are "
+        "validated and stored in chunks with one broadcast per chunk."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("room_id")
+        parser.add_argument(
+            "sender_email", help="Email of the room member sending the messages."
+        )
+        parser.add_argument("path", help='JSON lines file, or "-" for stdin.')
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args: Any, **options: Any):
+        sender = (
+            ChatRoomMember.objects.select_related("chat_room")
+            .filter(
+                chat_room__id=options["room_id"],
+                user__email=options["sender_email"],
+            )
+            .first()
+        )
+        if sender is None:
+            raise CommandError("The sender is not a member of this chat room.")
+
+        if options["path"] == "-":
+            created, skipped = self.ingest(sender, sys.stdin, options["chunk_size"])
+        else:
+            with open(options["path"]) as file:
+                created, skipped = self.ingest(sender, file, options["chunk_size"])
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Created {created} messages, skipped {skipped}.")
+        )
+
+    def ingest(
+        self, sender: ChatRoomMember, file: TextIO, chunk_size: int
+    ) -> tuple[int, int]:
+        created = skipped = 0
+        lines = self.read_lines(file)
+        while chunk := list(islice(lines, chunk_size)):
+            serializer = ChatRoomMessageCreateRequestSerializer(
+                data=[data for _, data in chunk], many=True
+            )
+            if not serializer.is_valid():
+                errors = cast(list[dict[str, Any]], serializer.errors)
+                line, error = next(
+                    (line, error) for (line, _), error in zip(chunk, errors) if error
+                )
+                raise CommandError(f"Line {line}: {error}")
+
+            messages_data = cast(list[dict[str, Any]], serializer.validated_data)
+            messages = ChatMessageManager.bulk_create_messages(
+                sender.chat_room, sender, messages_data
+            )
+            created += len(messages)
+            skipped += len(messages_data) - len(messages)
+        return created, skipped
+
+    def read_lines(self, file: TextIO) -> Iterator[tuple[int, Any]]:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as error:
+                raise CommandError(f"Line {line_number}: {error}")
@@ -0,0 +1,28 @@
+from typing import Any
+from django.core.management.base import BaseCommand, CommandParser
+
+from messaging.utils.recent import RecentMessagesCache
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints the hit rate of the recent messages cache. Counts are shared "
+        "across processes with the Redis backend and per process otherwise."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the counters after reading."
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        stats = RecentMessagesCache.stats(reset=options["reset"])
+        if stats is None:
+            self.stdout.write("The recent messages cache is turned off.")
+            return
+
+        hit_rate = stats["hit_rate"]
+        self.stdout.write(
+            f"hits: {stats['hits']}, misses: {stats['misses']}, hit rate: "
+            + ("n/a" if hit_rate is None else f"{hit_rate:.1%}")
+        )
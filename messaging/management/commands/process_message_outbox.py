@@ -0,0 +1,56 @@
+import logging
+import time
+from typing import Any
+from django.core.management.base import BaseCommand, CommandParser
+
+from messaging.utils.chat import ChatMessageManager
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Drains the message outbox: applies read-state updates and broadcasts "
+        "new messages to their rooms in batches."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0.2,
+            help="Seconds to wait when the outbox is empty.",
+        )
+        parser.add_argument(
+            "--retry-interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait after a failed batch before retrying.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Drain the outbox and exit instead of polling.",
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        processed = 0
+        while True:
+            try:
+                count = ChatMessageManager.process_outbox(options["batch_size"])
+            except Exception:
+                logger.exception("Processing the message outbox failed, retrying")
+                if options["once"]:
+                    raise
+                time.sleep(options["retry_interval"])
+                continue
+
+            processed += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} messages."))
@@ -0,0 +1,53 @@
+from typing import Any
+from django.core.management.base import BaseCommand, CommandParser
+from django.db.models import Count, IntegerField, OuterRef, QuerySet, Subquery
+from django.db.models.functions import Coalesce
+
+from messaging.models.chat import ChatRoomMember, ChatRoomMessage
+
+
+def count_subquery(messages: QuerySet[ChatRoomMessage]):
+    return Coalesce(
+        Subquery(
+            messages.order_by()
+            .values("chat_room")
+            .annotate(count=Count("id"))
+            .values("count"),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = "Recomputes ChatRoomMember.unread_count from the members' read watermarks."
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument(
+            "--room",
+            dest="room_id",
+            default=None,
+            help="Only rebuild the counters of members of this chat room.",
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        members = ChatRoomMember.objects.all()
+        if options["room_id"]:
+            members = members.filter(chat_room__id=options["room_id"])
+
+        unread = ChatRoomMessage.objects.filter(
+            chat_room=OuterRef("chat_room")
+        ).exclude(sender=OuterRef("pk"))
+
+        updated = members.filter(last_read_at__isnull=True).update(
+            unread_count=count_subquery(unread)
+        )
+        updated += members.filter(last_read_at__isnull=False).update(
+            unread_count=count_subquery(
+                unread.filter(date_added__gt=OuterRef("last_read_at"))
+            )
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt unread counters for {updated} members.")
+        )
@@ -0,0 +1,25 @@
+from typing import Any
+from django.core.management.base import BaseCommand, CommandParser
+
+from messaging.utils.sendqueue import SendQueueMetrics
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints how many socket frames were queued, collapsed and dropped, the "
+        "deepest queue seen and how many slow sockets were closed. Workers add "
+        "their counts to the default cache every few seconds."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the counters after reading."
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        stats = SendQueueMetrics.stats(reset=options["reset"])
+        self.stdout.write(
+            f"queued: {stats['queued']}, collapsed: {stats['collapsed']}, "
+            f"dropped: {stats['dropped']}, max depth: {stats['max_depth']}, "
+            f"slow sockets closed: {stats['disconnected']}"
+        )
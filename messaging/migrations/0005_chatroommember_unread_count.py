@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0004_chatroommember_last_updated_chatroommember_online'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroommember',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='chatroommember',
+            index=models.Index(fields=['user', 'chat_room'], name='messaging_c_user_id_e98151_idx'),
+        ),
+    ]
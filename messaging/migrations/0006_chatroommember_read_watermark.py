@@ -0,0 +1,100 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def compact_read_receipts(apps, schema_editor):
+    """
+    Sets each member's watermark to the newest message before the first
+    message they have no receipt for, so nothing unread becomes read. Receipts
+    for messages after that gap cannot be kept by a watermark and are dropped;
+    unread counters are recomputed to match.
+    """
+    ChatRoomMember = apps.get_model("messaging", "ChatRoomMember")
+    ChatRoomMessage = apps.get_model("messaging", "ChatRoomMessage")
+    ChatRoomMessageReadReciepts = apps.get_model(
+        "messaging", "ChatRoomMessageReadReciepts"
+    )
+
+    members = ChatRoomMember.objects.filter(
+        pk__in=ChatRoomMessageReadReciepts.objects.values("member")
+    )
+    for member in members.iterator():
+        messages = ChatRoomMessage.objects.filter(chat_room_id=member.chat_room_id)
+        first_unread = (
+            messages.exclude(sender=member)
+            .exclude(
+                pk__in=ChatRoomMessageReadReciepts.objects.filter(
+                    member=member
+                ).values("message")
+            )
+            .order_by("date_added")
+            .values_list("date_added", flat=True)
+            .first()
+        )
+        if first_unread is not None:
+            messages = messages.filter(date_added__lt=first_unread)
+        last_read = messages.order_by("-date_added").first()
+        if last_read is None:
+            continue
+
+        member.last_read_message = last_read
+        member.last_read_at = last_read.date_added
+        member.unread_count = (
+            ChatRoomMessage.objects.filter(
+                chat_room_id=member.chat_room_id, date_added__gt=last_read.date_added
+            )
+            .exclude(sender=member)
+            .count()
+        )
+        member.save(update_fields=["last_read_message", "last_read_at", "unread_count"])
+    ChatRoomMessageReadReciepts.objects.all().delete()
+
+
+def expand_read_watermarks(apps, schema_editor):
+    ChatRoomMember = apps.get_model("messaging", "ChatRoomMember")
+    ChatRoomMessage = apps.get_model("messaging", "ChatRoomMessage")
+    ChatRoomMessageReadReciepts = apps.get_model(
+        "messaging", "ChatRoomMessageReadReciepts"
+    )
+
+    for member in ChatRoomMember.objects.filter(last_read_at__isnull=False).iterator():
+        messages = ChatRoomMessage.objects.filter(
+            chat_room_id=member.chat_room_id, date_added__lte=member.last_read_at
+        ).values_list("pk", flat=True)
+        ChatRoomMessageReadReciepts.objects.bulk_create(
+            [
+                ChatRoomMessageReadReciepts(message_id=message_id, member=member)
+                for message_id in messages.iterator()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0005_chatroommember_unread_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroommember',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroommember',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='messaging.chatroommessage'),
+        ),
+        migrations.AddIndex(
+            model_name='chatroommember',
+            index=models.Index(fields=['chat_room', 'last_read_at'], name='messaging_c_chat_ro_1b85c9_idx'),
+        ),
+        migrations.RunPython(compact_read_receipts, expand_read_watermarks),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('messaging', '0006_chatroommember_read_watermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatroommessage',
+            index=models.Index(fields=['chat_room', 'date_added', 'id'], name='messaging_c_chat_ro_a3544b_idx'),
+        ),
+    ]
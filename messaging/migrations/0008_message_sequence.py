@@ -0,0 +1,108 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:52
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def number_messages(apps, schema_editor):
+    ChatRoom = apps.get_model("messaging", "ChatRoom")
+    ChatRoomMessage = apps.get_model("messaging", "ChatRoomMessage")
+
+    for chat_room in ChatRoom.objects.iterator():
+        messages = list(
+            ChatRoomMessage.objects.filter(chat_room=chat_room).annotate(
+                row_number=Window(
+                    RowNumber(), order_by=[F("date_added").asc(), F("id").asc()]
+                )
+            )
+        )
+        for message in messages:
+            message.sequence = message.row_number
+            message.change_sequence = message.row_number
+        ChatRoomMessage.objects.bulk_update(
+            messages, ["sequence", "change_sequence"], batch_size=1000
+        )
+        chat_room.sequence = len(messages)
+        chat_room.save(update_fields=["sequence"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0007_chatroommessage_history_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatRoomMessageTombstone",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("message_id", models.UUIDField()),
+                ("sequence", models.PositiveBigIntegerField()),
+                ("date_added", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="sequence",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="chatroommessage",
+            name="change_sequence",
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="chatroommessage",
+            name="sequence",
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.RunPython(number_messages, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="chatroommessage",
+            name="change_sequence",
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name="chatroommessage",
+            name="sequence",
+            field=models.PositiveBigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name="chatroommessage",
+            index=models.Index(
+                fields=["chat_room", "change_sequence"],
+                name="messaging_c_chat_ro_9f120c_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatroommessage",
+            constraint=models.UniqueConstraint(
+                fields=("chat_room", "sequence"), name="unique_message_sequence"
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatroommessagetombstone",
+            name="chat_room",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, to="messaging.chatroom"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="chatroommessagetombstone",
+            constraint=models.UniqueConstraint(
+                fields=("chat_room", "sequence"), name="unique_tombstone_sequence"
+            ),
+        ),
+    ]
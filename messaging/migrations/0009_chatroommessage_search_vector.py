@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:55
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0008_message_sequence"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroommessage",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.SearchVector(
+                    "text", config="english"
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chatroommessage",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="messaging_c_search__3732b0_gin"
+            ),
+        ),
+    ]
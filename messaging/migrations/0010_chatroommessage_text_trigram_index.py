@@ -0,0 +1,34 @@
+from django.db import migrations
+
+TRIGRAM_INDEX_NAME = "messaging_chatroommessage_text_trgm"
+
+
+def create_trigram_index(apps, schema_editor):
+    # pg_trgm is optional: it ships with postgresql-contrib, which not every
+    # deployment installs. Without it message search falls back to full-text
+    # matching only.
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME} "
+        "ON messaging_chatroommessage USING gin (text gin_trgm_ops)"
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    schema_editor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0009_chatroommessage_search_vector"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0010_chatroommessage_text_trigram_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChatRoomMessageOutbox",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("date_added", models.DateTimeField(auto_now_add=True)),
+                (
+                    "message",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="messaging.chatroommessage",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0011_message_outbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroommessage",
+            name="client_key",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="chatroommessage",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("client_key__isnull", False)),
+                fields=("chat_room", "sender", "client_key"),
+                name="unique_message_client_key",
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce, Left
+
+
+def fill_last_message(apps, schema_editor):
+    ChatRoom = apps.get_model("messaging", "ChatRoom")
+    ChatRoomMember = apps.get_model("messaging", "ChatRoomMember")
+    ChatRoomMessage = apps.get_model("messaging", "ChatRoomMessage")
+
+    latest = ChatRoomMessage.objects.filter(chat_room=OuterRef("pk")).order_by(
+        "-date_added", "-id"
+    )
+    ChatRoom.objects.update(
+        last_message=Subquery(latest.values("id")[:1]),
+        last_message_at=Subquery(latest.values("date_added")[:1]),
+        last_message_preview=Subquery(
+            latest.annotate(preview=Left("text", 100)).values("preview")[:1]
+        ),
+    )
+    ChatRoomMember.objects.update(
+        last_activity_at=Coalesce(
+            Subquery(
+                ChatRoom.objects.filter(pk=OuterRef("chat_room")).values(
+                    "last_message_at"
+                )[:1]
+            ),
+            "date_added",
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messaging", "0012_message_client_key"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="messaging.chatroommessage",
+            ),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatroom",
+            name="last_message_preview",
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name="chatroommember",
+            name="last_activity_at",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(fill_last_message, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="chatroommember",
+            index=models.Index(
+                models.F("user"),
+                models.OrderBy(models.F("last_activity_at"), descending=True),
+                models.OrderBy(models.F("chat_room"), descending=True),
+                name="member_room_activity_idx",
+            ),
+        ),
+    ]
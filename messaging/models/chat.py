@@ -1,9 +1,18 @@
 import uuid
+from typing import Any, Optional
 from channels.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
 
 User = get_user_model()
 
+MESSAGE_PREVIEW_LENGTH = 100
+MESSAGE_SEARCH_CONFIG = "english"
+
 
 class ChatRoomType(models.TextChoices):
     Pair = "pair"
@@ -19,6 +28,69 @@ class ChatRoom(models.Model):
         max_length=40, choices=ChatRoomType.choices, default=ChatRoomType.Pair
     )
     date_added = models.DateTimeField(auto_now_add=True)
+    # Last sequence number handed out to an insert, edit or delete in this room.
+    sequence = models.PositiveBigIntegerField(default=0)
+    # Newest message, kept current in the transactions that insert, edit or
+    # delete messages so room lists need no per-room message lookups.
+    last_message = models.ForeignKey(
+        "ChatRoomMessage",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message_preview = models.CharField(
+        max_length=MESSAGE_PREVIEW_LENGTH, null=True, blank=True
+    )
+
+    @classmethod
+    def allocate_sequence(cls, chat_room_id: uuid.UUID, count: int = 1) -> int:
+        """
+        Reserves `count` consecutive sequence numbers and returns the first one.
+        Must run inside the transaction that writes the sequenced rows, so a
+        rollback releases the numbers again and the stream stays gap-free.
+        """
+        _ = cls.objects.filter(pk=chat_room_id).update(
+            sequence=models.F("sequence") + count
+        )
+        last = cls.objects.values_list("sequence", flat=True).get(pk=chat_room_id)
+        return last - count + 1
+
+    @classmethod
+    def set_last_message(cls, message: "ChatRoomMessage"):
+        """
+        Records `message` as the newest in its room. Callers hold the room row
+        lock taken by `allocate_sequence`, so inserts are recorded in order.
+        The sender's room moves up in their activity order right away; the
+        outbox worker does the same for the other members.
+        """
+        _ = cls.objects.filter(pk=message.chat_room_id).update(
+            last_message=message,
+            last_message_at=message.date_added,
+            last_message_preview=message.preview(),
+        )
+        _ = ChatRoomMember.objects.filter(pk=message.sender_id).update(
+            last_activity_at=Greatest(F("last_activity_at"), Value(message.date_added))
+        )
+
+    @classmethod
+    def refresh_last_message(cls, chat_room_id: uuid.UUID):
+        """
+        Recomputes the newest message after the previous one was deleted.
+        """
+        latest = (
+            ChatRoomMessage.objects.filter(chat_room=chat_room_id)
+            .order_by("-date_added", "-id")
+            .only("id", "date_added", "text", "chat_room_id", "sender_id")
+            .first()
+        )
+        if latest is not None:
+            cls.set_last_message(latest)
+        else:
+            _ = cls.objects.filter(pk=chat_room_id).update(
+                last_message=None, last_message_at=None, last_message_preview=None
+            )
 
 
 class ChatRoomMember(models.Model):
@@ -26,9 +98,54 @@ class ChatRoomMember(models.Model):
     chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     active = models.BooleanField(default=True)
+    # Superseded by PresenceManager; no longer written to.
     online = models.BooleanField(default=False, null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Read watermark: every message in the room up to and including
+    # last_read_message (dated last_read_at) counts as read by this member.
+    last_read_message = models.ForeignKey(
+        "ChatRoomMessage",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    last_read_at = models.DateTimeField(null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(null=True, auto_now=True)
+    # Time of the newest message in the room (or of joining), set for the
+    # sender with the message and copied to every other member by the outbox
+    # worker, so "my rooms by recent activity" is a single scan of the
+    # (user, last_activity_at, chat_room) index.
+    last_activity_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "chat_room"]),
+            models.Index(fields=["chat_room", "last_read_at"]),
+            models.Index(
+                F("user"),
+                F("last_activity_at").desc(),
+                F("chat_room").desc(),
+                name="member_room_activity_idx",
+            ),
+        ]
+
+    def mark_read(self, message: Optional["ChatRoomMessage"]):
+        if message and (
+            self.last_read_at is None or self.last_read_at < message.date_added
+        ):
+            self.last_read_message = message
+            self.last_read_at = message.date_added
+        self.unread_count = 0
+        self.save(
+            update_fields=[
+                "last_read_message",
+                "last_read_at",
+                "unread_count",
+                "last_updated",
+            ]
+        )
 
 
 class ChatRoomMessage(models.Model):
@@ -40,8 +157,66 @@ class ChatRoomMessage(models.Model):
     url_content_type = models.CharField(max_length=255, null=True, blank=True)
     date_added = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
+    # Room sequence number of the insert, and of the latest insert or edit.
+    sequence = models.PositiveBigIntegerField()
+    change_sequence = models.PositiveBigIntegerField()
+    # Optional key chosen by the client so retried sends return the original.
+    client_key = models.CharField(max_length=64, null=True, blank=True)
+    search_vector = models.GeneratedField(
+        expression=SearchVector("text", config=MESSAGE_SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["chat_room", "date_added", "id"]),
+            models.Index(fields=["chat_room", "change_sequence"]),
+            GinIndex(fields=["search_vector"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat_room", "sequence"], name="unique_message_sequence"
+            ),
+            models.UniqueConstraint(
+                fields=["chat_room", "sender", "client_key"],
+                condition=models.Q(client_key__isnull=False),
+                name="unique_message_client_key",
+            ),
+        ]
+
+    def save(self, *args: Any, **kwargs: Any):
+        with transaction.atomic():
+            if self.sequence is None:
+                self.sequence = ChatRoom.allocate_sequence(self.chat_room_id)
+                self.change_sequence = self.sequence
+            elif not self._state.adding:
+                self.change_sequence = ChatRoom.allocate_sequence(self.chat_room_id)
+                if kwargs.get("update_fields") is not None:
+                    kwargs["update_fields"] = {
+                        *kwargs["update_fields"],
+                        "change_sequence",
+                    }
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            if adding:
+                ChatRoom.set_last_message(self)
+            else:
+                _ = ChatRoom.objects.filter(
+                    pk=self.chat_room_id, last_message=self
+                ).update(last_message_preview=self.preview())
 
+    def preview(self) -> Optional[str]:
+        return None if self.text is None else self.text[:MESSAGE_PREVIEW_LENGTH]
 
+    def read_by(self):
+        return ChatRoomMember.objects.filter(
+            chat_room=self.chat_room_id, last_read_at__gte=self.date_added
+        )
+
+
+# Superseded by the ChatRoomMember read watermark. Existing rows are compacted
+# by migration 0006; the table is no longer written to.
 class ChatRoomMessageReadReciepts(models.Model):
     id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
     message = models.ForeignKey(ChatRoomMessage, on_delete=models.CASCADE)
@@ -50,3 +225,47 @@ class ChatRoomMessageReadReciepts(models.Model):
 
     class Meta:
         unique_together = ("message", "member")
+
+
+class ChatRoomMessageTombstone(models.Model):
+    id = models.UUIDField(primary_key=True, editable=False, default=uuid.uuid4)
+    chat_room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE)
+    message_id = models.UUIDField()
+    sequence = models.PositiveBigIntegerField()
+    date_added = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["chat_room", "sequence"], name="unique_tombstone_sequence"
+            )
+        ]
+
+    @classmethod
+    def create_for_message(cls, message: ChatRoomMessage):
+        with transaction.atomic():
+            tombstone = cls.objects.create(
+                chat_room_id=message.chat_room_id,
+                message_id=message.pk,
+                sequence=ChatRoom.allocate_sequence(message.chat_room_id),
+            )
+            was_latest = ChatRoom.objects.filter(
+                pk=message.chat_room_id, last_message=message
+            ).exists()
+            _ = message.delete()
+            if was_latest:
+                ChatRoom.refresh_last_message(message.chat_room_id)
+        return tombstone
+
+
+class ChatRoomMessageOutbox(models.Model):
+    """
+    Messages whose read-state updates and channel-layer fan-out are still
+    pending. Written in the same transaction as the message and drained by the
+    `process_message_outbox` worker.
+    """
+
+    # Sequential so the worker drains messages in the order they were sent.
+    id = models.BigAutoField(primary_key=True)
+    message = models.OneToOneField(ChatRoomMessage, on_delete=models.CASCADE)
+    date_added = models.DateTimeField(auto_now_add=True)
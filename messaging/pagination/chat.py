@@ -1,7 +1,298 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timezone
+from typing import Any, Optional
+from uuid import UUID
+from django.db.models import Q, QuerySet
 from rest_framework import pagination
+from rest_framework.views import Request, Response, exceptions
 
+from messaging.models.chat import ChatRoom, ChatRoomMessage
 
-class ChatMessagesPagination(pagination.PageNumberPagination):
+
+class KeysetPagination(pagination.BasePagination):
     page_size = 5
     page_size_query_param = "page_size"
     max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request: Request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def encode_position(self, *parts: Any):
+        position = "|".join(str(part) for part in parts)
+        return urlsafe_b64encode(position.encode()).decode()
+
+    def decode_position(self, encoded: str):
+        try:
+            return urlsafe_b64decode(encoded.encode()).decode().split("|")
+        except (TypeError, ValueError):
+            raise exceptions.NotFound(self.invalid_cursor_message)
+
+
+class ChatMessagesPagination(KeysetPagination):
+    """
+    Keyset pagination over (date_added, id).
+
+    Without a cursor the newest page is returned. `before` walks back through
+    history and `after` returns messages newer than the cursor, so clients can
+    poll for new messages. Pages are always in chronological order.
+    """
+
+    before_query_param = "before"
+    after_query_param = "after"
+
+    def paginate_queryset(
+        self, queryset: QuerySet[ChatRoomMessage], request: Request, view: Any = None
+    ):
+        self.page_size = self.get_page_size(request)
+        before = self.decode_cursor(request, self.before_query_param)
+        after = self.decode_cursor(request, self.after_query_param)
+
+        if after:
+            date_added, message_id = after
+            queryset = queryset.filter(
+                Q(date_added__gt=date_added)
+                | Q(date_added=date_added, id__gt=message_id)
+            ).order_by("date_added", "id")
+            page = list(queryset[: self.page_size + 1])
+            self.has_newer = len(page) > self.page_size
+            page = page[: self.page_size]
+            self.has_older = True
+        else:
+            if before:
+                date_added, message_id = before
+                queryset = queryset.filter(
+                    Q(date_added__lt=date_added)
+                    | Q(date_added=date_added, id__lt=message_id)
+                )
+            queryset = queryset.order_by("-date_added", "-id")
+            page = list(queryset[: self.page_size + 1])
+            self.has_older = len(page) > self.page_size
+            page = list(reversed(page[: self.page_size]))
+            self.has_newer = before is not None
+
+        self.page = page
+        self.request_cursor = request.query_params.get(self.after_query_param)
+        return page
+
+    def get_paginated_response(self, data: Any):
+        return Response(
+            {
+                "before": self.get_before_cursor(),
+                "after": self.get_after_cursor(),
+                "has_newer": self.has_newer,
+                "results": data,
+            }
+        )
+
+    def get_cached_paginated_response(
+        self, messages: list[dict[str, Any]], has_older: bool
+    ):
+        """
+        Responds with a newest page served by RecentMessagesCache, where
+        messages are already serialized.
+        """
+        return Response(
+            {
+                "before": (
+                    self.encode_serialized_cursor(messages[0])
+                    if has_older and messages
+                    else None
+                ),
+                "after": (
+                    self.encode_serialized_cursor(messages[-1]) if messages else None
+                ),
+                "has_newer": False,
+                "results": messages,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema: dict[str, Any]):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "before": {"type": "string", "nullable": True},
+                "after": {"type": "string", "nullable": True},
+                "has_newer": {"type": "boolean"},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view: Any):
+        return [
+            {
+                "name": self.before_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor returning the messages older than it.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.after_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Cursor returning the messages newer than it.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Number of results to return per page.",
+                "schema": {"type": "integer"},
+            },
+        ]
+
+    def get_before_cursor(self) -> Optional[str]:
+        if not self.has_older or not self.page:
+            return None
+        return self.encode_cursor(self.page[0])
+
+    def get_after_cursor(self) -> Optional[str]:
+        if not self.page:
+            return self.request_cursor
+        return self.encode_cursor(self.page[-1])
+
+    def encode_cursor(self, message: ChatRoomMessage):
+        return self.encode_position(message.date_added.isoformat(), message.id)
+
+    def encode_serialized_cursor(self, message: dict[str, Any]):
+        # Same cursor as encode_cursor gives for the stored timestamp.
+        date_added = datetime.fromisoformat(message["date_added"])
+        return self.encode_position(
+            date_added.astimezone(timezone.utc).isoformat(), message["id"]
+        )
+
+    def decode_cursor(self, request: Request, query_param: str):
+        encoded = request.query_params.get(query_param)
+        if not encoded:
+            return None
+
+        try:
+            date_added, message_id = self.decode_position(encoded)
+            return datetime.fromisoformat(date_added), UUID(message_id)
+        except ValueError:
+            raise exceptions.NotFound(self.invalid_cursor_message)
+
+
+class ChatMessagesSearchPagination(KeysetPagination):
+    """
+    Keyset pagination over (rank, id) for ranked search results, best match
+    first. Expects the queryset to be annotated with `rank`.
+    """
+
+    page_size = 20
+    cursor_query_param = "cursor"
+
+    def paginate_queryset(
+        self, queryset: QuerySet[ChatRoomMessage], request: Request, view: Any = None
+    ):
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        if cursor:
+            rank, message_id = cursor
+            queryset = queryset.filter(
+                Q(rank__lt=rank) | Q(rank=rank, id__lt=message_id)
+            )
+        page = list(queryset.order_by("-rank", "-id")[: page_size + 1])
+
+        self.next_cursor = (
+            self.encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        )
+        return page[:page_size]
+
+    def get_paginated_response(self, data: Any):
+        return Response({"next": self.next_cursor, "results": data})
+
+    def get_paginated_response_schema(self, schema: dict[str, Any]):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def encode_cursor(self, message: ChatRoomMessage):
+        return self.encode_position(repr(getattr(message, "rank")), message.id)
+
+    def decode_cursor(self, request: Request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            rank, message_id = self.decode_position(encoded)
+            return float(rank), UUID(message_id)
+        except ValueError:
+            raise exceptions.NotFound(self.invalid_cursor_message)
+
+
+class ChatRoomsPagination(KeysetPagination):
+    """
+    Keyset pagination over the requesting member's (last_activity_at, room id),
+    most recently active first. Expects the queryset to be annotated with
+    `last_activity_at` and `activity_room_id` from the member row.
+    """
+
+    page_size = 20
+    cursor_query_param = "cursor"
+
+    def paginate_queryset(
+        self, queryset: QuerySet[ChatRoom], request: Request, view: Any = None
+    ):
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        if cursor:
+            last_activity_at, room_id = cursor
+            queryset = queryset.filter(
+                Q(last_activity_at__lt=last_activity_at)
+                | Q(last_activity_at=last_activity_at, activity_room_id__lt=room_id)
+            )
+        page = list(
+            queryset.order_by("-last_activity_at", "-activity_room_id")[: page_size + 1]
+        )
+
+        self.next_cursor = (
+            self.encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+        )
+        return page[:page_size]
+
+    def get_paginated_response(self, data: Any):
+        return Response({"next": self.next_cursor, "results": data})
+
+    def get_paginated_response_schema(self, schema: dict[str, Any]):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def encode_cursor(self, room: ChatRoom):
+        return self.encode_position(
+            getattr(room, "last_activity_at").isoformat(), room.id
+        )
+
+    def decode_cursor(self, request: Request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            last_activity_at, room_id = self.decode_position(encoded)
+            return datetime.fromisoformat(last_activity_at), UUID(room_id)
+        except ValueError:
+            raise exceptions.NotFound(self.invalid_cursor_message)
@@ -3,7 +3,7 @@ from rest_framework import permissions
 from rest_framework.views import Request
 from rest_framework.viewsets import ViewSet
 
-from messaging.models.chat import ChatRoomMember
+from messaging.utils.chat import ChatMembershipCache
 
 if TYPE_CHECKING:
     from users.models.users import User
@@ -16,16 +16,14 @@ class CanSendMessagePermission(permissions.BasePermission):
         if not user.is_authenticated:
             return False
 
+        if "can_send_message" not in user.hq_permissions:
+            return False
+
         chat_room_id = view.kwargs.get("chat_pk")
         if chat_room_id:
-            member = ChatRoomMember.objects.filter(
-                chat_room__id=chat_room_id, user=user
-            ).first()
-
-            if not member or not member.active:
-                return False
+            return ChatMembershipCache.is_active_member(chat_room_id, user.pk)
 
-        return "can_send_message" in user.hq_user_data["permissions"]
+        return True
 
 
 class CanEditMessagePermission(permissions.BasePermission):
@@ -35,7 +33,7 @@ class CanEditMessagePermission(permissions.BasePermission):
         if not user.is_authenticated:
             return False
 
-        return "can_edit_message" in user.hq_user_data["permissions"]
+        return "can_edit_message" in user.hq_permissions
 
 
 class CanViewMessagePermission(permissions.BasePermission):
@@ -45,13 +43,11 @@ class CanViewMessagePermission(permissions.BasePermission):
         if not user.is_authenticated:
             return False
 
+        if "can_view_chat" not in user.hq_permissions:
+            return False
+
         chat_room_id = view.kwargs.get("chat_pk")
         if chat_room_id:
-            member_exists = ChatRoomMember.objects.filter(
-                chat_room__id=chat_room_id, user=user
-            ).exists()
-
-            if not member_exists:
-                return False
+            return ChatMembershipCache.is_member(chat_room_id, user.pk)
 
-        return "can_view_chat" in user.hq_user_data["permissions"]
+        return True
@@ -1,7 +1,7 @@
 from django.urls import re_path
 from messaging import consumers
 
-
 websocket_urlpatterns = [
     re_path(r"^ws/chat/(?P<room_id>[0-9a-fA-F-]+)/$", consumers.ChatConsumer.as_asgi()),
+    re_path(r"^ws/inbox/$", consumers.InboxConsumer.as_asgi()),
 ]
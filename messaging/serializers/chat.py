@@ -1,4 +1,4 @@
-from django.db.models import Exists, OuterRef
+from typing import Any, Optional
 from rest_framework import serializers
 from drf_yasg.utils import swagger_serializer_method
 
@@ -6,7 +6,6 @@ from messaging.models.chat import (
     ChatRoom,
     ChatRoomMember,
     ChatRoomMessage,
-    ChatRoomMessageReadReciepts,
     ChatRoomType,
 )
 from users.serializers.user import UserSerializer
@@ -34,6 +33,8 @@ class ChatRoomMessageDetailSerializer(serializers.ModelSerializer):
             "date_added",
             "edited",
             "sender",
+            "sequence",
+            "client_key",
         ]
 
     @swagger_serializer_method(
@@ -43,12 +44,54 @@ class ChatRoomMessageDetailSerializer(serializers.ModelSerializer):
         return message.date_added != message.last_updated
 
 
+class ChatRoomMessageSearchRequestSerializer(serializers.Serializer):
+    q = serializers.CharField()
+    cursor = serializers.CharField(required=False)
+    page_size = serializers.IntegerField(required=False, min_value=1, max_value=100)
+
+
+class ChatRoomMessageSearchResponseSerializer(serializers.Serializer):
+    next = serializers.CharField(allow_null=True)
+    results = ChatRoomMessageDetailSerializer(many=True)
+
+
 class ChatRoomMessageRequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatRoomMessage
         fields = ["text", "url", "url_content_type"]
 
 
+class ChatRoomMessageCreateRequestSerializer(ChatRoomMessageRequestSerializer):
+    class Meta(ChatRoomMessageRequestSerializer.Meta):
+        fields = [*ChatRoomMessageRequestSerializer.Meta.fields, "client_key"]
+
+    def validate_client_key(self, value: Optional[str]) -> Optional[str]:
+        # Form clients send empty fields; an empty key is no key, not one
+        # shared by every message that omits it.
+        return value or None
+
+
+class ChatRoomMessageBulkCreateRequestSerializer(serializers.Serializer):
+    max_messages = 5000
+
+    messages = ChatRoomMessageCreateRequestSerializer(many=True, allow_empty=False)
+
+    def validate_messages(self, value: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        if len(value) > self.max_messages:
+            raise serializers.ValidationError(
+                f"Ensure this field has no more than {self.max_messages} elements."
+            )
+        return value
+
+
+class ChatRoomMessageBulkCreateResponseSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    skipped = serializers.IntegerField()
+    ids = serializers.ListField(child=serializers.UUIDField())
+    first_sequence = serializers.IntegerField(allow_null=True)
+    last_sequence = serializers.IntegerField(allow_null=True)
+
+
 class ChatRoomCreateRequestSerializer(serializers.ModelSerializer):
     pair_email = serializers.EmailField(allow_null=True, required=False)
 
@@ -66,6 +109,7 @@ class ChatRoomEditRequestSerializer(serializers.ModelSerializer):
 class ChatRoomDetailsSerializer(serializers.ModelSerializer):
     display_name = serializers.SerializerMethodField()
     unread = serializers.SerializerMethodField()
+    member_count = serializers.SerializerMethodField()
 
     class Meta:
         model = ChatRoom
@@ -77,6 +121,15 @@ class ChatRoomDetailsSerializer(serializers.ModelSerializer):
             "date_added",
             "display_name",
             "unread",
+            "member_count",
+            "last_message_id",
+            "last_message_preview",
+            "last_message_at",
+        ]
+        read_only_fields = [
+            "last_message_id",
+            "last_message_preview",
+            "last_message_at",
         ]
 
     @swagger_serializer_method(
@@ -87,13 +140,24 @@ class ChatRoomDetailsSerializer(serializers.ModelSerializer):
             request = self.context.get("request")
 
             if request and hasattr(request, "user"):
-                reciever_member = (
-                    ChatRoomMember.objects.select_related("user__profile")
-                    .filter(chat_room=room)
-                    .exclude(user=request.user)
-                    .first()
-                )
-                if reciever_member:
+                pair_members = getattr(room, "pair_members", None)
+                if pair_members is not None:
+                    reciever_member = next(
+                        (
+                            member
+                            for member in pair_members
+                            if member.user_id != request.user.pk
+                        ),
+                        None,
+                    )
+                else:
+                    reciever_member = (
+                        ChatRoomMember.objects.select_related("user__profile")
+                        .filter(chat_room=room)
+                        .exclude(user=request.user)
+                        .first()
+                    )
+                if reciever_member and reciever_member.user:
                     return (
                         reciever_member.user.profile.full_name
                         if hasattr(reciever_member.user, "profile")
@@ -102,26 +166,55 @@ class ChatRoomDetailsSerializer(serializers.ModelSerializer):
 
         return room.name
 
+    @swagger_serializer_method(serializer_or_field=serializers.IntegerField())
+    def get_member_count(self, room: ChatRoom):
+        member_count = getattr(room, "member_count", None)
+        if member_count is not None:
+            return member_count
+        return ChatRoomMember.objects.filter(chat_room=room).count()
+
     @swagger_serializer_method(serializer_or_field=serializers.IntegerField())
     def get_unread(self, chat_room: ChatRoom):
+        unread = getattr(chat_room, "unread", None)
+        if unread is not None:
+            return unread
+
         request = self.context.get("request")
 
         if request and hasattr(request, "user"):
-            member = ChatRoomMember.objects.get(chat_room=chat_room, user=request.user)
-            return (
-                ChatRoomMessage.objects.filter(chat_room=chat_room)
-                .exclude(sender=member)
-                .filter(
-                    ~Exists(
-                        ChatRoomMessageReadReciepts.objects.filter(
-                            message=OuterRef("id"), member=member
-                        )
-                    )
-                )
-            ).count()
+            member = (
+                ChatRoomMember.objects.filter(chat_room=chat_room, user=request.user)
+                .values("unread_count")
+                .first()
+            )
+            return member["unread_count"] if member else 0
 
         return 0
 
 
 class ChatRoomAddMemeberRequestSerializer(serializers.Serializer):
     user_email = serializers.EmailField()
+
+
+class ChatRoomMessageExportRequestSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(choices=["ndjson", "csv"], default="ndjson")
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+
+class ChatRoomSyncRequestSerializer(serializers.Serializer):
+    since_seq = serializers.IntegerField(min_value=0)
+    limit = serializers.IntegerField(min_value=1, max_value=500, default=100)
+
+
+class ChatRoomSyncEventSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=["insert", "edit", "delete"])
+    sequence = serializers.IntegerField()
+    message_id = serializers.UUIDField()
+    message = ChatRoomMessageDetailSerializer(allow_null=True)
+
+
+class ChatRoomSyncResponseSerializer(serializers.Serializer):
+    events = ChatRoomSyncEventSerializer(many=True)
+    last_seq = serializers.IntegerField()
+    has_more = serializers.BooleanField()
@@ -0,0 +1,60 @@
+from typing import Any
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from messaging.models.chat import ChatRoomMember
+from messaging.utils.chat import ChatMembershipCache, ChatMessageManager
+
+
+@receiver(post_save, sender=ChatRoomMember)
+@receiver(post_delete, sender=ChatRoomMember)
+def invalidate_membership(sender: Any, instance: ChatRoomMember, **kwargs: Any):
+    if instance.user_id is None:
+        return
+
+    ChatMembershipCache.invalidate(instance.chat_room_id, instance.user_id)
+    # Again after commit, in case a concurrent request cached the old state.
+    transaction.on_commit(
+        lambda: ChatMembershipCache.invalidate(instance.chat_room_id, instance.user_id)
+    )
+
+
+@receiver(post_save, sender=ChatRoomMember)
+def notify_membership_saved(
+    sender: Any, instance: ChatRoomMember, created: bool, **kwargs: Any
+):
+    update_fields = kwargs.get("update_fields")
+    if instance.user_id is None:
+        return
+    # Read-state saves are announced through `unread` events instead.
+    if not created and update_fields is not None and "active" not in update_fields:
+        return
+
+    event = {
+        "type": "membership",
+        "room_id": str(instance.chat_room_id),
+        "member": True,
+        "active": instance.active,
+        "unread": instance.unread_count,
+    }
+    transaction.on_commit(
+        lambda: ChatMessageManager.notify_user(instance.user_id, event), robust=True
+    )
+
+
+@receiver(post_delete, sender=ChatRoomMember)
+def notify_membership_deleted(sender: Any, instance: ChatRoomMember, **kwargs: Any):
+    if instance.user_id is None:
+        return
+
+    event = {
+        "type": "membership",
+        "room_id": str(instance.chat_room_id),
+        "member": False,
+        "active": False,
+        "unread": 0,
+    }
+    transaction.on_commit(
+        lambda: ChatMessageManager.notify_user(instance.user_id, event), robust=True
+    )
@@ -1,3 +1,1363 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import tempfile
+import threading
+import time
+import uuid
+import warnings
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from typing import Any, Optional
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
 
-# Create your tests here.
+from messaging.consumers.chat import ChatConsumer
+from messaging.models.chat import (
+    ChatRoom,
+    ChatRoomMember,
+    ChatRoomMessage,
+    ChatRoomMessageOutbox,
+    ChatRoomType,
+)
+from messaging.permissions.chat import (
+    CanSendMessagePermission,
+    CanViewMessagePermission,
+)
+from messaging.routing import websocket_urlpatterns
+from messaging.utils.chat import ChatMessageManager
+from messaging.utils.ephemeral import EphemeralCoalescer
+from messaging.utils.presence import PresenceManager
+from messaging.utils.recent import RecentMessagesCache
+from messaging.utils.sendqueue import SendQueue, SendQueueMetrics
+from users.models.users import Profile, User
+
+process_outbox = database_sync_to_async(ChatMessageManager.process_outbox)
+
+
+class ChatRoomListQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_rooms(self, count: int):
+        start = ChatRoom.objects.count()
+        for index in range(start, start + count):
+            peer = User.objects.create_user(email=f"peer{index}@example.com")
+            _ = Profile.objects.create(
+                user=peer, first_name="Peer", last_name=str(index)
+            )
+            room = ChatRoom.objects.create(type=ChatRoomType.Pair, created_by=self.user)
+            member = ChatRoomMember.objects.create(chat_room=room, user=self.user)
+            _ = ChatRoomMember.objects.create(
+                chat_room=room, user=peer, unread_count=index
+            )
+            _ = ChatRoomMessage.objects.create(
+                chat_room=room, sender=member, text=f"hello {index}"
+            )
+
+    def list_rooms(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/messaging/chat/")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"], len(queries)
+
+    def test_query_count_is_constant(self):
+        self.create_rooms(2)
+        rooms, few_rooms_queries = self.list_rooms()
+        self.assertEqual(len(rooms), 2)
+
+        self.create_rooms(8)
+        rooms, many_rooms_queries = self.list_rooms()
+        self.assertEqual(len(rooms), 10)
+        self.assertEqual(few_rooms_queries, many_rooms_queries)
+
+    def test_annotated_fields(self):
+        self.create_rooms(1)
+        rooms, _ = self.list_rooms()
+
+        self.assertEqual(rooms[0]["display_name"], "Peer 0")
+        self.assertEqual(rooms[0]["unread"], 0)
+        self.assertEqual(rooms[0]["member_count"], 2)
+        self.assertEqual(rooms[0]["last_message_preview"], "hello 0")
+        self.assertIsNotNone(rooms[0]["last_message_at"])
+
+
+class ChatRoomActivityTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message", "can_edit_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.rooms = [
+            ChatRoom.objects.create(type=ChatRoomType.GroupChat) for _ in range(5)
+        ]
+        self.members = [
+            ChatRoomMember.objects.create(chat_room=room, user=self.user)
+            for room in self.rooms
+        ]
+
+    def send(self, index: int, text: str):
+        _ = ChatMessageManager.create_message(
+            self.rooms[index], self.members[index], {"text": text}
+        )
+        _ = ChatMessageManager.process_outbox()
+
+    def test_rooms_are_listed_by_recent_activity(self):
+        for index in [3, 1, 4]:
+            self.send(index, f"to {index}")
+
+        first = self.client.get("/messaging/chat/", {"page_size": 2}).json()
+        second = self.client.get(
+            "/messaging/chat/", {"page_size": 2, "cursor": first["next"]}
+        ).json()
+        third = self.client.get(
+            "/messaging/chat/", {"page_size": 2, "cursor": second["next"]}
+        ).json()
+
+        listed = [
+            room["id"] for page in [first, second, third] for room in page["results"]
+        ]
+        expected = [self.rooms[i] for i in [4, 1, 3]]
+        self.assertEqual(listed[:3], [str(room.id) for room in expected])
+        self.assertCountEqual(listed, [str(room.id) for room in self.rooms])
+        self.assertIsNone(third["next"])
+        self.assertEqual(first["results"][0]["last_message_preview"], "to 4")
+
+    def test_sender_sees_the_room_move_before_the_outbox_runs(self):
+        self.send(1, "delivered")
+        _ = ChatMessageManager.create_message(
+            self.rooms[3], self.members[3], {"text": "pending"}
+        )
+
+        first = self.client.get("/messaging/chat/", {"page_size": 1}).json()
+        self.assertEqual(first["results"][0]["id"], str(self.rooms[3].id))
+        self.assertEqual(first["results"][0]["last_message_preview"], "pending")
+
+    def test_last_message_follows_edits_and_deletes(self):
+        self.send(0, "first")
+        self.send(0, "second")
+        room = self.rooms[0]
+        latest = ChatRoomMessage.objects.get(chat_room=room, text="second")
+        url = f"/messaging/chat/{room.id}/messages/{latest.id}/"
+
+        _ = self.client.patch(url, {"text": "second, edited"})
+        room.refresh_from_db()
+        self.assertEqual(room.last_message_id, latest.id)
+        self.assertEqual(room.last_message_preview, "second, edited")
+
+        _ = self.client.delete(url)
+        room.refresh_from_db()
+        self.assertEqual(room.last_message_preview, "first")
+
+        _ = self.client.delete(
+            f"/messaging/chat/{room.id}/messages/{room.last_message_id}/"
+        )
+        room.refresh_from_db()
+        self.assertIsNone(room.last_message_id)
+        self.assertIsNone(room.last_message_at)
+
+
+class ChatMessagesPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        member = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+        for index in range(12):
+            _ = ChatRoomMessage.objects.create(
+                chat_room=self.room, sender=member, text=str(index)
+            )
+
+    def get_page(self, **params: str):
+        response = self.client.get(f"/messaging/chat/{self.room.id}/messages/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_scrolls_back_through_history(self):
+        page = self.get_page()
+        self.assertEqual(
+            [m["text"] for m in page["results"]], ["7", "8", "9", "10", "11"]
+        )
+
+        page = self.get_page(before=page["before"])
+        self.assertEqual(
+            [m["text"] for m in page["results"]], ["2", "3", "4", "5", "6"]
+        )
+
+        page = self.get_page(before=page["before"])
+        self.assertEqual([m["text"] for m in page["results"]], ["0", "1"])
+        self.assertIsNone(page["before"])
+
+    def test_polls_for_new_messages(self):
+        page = self.get_page()
+        after = page["after"]
+
+        page = self.get_page(after=after)
+        self.assertEqual(page["results"], [])
+        self.assertEqual(page["after"], after)
+
+        _ = ChatRoomMessage.objects.create(
+            chat_room=self.room,
+            sender=ChatRoomMember.objects.get(user=self.user),
+            text="12",
+        )
+        page = self.get_page(after=after)
+        self.assertEqual([m["text"] for m in page["results"]], ["12"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            f"/messaging/chat/{self.room.id}/messages/", {"before": "garbage"}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ChatMessagesQueryCountTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="reader@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        _ = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+
+    def add_messages(self, count: int):
+        for index in range(count):
+            sender = User.objects.create_user(
+                email=f"sender{ChatRoomMessage.objects.count()}@example.com"
+            )
+            sender.hq_user_data = {"subscription_payment_paid": True}
+            sender.save()
+            _ = Profile.objects.create(user=sender, first_name=f"Sender {index}")
+            member = ChatRoomMember.objects.create(chat_room=self.room, user=sender)
+            _ = ChatRoomMessage.objects.create(
+                chat_room=self.room, sender=member, text=str(index)
+            )
+
+    def page_queries(self) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                f"/messaging/chat/{self.room.id}/messages/", {"page_size": 100}
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_page_serializes_in_constant_queries(self):
+        self.add_messages(10)
+        _ = self.page_queries()  # warms the membership cache
+        small_page_queries = self.page_queries()
+        self.add_messages(90)
+        full_page_queries = self.page_queries()
+
+        self.assertEqual(small_page_queries, full_page_queries)
+        self.assertLessEqual(full_page_queries, 3)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+)
+class ChatRoomSyncTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message", "can_edit_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        _ = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+
+        messages_url = f"/messaging/chat/{self.room.id}/messages/"
+        self.ids = [
+            self.client.post(messages_url, {"text": str(index)}).json()["id"]
+            for index in range(3)
+        ]
+        edited = self.client.patch(f"{messages_url}{self.ids[0]}/", {"text": "0!"})
+        deleted = self.client.delete(f"{messages_url}{self.ids[1]}/")
+        self.assertEqual(edited.status_code, 200)
+        self.assertEqual(deleted.status_code, 204)
+
+    def sync(self, since_seq: int, limit: int = 100) -> dict[str, Any]:
+        response = self.client.get(
+            f"/messaging/chat/{self.room.id}/sync/",
+            {"since_seq": since_seq, "limit": limit},
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def events(self, data: dict[str, Any]) -> list[tuple[str, int, str]]:
+        return [
+            (event["type"], event["sequence"], event["message_id"])
+            for event in data["events"]
+        ]
+
+    def test_changes_in_sequence_order(self):
+        first, second, third = self.ids
+        data = self.sync(0)
+
+        self.assertEqual(
+            self.events(data),
+            [("insert", 3, third), ("insert", 4, first), ("delete", 5, second)],
+        )
+        self.assertEqual(data["events"][1]["message"]["text"], "0!")
+        self.assertIsNone(data["events"][2]["message"])
+        self.assertEqual((data["last_seq"], data["has_more"]), (5, False))
+
+        data = self.sync(3)
+        self.assertEqual(self.events(data), [("edit", 4, first), ("delete", 5, second)])
+
+    def test_pages(self):
+        first, second, third = self.ids
+
+        data = self.sync(0, limit=2)
+        self.assertEqual(
+            self.events(data), [("insert", 3, third), ("insert", 4, first)]
+        )
+        self.assertEqual((data["last_seq"], data["has_more"]), (4, True))
+
+        data = self.sync(data["last_seq"], limit=2)
+        self.assertEqual(self.events(data), [("delete", 5, second)])
+        self.assertEqual((data["last_seq"], data["has_more"]), (5, False))
+
+        # A page that ends exactly on the last change has nothing more.
+        data = self.sync(3, limit=2)
+        self.assertEqual((data["last_seq"], data["has_more"]), (5, False))
+
+        data = self.sync(5)
+        self.assertEqual(
+            (data["events"], data["last_seq"], data["has_more"]), ([], 5, False)
+        )
+
+    def test_since_seq_is_validated(self):
+        response = self.client.get(
+            f"/messaging/chat/{self.room.id}/sync/", {"since_seq": -1}
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class ReadStateTest(TestCase):
+    def setUp(self):
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.members: dict[str, ChatRoomMember] = {}
+        for name in ["alice", "bob", "carol", "dave"]:
+            user = User.objects.create_user(email=f"{name}@example.com")
+            self.members[name] = ChatRoomMember.objects.create(
+                chat_room=self.room, user=user
+            )
+
+    def send(self, *online: str) -> ChatRoomMessage:
+        message = ChatRoomMessage.objects.create(
+            chat_room=self.room, sender=self.members["alice"], text="hi"
+        )
+        ChatMessageManager.update_read_state(
+            message,
+            Q(pk__in=[self.members[name].pk for name in online], active=True),
+        )
+        return message
+
+    def state(self) -> dict[str, tuple[Any, int]]:
+        return {
+            member.user.email.split("@")[0]: (
+                member.last_read_message_id,
+                member.unread_count,
+            )
+            for member in ChatRoomMember.objects.filter(
+                chat_room=self.room
+            ).select_related("user")
+        }
+
+    def test_online_members_only_read_when_caught_up(self):
+        first = self.send("bob")
+        second = self.send("bob", "carol")
+
+        self.assertEqual(
+            self.state(),
+            {
+                "alice": (second.pk, 0),
+                "bob": (second.pk, 0),
+                "carol": (None, 2),
+                "dave": (None, 2),
+            },
+        )
+        self.assertEqual(
+            {member.pk for member in first.read_by()},
+            {self.members["alice"].pk, self.members["bob"].pk},
+        )
+
+    def test_clear_unread_before_the_outbox_drains(self):
+        message = ChatRoomMessage.objects.create(
+            chat_room=self.room, sender=self.members["alice"], text="hi"
+        )
+        self.members["dave"].mark_read(message)
+        ChatMessageManager.update_read_state(message, Q(pk__in=[]))
+
+        self.assertEqual(self.state()["dave"], (message.pk, 0))
+        self.assertEqual(self.state()["carol"], (None, 1))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    MESSAGE_CACHE={
+        "BACKEND": "messaging.utils.recent.MemoryRecentMessagesStore",
+        "SIZE": 10,
+    },
+)
+class RecentMessagesCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message", "can_edit_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.member = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+        for index in range(12):
+            _ = ChatRoomMessage.objects.create(
+                chat_room=self.room, sender=self.member, text=str(index)
+            )
+        self.url = f"/messaging/chat/{self.room.id}/messages/"
+        _ = RecentMessagesCache.stats(reset=True)
+
+    def get_page(self, **params: str):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_newest_page_is_served_and_written_through(self):
+        with override_settings(MESSAGE_CACHE={"BACKEND": None}):
+            uncached = self.get_page(page_size="5")
+
+        self.assertEqual(self.get_page(page_size="5"), uncached)
+        # The room version and the senders.
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_page(page_size="5"), uncached)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            sent = self.client.post(self.url, {"text": "new"}).json()
+            _ = self.client.patch(f"{self.url}{sent['id']}/", {"text": "edited"})
+            _ = self.client.delete(f"{self.url}{uncached['results'][-1]['id']}/")
+
+        with self.assertNumQueries(2):
+            page = self.get_page(page_size="5")
+        with override_settings(MESSAGE_CACHE={"BACKEND": None}):
+            self.assertEqual(self.get_page(page_size="5"), page)
+        self.assertEqual(page["results"][-1]["text"], "edited")
+        self.assertEqual(len(self.get_page(before=page["before"])["results"]), 5)
+
+        stats = RecentMessagesCache.stats(reset=True)
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_missed_write_is_not_served(self):
+        _ = self.get_page()
+        # Written without the write-through; the entry is now behind the room.
+        _ = ChatRoomMessage.objects.create(
+            chat_room=self.room, sender=self.member, text="unseen"
+        )
+
+        self.assertEqual(self.get_page()["results"][-1]["text"], "unseen")
+
+    def test_edit_outside_the_window_leaves_no_gap(self):
+        messages = list(ChatRoomMessage.objects.order_by("sequence"))
+        with override_settings(
+            MESSAGE_CACHE={
+                "BACKEND": "messaging.utils.recent.MemoryRecentMessagesStore",
+                "SIZE": 3,
+            }
+        ):
+            _ = self.get_page(page_size="3")
+            with self.captureOnCommitCallbacks(execute=True):
+                _ = self.client.delete(f"{self.url}{messages[-2].id}/")
+                _ = self.client.patch(
+                    f"{self.url}{messages[0].id}/", {"text": "edited"}
+                )
+
+            page = self.get_page(page_size="3")
+        with override_settings(MESSAGE_CACHE={"BACKEND": None}):
+            self.assertEqual(self.get_page(page_size="3"), page)
+        self.assertEqual(
+            [message["text"] for message in page["results"]], ["8", "9", "11"]
+        )
+
+    def test_sender_changes_are_not_cached(self):
+        _ = self.get_page()
+        # Neither write bumps the room sequence.
+        self.member.active = False
+        self.member.save()
+        self.user.hq_user_data["subscription_payment_paid"] = False
+        self.user.save()
+
+        sender = self.get_page()["results"][-1]["sender"]
+        self.assertFalse(sender["active"])
+        self.assertFalse(sender["user"]["subscription_payment_paid"])
+        self.assertEqual(RecentMessagesCache.stats(reset=True)["hits"], 1)
+
+
+class ChatRoomMessageSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        member = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+        for text in [
+            "lunch tomorrow?",
+            "the budget meeting moved",
+            "meeting notes from the meeting",
+            "see you at the meeting",
+        ]:
+            _ = ChatRoomMessage.objects.create(
+                chat_room=self.room, sender=member, text=text
+            )
+
+    def test_ranked_search_with_cursor(self):
+        url = f"/messaging/chat/{self.room.id}/messages/search/"
+        response = self.client.get(url, {"q": "meetings", "page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual(page["results"][0]["text"], "meeting notes from the meeting")
+        self.assertEqual(len(page["results"]), 2)
+
+        response = self.client.get(
+            url, {"q": "meetings", "page_size": 2, "cursor": page["next"]}
+        )
+        page = response.json()
+        self.assertEqual(len(page["results"]), 1)
+        self.assertIsNone(page["next"])
+
+    @override_settings(MESSAGE_SEARCH={"TRIGRAM": True})
+    def test_trigram_search_adds_substring_matches(self):
+        url = f"/messaging/chat/{self.room.id}/messages/search/"
+        page = self.client.get(url, {"q": "UDGE"}).json()
+        self.assertEqual(
+            [message["text"] for message in page["results"]],
+            ["the budget meeting moved"],
+        )
+        # LIKE wildcards in the term are matched literally.
+        self.assertEqual(self.client.get(url, {"q": "b_dget"}).json()["results"], [])
+
+        page = self.client.get(url, {"q": "meetings"}).json()
+        self.assertEqual(len(page["results"]), 3)
+
+
+class IdempotentSendTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        _ = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+
+    def send(self, **data: str):
+        return self.client.post(f"/messaging/chat/{self.room.id}/messages/", data)
+
+    def test_retry_returns_the_original_message(self):
+        first = self.send(text="hi", client_key="k1")
+        retry = self.send(text="hi", client_key="k1")
+        other = self.send(text="hi", client_key="k2")
+        _ = self.send(text="no key")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()["id"], first.json()["id"])
+        self.assertEqual(other.status_code, 201)
+        self.assertEqual(ChatRoomMessage.objects.count(), 3)
+        self.assertEqual(ChatRoomMessageOutbox.objects.count(), 3)
+
+    def test_empty_key_is_no_key(self):
+        first = self.send(text="one", client_key="")
+        second = self.send(text="two", client_key="")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(
+            list(ChatRoomMessage.objects.values_list("client_key", flat=True)),
+            [None, None],
+        )
+
+
+class BulkIngestTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="bot@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        _ = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+        self.reader = ChatRoomMember.objects.create(chat_room=self.room)
+
+    def test_bulk_endpoint(self):
+        messages = [{"text": str(i), "client_key": f"k{i % 4}"} for i in range(6)]
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(
+                f"/messaging/chat/{self.room.id}/messages/bulk/",
+                {"messages": messages},
+                format="json",
+            )
+        retry = self.client.post(
+            f"/messaging/chat/{self.room.id}/messages/bulk/",
+            {"messages": messages[:2]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["created"], 4)
+        self.assertEqual(response.json()["skipped"], 2)
+        self.assertEqual(response.json()["first_sequence"], 1)
+        self.assertEqual(response.json()["last_sequence"], 4)
+        self.assertEqual(retry.json()["created"], 0)
+        # One coalesced broadcast and one recent messages cache invalidation.
+        self.assertEqual(len(callbacks), 2)
+        self.assertEqual(
+            list(
+                ChatRoomMessage.objects.order_by("sequence").values_list(
+                    "text", flat=True
+                )
+            ),
+            ["0", "1", "2", "3"],
+        )
+        self.assertFalse(ChatRoomMessageOutbox.objects.exists())
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.unread_count, 4)
+
+    def test_bulk_size_is_limited(self):
+        response = self.client.post(
+            f"/messaging/chat/{self.room.id}/messages/bulk/",
+            {"messages": [{"text": "x"}] * 5001},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("messages", response.json())
+        self.assertFalse(ChatRoomMessage.objects.exists())
+
+    def test_ingest_command(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as file:
+            _ = file.write('{"text": "a"}\n\n{"text": "b", "client_key": "b"}\n')
+            file.flush()
+            out = StringIO()
+            call_command(
+                "ingest_messages",
+                str(self.room.id),
+                self.user.email,
+                file.name,
+                stdout=out,
+            )
+
+        self.assertIn("Created 2 messages", out.getvalue())
+        self.assertEqual(ChatRoomMessage.objects.filter(chat_room=self.room).count(), 2)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    MESSAGE_CACHE={"BACKEND": None},
+)
+class BulkIngestRaceTest(TransactionTestCase):
+    def setUp(self):
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.sender = ChatRoomMember.objects.create(chat_room=self.room)
+
+    def test_bulk_send_waits_for_a_single_send_with_the_same_key(self):
+        sending = threading.Event()
+
+        def send_single():
+            try:
+                with transaction.atomic():
+                    _ = ChatMessageManager.create_message(
+                        self.room, self.sender, {"text": "single", "client_key": "k"}
+                    )
+                    sending.set()
+                    # Keep the room locked while the bulk send starts.
+                    time.sleep(0.3)
+            finally:
+                connection.close()
+
+        single = threading.Thread(target=send_single)
+        single.start()
+        self.assertTrue(sending.wait(5))
+        created = ChatMessageManager.bulk_create_messages(
+            self.room, self.sender, [{"text": "bulk", "client_key": "k"}]
+        )
+        single.join()
+
+        self.assertEqual(created, [])
+        self.assertEqual(
+            list(ChatRoomMessage.objects.values_list("text", flat=True)), ["single"]
+        )
+
+
+class ChatHistoryExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        _ = Profile.objects.create(user=self.user, username="owner")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        member = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+        for index in range(3):
+            _ = ChatRoomMessage.objects.create(
+                chat_room=self.room, sender=member, text=f"line, {index}"
+            )
+        self.old = ChatRoomMessage.objects.get(sequence=1)
+        _ = ChatRoomMessage.objects.filter(pk=self.old.pk).update(
+            date_added=timezone.now() - timedelta(days=30)
+        )
+
+    def export(self, **params: str) -> bytes:
+        response = self.client.get(
+            f"/messaging/chat/{self.room.id}/messages/export/", params
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return b"".join(response)
+
+    def test_ndjson_export_within_range(self):
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        rows = [json.loads(line) for line in self.export(since=since).splitlines()]
+
+        self.assertEqual([row["sequence"] for row in rows], [2, 3])
+        self.assertEqual(rows[0]["sender_username"], "owner")
+        self.assertEqual(rows[0]["text"], "line, 1")
+
+    def test_csv_export(self):
+        rows = list(csv.reader(StringIO(self.export(file_format="csv").decode())))
+
+        self.assertEqual(rows[0][:2], ["id", "sequence"])
+        self.assertEqual(
+            [row[-3] for row in rows[1:]], ["line, 0", "line, 1", "line, 2"]
+        )
+
+    def test_export_command(self):
+        with tempfile.NamedTemporaryFile(suffix=".ndjson") as file:
+            call_command("export_messages", str(self.room.id), "-o", file.name)
+            lines = file.read().splitlines()
+
+        self.assertEqual(len(lines), 3)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    PRESENCE={"BACKEND": "messaging.utils.presence.MemoryPresenceStore", "TTL": 60},
+)
+class ChatConsumerSendMessageTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        _ = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+
+    def connect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/chat/{self.room.id}/"
+        )
+        communicator.scope["user"] = self.user
+        return communicator
+
+    def test_send_message_is_stored_acknowledged_and_broadcast(self):
+        async def scenario():
+            sender, receiver = self.connect(), self.connect()
+            self.assertTrue((await sender.connect())[0])
+            self.assertTrue((await receiver.connect())[0])
+
+            await sender.send_json_to(
+                {"type": "send_message", "request_id": "r1", "data": {"text": "hi"}}
+            )
+            ack = await sender.receive_json_from()
+            await process_outbox()
+            broadcast = await receiver.receive_json_from()
+
+            await sender.disconnect()
+            await receiver.disconnect()
+            return ack, broadcast
+
+        ack, broadcast = async_to_sync(scenario)()
+
+        self.assertEqual(ack["type"], "send_message_ack")
+        self.assertEqual(ack["request_id"], "r1")
+        self.assertEqual(broadcast["type"], "chat_message")
+        self.assertEqual(broadcast["data"]["id"], ack["data"]["id"])
+        self.assertTrue(
+            ChatRoomMessage.objects.filter(pk=ack["data"]["id"], text="hi").exists()
+        )
+
+    def test_invalid_frame_is_rejected(self):
+        async def scenario():
+            sender = self.connect()
+            _ = await sender.connect()
+            await sender.send_json_to(
+                {"type": "send_message", "request_id": "r1", "data": {"url": "x" * 600}}
+            )
+            response = await sender.receive_json_from()
+            await sender.disconnect()
+            return response
+
+        response = async_to_sync(scenario)()
+
+        self.assertEqual(response["type"], "error")
+        self.assertIn("url", response["errors"])
+        self.assertFalse(ChatRoomMessage.objects.exists())
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    PRESENCE={"BACKEND": "messaging.utils.presence.MemoryPresenceStore", "TTL": 60},
+)
+class InboxConsumerTest(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="inbox@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.rooms = [
+            ChatRoom.objects.create(type=ChatRoomType.GroupChat) for _ in range(3)
+        ]
+        for room in self.rooms[:2]:
+            _ = ChatRoomMember.objects.create(chat_room=room, user=self.user)
+
+    def test_subscribe_send_and_receive_across_rooms(self):
+        async def scenario():
+            inbox = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), "/ws/inbox/"
+            )
+            inbox.scope["user"] = self.user
+            self.assertTrue((await inbox.connect())[0])
+
+            await inbox.send_json_to(
+                {
+                    "type": "subscribe",
+                    "room_ids": [str(room.id) for room in self.rooms] + ["nope"],
+                }
+            )
+            subscribed = await inbox.receive_json_from()
+
+            await inbox.send_json_to(
+                {
+                    "type": "send_message",
+                    "room_id": str(self.rooms[1].id),
+                    "request_id": "r1",
+                    "data": {"text": "hi"},
+                }
+            )
+            ack = await inbox.receive_json_from()
+            await process_outbox()
+            broadcast = await inbox.receive_json_from()
+
+            await inbox.send_json_to(
+                {"type": "send_message", "room_id": str(self.rooms[2].id), "data": {}}
+            )
+            rejected = await inbox.receive_json_from()
+
+            await inbox.disconnect()
+            return subscribed, ack, broadcast, rejected
+
+        subscribed, ack, broadcast, rejected = async_to_sync(scenario)()
+
+        self.assertCountEqual(
+            subscribed["room_ids"], [str(room.id) for room in self.rooms[:2]]
+        )
+        self.assertEqual(ack["type"], "send_message_ack")
+        self.assertEqual(broadcast["room_id"], str(self.rooms[1].id))
+        self.assertEqual(broadcast["data"]["id"], ack["data"]["id"])
+        self.assertEqual(rejected["type"], "error")
+        self.assertEqual(
+            PresenceManager.online_user_ids_many(room.id for room in self.rooms[:2]),
+            {str(room.id): set() for room in self.rooms[:2]},
+        )
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    PRESENCE={"BACKEND": "messaging.utils.presence.MemoryPresenceStore", "TTL": 60},
+)
+class PresenceTest(TransactionTestCase):
+    def setUp(self):
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.users: list[User] = []
+        for name in ["alice", "bob", "carol"]:
+            user = User.objects.create_user(email=f"{name}@example.com")
+            user.hq_user_data = {
+                "permissions": ["can_view_chat", "can_send_message"],
+                "subscription_payment_paid": True,
+            }
+            user.save()
+            _ = ChatRoomMember.objects.create(chat_room=self.room, user=user)
+            self.users.append(user)
+
+    def connect(self, user: User):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/chat/{self.room.id}/"
+        )
+        communicator.scope["user"] = user
+        return communicator
+
+    def test_presence_events_and_unread_counts(self):
+        alice, bob, carol = self.users
+
+        async def scenario():
+            alice_socket, bob_socket = self.connect(alice), self.connect(bob)
+            _ = await alice_socket.connect()
+            _ = await bob_socket.connect()
+            joined = await alice_socket.receive_json_from()
+
+            await alice_socket.send_json_to({"type": "heartbeat"})
+            heartbeat = await alice_socket.receive_json_from()
+
+            await alice_socket.send_json_to(
+                {"type": "send_message", "request_id": "r1", "data": {"text": "hi"}}
+            )
+            _ = await alice_socket.receive_json_from()
+            await process_outbox()
+            _ = await alice_socket.receive_json_from()
+
+            await bob_socket.disconnect()
+            left = await alice_socket.receive_json_from()
+            await alice_socket.disconnect()
+            return joined, heartbeat, left
+
+        with CaptureQueriesContext(connection) as queries:
+            joined, heartbeat, left = async_to_sync(scenario)()
+
+        self.assertEqual(joined["type"], "presence")
+        self.assertEqual(joined["user_id"], str(bob.pk))
+        self.assertTrue(joined["online"])
+        self.assertEqual(heartbeat["type"], "heartbeat_ack")
+        self.assertEqual(left["user_id"], str(bob.pk))
+        self.assertFalse(left["online"])
+        self.assertFalse(
+            any(
+                q["sql"].startswith("UPDATE") and '"online"' in q["sql"]
+                for q in queries
+            )
+        )
+
+        unread = dict(
+            ChatRoomMember.objects.filter(chat_room=self.room).values_list(
+                "user__email", "unread_count"
+            )
+        )
+        self.assertEqual(
+            unread,
+            {"alice@example.com": 0, "bob@example.com": 0, "carol@example.com": 1},
+        )
+        self.assertEqual(PresenceManager.online_user_ids(self.room.id), set())
+
+
+class EphemeralCoalescerTest(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.coalescer = EphemeralCoalescer(
+            rate=10, burst=3, interval=0.5, refresh=3.0, clock=lambda: self.now
+        )
+
+    def test_rate_limit(self):
+        self.assertEqual(
+            [self.coalescer.allow() for _ in range(4)], [True] * 3 + [False]
+        )
+        self.now += 0.1
+        self.assertTrue(self.coalescer.allow())
+        self.assertFalse(self.coalescer.allow())
+
+    def test_coalescing(self):
+        self.assertEqual(self.coalescer.offer("room", "typing", True), 0)
+        self.assertIsNone(self.coalescer.offer("room", "typing", True))
+
+        self.now = 0.2
+        self.assertEqual(self.coalescer.offer("room", "typing", False), 0.3)
+        self.assertIsNone(self.coalescer.offer("room", "typing", False))
+        self.assertEqual(self.coalescer.offer("room", "focus", True), 0)
+        self.now = 0.5
+        self.assertEqual(self.coalescer.flush("room", "typing"), (True, False))
+
+        # Toggling back within the window publishes nothing new.
+        self.now = 0.6
+        self.assertEqual(self.coalescer.offer("room", "typing", True), 0.4)
+        self.assertIsNone(self.coalescer.offer("room", "typing", False))
+        self.now = 1.0
+        self.assertEqual(self.coalescer.flush("room", "typing"), (False, False))
+
+        self.now = 3.6
+        self.assertEqual(self.coalescer.offer("room", "typing", False), 0)
+
+    def test_validation(self):
+        self.assertTrue(EphemeralCoalescer.is_valid("typing", True))
+        self.assertTrue(EphemeralCoalescer.is_valid("seen", str(uuid.uuid4())))
+        self.assertFalse(EphemeralCoalescer.is_valid("typing", "yes"))
+        self.assertFalse(EphemeralCoalescer.is_valid("seen", "not-a-uuid"))
+        self.assertFalse(EphemeralCoalescer.is_valid("shout", True))
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    PRESENCE={"BACKEND": "messaging.utils.presence.MemoryPresenceStore", "TTL": 60},
+    EPHEMERAL_EVENTS={"RATE": 100, "BURST": 50, "INTERVAL": 0.05, "REFRESH": 3.0},
+)
+class EphemeralEventsTest(TransactionTestCase):
+    def setUp(self):
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.users: list[User] = []
+        for name in ["alice", "bob"]:
+            user = User.objects.create_user(email=f"{name}@example.com")
+            user.hq_user_data = {
+                "permissions": ["can_view_chat", "can_send_message"],
+                "subscription_payment_paid": True,
+            }
+            user.save()
+            _ = ChatRoomMember.objects.create(chat_room=self.room, user=user)
+            self.users.append(user)
+
+    def test_keystrokes_are_coalesced(self):
+        alice, bob = self.users
+
+        async def scenario():
+            sockets = []
+            for user in self.users:
+                communicator = WebsocketCommunicator(
+                    URLRouter(websocket_urlpatterns), f"/ws/chat/{self.room.id}/"
+                )
+                communicator.scope["user"] = user
+                _ = await communicator.connect()
+                sockets.append(communicator)
+            alice_socket, bob_socket = sockets
+            _ = await alice_socket.receive_json_from()
+
+            for _ in range(10):
+                await alice_socket.send_json_to(
+                    {"type": "ephemeral", "kind": "typing", "value": True}
+                )
+            await alice_socket.send_json_to(
+                {"type": "ephemeral", "kind": "typing", "value": False}
+            )
+            started = await bob_socket.receive_json_from()
+            stopped = await bob_socket.receive_json_from()
+            bob_nothing_else = await bob_socket.receive_nothing()
+            alice_no_echo = await alice_socket.receive_nothing()
+
+            await alice_socket.send_json_to(
+                {"type": "ephemeral", "kind": "shout", "value": True}
+            )
+            invalid = await alice_socket.receive_json_from()
+            await alice_socket.send_to(text_data="raw text")
+            raw = await alice_socket.receive_json_from()
+
+            for communicator in sockets:
+                await communicator.disconnect()
+            return started, stopped, bob_nothing_else, alice_no_echo, invalid, raw
+
+        started, stopped, bob_nothing_else, alice_no_echo, invalid, raw = async_to_sync(
+            scenario
+        )()
+
+        self.assertEqual(
+            started,
+            {
+                "type": "ephemeral",
+                "room_id": str(self.room.id),
+                "user_id": str(alice.pk),
+                "kind": "typing",
+                "value": True,
+            },
+        )
+        self.assertFalse(stopped["value"])
+        self.assertTrue(bob_nothing_else)
+        self.assertTrue(alice_no_echo)
+        self.assertEqual(invalid["type"], "error")
+        self.assertEqual(raw["type"], "error")
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    PRESENCE={"BACKEND": "messaging.utils.presence.MemoryPresenceStore", "TTL": 60},
+    SEND_QUEUE={"BATCH_WINDOW": 0.05, "BATCH_SIZE": 2},
+)
+class BatchedEventsTest(TransactionTestCase):
+    def setUp(self):
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.user = User.objects.create_user(email="batch@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        _ = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+
+    def test_events_are_sent_as_arrays(self):
+        broadcast = database_sync_to_async(ChatMessageManager.broadcast)
+
+        async def scenario():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f"/ws/chat/{self.room.id}/?batch=1"
+            )
+            communicator.scope["user"] = self.user
+            _ = await communicator.connect()
+
+            await communicator.send_json_to({"type": "heartbeat"})
+            ack = await communicator.receive_json_from()
+
+            for index in range(3):
+                await broadcast(
+                    self.room.id,
+                    {"type": "clear_unread", "room_id": str(self.room.id), "n": index},
+                )
+            frames = [
+                await communicator.receive_json_from(),
+                await communicator.receive_json_from(),
+            ]
+            nothing_else = await communicator.receive_nothing()
+
+            await communicator.disconnect()
+            return ack, frames, nothing_else
+
+        ack, frames, nothing_else = async_to_sync(scenario)()
+
+        self.assertEqual(ack, {"type": "heartbeat_ack"})
+        self.assertEqual(
+            [[event["n"] for event in frame] for frame in frames], [[0, 1], [2]]
+        )
+        self.assertTrue(nothing_else)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class SendQueueTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        SendQueueMetrics.flush()
+        _ = SendQueueMetrics.stats(reset=True)
+        self.now = 0.0
+        self.queue = SendQueue(
+            max_size=3,
+            max_lag=5.0,
+            policies={"chat_message_edit": "collapse", "ephemeral": "drop"},
+            clock=lambda: self.now,
+        )
+
+    def put(self, event_type: str, key: Optional[str] = None) -> bool:
+        return self.queue.put(event_type, key, f"{event_type}:{key}")
+
+    def test_collapse_and_drop(self):
+        self.assertTrue(self.put("chat_message_edit", "m1"))
+        self.assertTrue(self.put("ephemeral", "typing"))
+        self.assertTrue(self.put("chat_message_edit", "m1"))
+        self.assertTrue(self.put("chat_message", "a"))
+        self.assertEqual(len(self.queue), 3)
+
+        # Full: new droppable events are discarded, others evict them.
+        self.assertTrue(self.put("ephemeral", "focus"))
+        self.assertTrue(self.put("chat_message", "b"))
+        self.assertFalse(self.put("chat_message", "c"))
+        self.assertEqual(
+            [self.queue.pop() for _ in range(3)],
+            ["chat_message_edit:m1", "chat_message:a", "chat_message:b"],
+        )
+
+        SendQueueMetrics.flush()
+        stats = SendQueueMetrics.stats(reset=True)
+        self.assertEqual(stats["collapsed"], 1)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual(stats["max_depth"], 3)
+
+    def test_lag(self):
+        self.assertTrue(self.put("chat_message"))
+        self.now = 4.0
+        self.assertTrue(self.put("chat_message"))
+        self.now = 6.0
+        self.assertFalse(self.put("chat_message"))
+        _ = self.queue.pop()
+        self.assertTrue(self.put("chat_message"))
+
+    @override_settings(SEND_QUEUE={"MAX_SIZE": 2, "MAX_LAG": 30.0})
+    def test_stalled_socket_is_closed(self):
+        class StalledConsumer(ChatConsumer):
+            async def send(self, *args: Any, **kwargs: Any):
+                await asyncio.Event().wait()
+
+            async def close(self, code: Any = None, reason: Any = None):
+                self.closed_with = code
+
+        async def scenario():
+            consumer = StalledConsumer()
+            consumer.writer = asyncio.create_task(consumer.write_frames())
+            event = ChatMessageManager.group_event(
+                {"type": "chat_message", "room_id": "room", "data": {}}
+            )
+            for _ in range(4):
+                await consumer.chat_message(event)
+                await asyncio.sleep(0)
+            return consumer
+
+        consumer = async_to_sync(scenario)()
+
+        self.assertEqual(consumer.closed_with, ChatConsumer.slow_close_code)
+        self.assertIsNone(consumer.send_queue)
+        self.assertEqual(SendQueueMetrics.stats()["disconnected"], 1)
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    PRESENCE={"BACKEND": "messaging.utils.presence.MemoryPresenceStore", "TTL": 60},
+)
+class UserGroupTest(TransactionTestCase):
+    def setUp(self):
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.users: list[User] = []
+        for name in ["alice", "bob"]:
+            user = User.objects.create_user(email=f"{name}@example.com")
+            user.hq_user_data = {
+                "permissions": ["can_view_chat", "can_send_message"],
+                "subscription_payment_paid": True,
+            }
+            user.save()
+            self.users.append(user)
+        self.sender = ChatRoomMember.objects.create(
+            chat_room=self.room, user=self.users[0]
+        )
+
+    def test_unread_and_membership_events_reach_unsubscribed_sockets(self):
+        alice, bob = self.users
+
+        async def scenario():
+            inbox = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), "/ws/inbox/"
+            )
+            inbox.scope["user"] = bob
+            _ = await inbox.connect()
+
+            _ = await database_sync_to_async(ChatRoomMember.objects.create)(
+                chat_room=self.room, user=bob
+            )
+            joined = await inbox.receive_json_from()
+
+            for text in ["one", "two"]:
+                _ = await database_sync_to_async(ChatMessageManager.create_message)(
+                    self.room, self.sender, {"text": text}
+                )
+            await process_outbox()
+            unread = await inbox.receive_json_from()
+
+            client = APIClient()
+            client.force_authenticate(bob)
+            response = await database_sync_to_async(client.delete)(
+                f"/messaging/chat/{self.room.id}/clear_unread/"
+            )
+            cleared = await inbox.receive_json_from()
+            # Nothing was unread the second time, so there is no event.
+            _ = await database_sync_to_async(client.delete)(
+                f"/messaging/chat/{self.room.id}/clear_unread/"
+            )
+            nothing_else = await inbox.receive_nothing()
+
+            await inbox.disconnect()
+            return joined, unread, response, cleared, nothing_else
+
+        joined, unread, response, cleared, nothing_else = async_to_sync(scenario)()
+
+        self.assertEqual(joined["type"], "membership")
+        self.assertTrue(joined["member"])
+        self.assertEqual(
+            unread,
+            {"type": "unread", "room_id": str(self.room.id), "unread": 2, "delta": 2},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(cleared["unread"], 0)
+        self.assertEqual(cleared["delta"], -2)
+        self.assertTrue(nothing_else)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class ChatMembershipCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email="member@example.com")
+        self.user.hq_user_data = {
+            "permissions": ["can_view_chat", "can_send_message"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.room = ChatRoom.objects.create(type=ChatRoomType.GroupChat)
+        self.member = ChatRoomMember.objects.create(chat_room=self.room, user=self.user)
+
+    def test_permission_checks_are_cached_until_membership_changes(self):
+        request = APIRequestFactory().get("/")
+        request.user = self.user
+        view = SimpleNamespace(kwargs={"chat_pk": str(self.room.id).upper()})
+
+        self.assertTrue(CanSendMessagePermission().has_permission(request, view))
+        with self.assertNumQueries(0):
+            self.assertTrue(CanSendMessagePermission().has_permission(request, view))
+            self.assertTrue(CanViewMessagePermission().has_permission(request, view))
+
+        self.member.active = False
+        self.member.save()
+        self.assertFalse(CanSendMessagePermission().has_permission(request, view))
+        self.assertTrue(CanViewMessagePermission().has_permission(request, view))
+
+        _ = self.member.delete()
+        self.assertFalse(CanViewMessagePermission().has_permission(request, view))
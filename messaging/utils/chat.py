@@ -0,0 +1,395 @@
+import orjson
+import uuid
+from itertools import groupby
+from typing import Any, Optional, cast
+from asgiref.sync import async_to_sync
+from channels.layers import BaseChannelLayer, get_channel_layer
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Greatest
+
+from messaging.models.chat import (
+    ChatRoom,
+    ChatRoomMember,
+    ChatRoomMessage,
+    ChatRoomMessageOutbox,
+)
+from messaging.serializers.chat import ChatRoomMessageDetailSerializer
+from messaging.utils.presence import PresenceManager
+from messaging.utils.recent import RecentMessagesCache
+from messaging.utils.sendqueue import SendQueue
+
+
+class ChatMembershipCache:
+    """
+    Caches whether a user is an active, inactive or non-member of a room so
+    permission checks skip the ChatRoomMember lookup. Entries are dropped by
+    the ChatRoomMember signal handlers whenever a membership changes.
+    """
+
+    key_prefix = "chat:member:"
+    timeout = 300
+
+    ACTIVE = "active"
+    INACTIVE = "inactive"
+    NONE = "none"
+
+    @classmethod
+    def key(cls, chat_room_id: Any, user_id: Any) -> str:
+        # Room ids from URLs may be spelled differently from the stored UUID.
+        try:
+            chat_room_id = uuid.UUID(str(chat_room_id))
+        except ValueError:
+            pass
+        return f"{cls.key_prefix}{chat_room_id}:{user_id}"
+
+    @classmethod
+    def get_state(cls, chat_room_id: Any, user_id: Any) -> str:
+        key = cls.key(chat_room_id, user_id)
+        state = cache.get(key)
+        if state is None:
+            active = (
+                ChatRoomMember.objects.filter(chat_room__id=chat_room_id, user=user_id)
+                .values_list("active", flat=True)
+                .first()
+            )
+            state = (
+                cls.NONE if active is None else cls.ACTIVE if active else cls.INACTIVE
+            )
+            cache.set(key, state, cls.timeout)
+        return state
+
+    @classmethod
+    def is_member(cls, chat_room_id: Any, user_id: Any) -> bool:
+        return cls.get_state(chat_room_id, user_id) != cls.NONE
+
+    @classmethod
+    def is_active_member(cls, chat_room_id: Any, user_id: Any) -> bool:
+        return cls.get_state(chat_room_id, user_id) == cls.ACTIVE
+
+    @classmethod
+    def invalidate(cls, chat_room_id: Any, user_id: Any):
+        cache.delete(cls.key(chat_room_id, user_id))
+
+
+class ChatMessageManager:
+    @classmethod
+    def group_name(cls, chat_room_id: Any) -> str:
+        return f"chat_{chat_room_id}"
+
+    @classmethod
+    def user_group_name(cls, user_id: Any) -> str:
+        return f"user_{user_id}"
+
+    @classmethod
+    def unread_event(cls, chat_room_id: Any, unread: int, delta: int) -> dict[str, Any]:
+        """
+        Compact badge update sent to a member's `user_{id}` group.
+        """
+        return {
+            "type": "unread",
+            "room_id": str(chat_room_id),
+            "unread": unread,
+            "delta": delta,
+        }
+
+    @classmethod
+    def group_event(cls, event: dict[str, Any]) -> dict[str, Any]:
+        """
+        Encodes `event` once for the whole group. Consumers forward `payload`
+        to their sockets verbatim instead of re-serializing it per receiver.
+        """
+        group_event = {"type": event["type"], "payload": orjson.dumps(event)}
+        collapse_key = SendQueue.collapse_key(event)
+        if collapse_key is not None:
+            group_event["key"] = collapse_key
+        return group_event
+
+    @classmethod
+    def broadcast(cls, chat_room_id: Any, event: dict[str, Any]):
+        channel_layer = cast(BaseChannelLayer, get_channel_layer())
+        async_to_sync(channel_layer.group_send)(
+            cls.group_name(chat_room_id), cls.group_event(event)
+        )
+
+    @classmethod
+    def notify_user(cls, user_id: Any, event: dict[str, Any]):
+        channel_layer = cast(BaseChannelLayer, get_channel_layer())
+        async_to_sync(channel_layer.group_send)(
+            cls.user_group_name(user_id), cls.group_event(event)
+        )
+
+    @classmethod
+    def create_message(
+        cls,
+        chat_room: ChatRoom,
+        sender: Optional[ChatRoomMember],
+        validated_data: dict[str, Any],
+    ) -> tuple[ChatRoomMessage, bool]:
+        """
+        Stores a message together with its outbox row and returns it with
+        whether it was created. Read-state updates and the broadcast happen
+        later in `process_outbox`.
+
+        A send repeating an earlier `client_key` of the same sender returns the
+        original message and is not queued again.
+        """
+        client_key = validated_data.get("client_key")
+        if client_key is not None:
+            existing = cls.message_for_client_key(chat_room, sender, client_key)
+            if existing is not None:
+                return existing, False
+
+        try:
+            with transaction.atomic():
+                message = ChatRoomMessage.objects.create(
+                    **validated_data, chat_room=chat_room, sender=sender
+                )
+                _ = ChatRoomMessageOutbox.objects.create(message=message)
+        except IntegrityError:
+            # A concurrent retry with the same key won the insert.
+            existing = (
+                cls.message_for_client_key(chat_room, sender, client_key)
+                if client_key is not None
+                else None
+            )
+            if existing is None:
+                raise
+            return existing, False
+
+        RecentMessagesCache.message_created(
+            chat_room.pk,
+            ChatRoomMessageDetailSerializer(message).data,
+            message.sequence,
+        )
+        return message, True
+
+    @classmethod
+    def message_for_client_key(
+        cls, chat_room: ChatRoom, sender: Optional[ChatRoomMember], client_key: str
+    ) -> Optional[ChatRoomMessage]:
+        return (
+            ChatRoomMessage.objects.select_related("sender__user__profile")
+            .filter(chat_room=chat_room, sender=sender, client_key=client_key)
+            .first()
+        )
+
+    @classmethod
+    def process_outbox(cls, batch_size: int = 500) -> int:
+        """
+        Drains up to `batch_size` outbox rows and returns how many were handled.
+
+        Rows are locked with SKIP LOCKED so several workers can run side by
+        side. If the broadcast fails the transaction rolls back and the batch is
+        retried, so delivery is at-least-once; clients dedupe on message id.
+        Members whose unread count changed also get an `unread` event.
+        """
+        with transaction.atomic():
+            outbox = list(
+                ChatRoomMessageOutbox.objects.select_for_update(
+                    skip_locked=True, of=("self",)
+                )
+                .select_related("message__sender__user__profile")
+                .order_by("id")[:batch_size]
+            )
+            if not outbox:
+                return 0
+
+            messages = sorted(
+                (entry.message for entry in outbox),
+                key=lambda message: (str(message.chat_room_id), message.sequence),
+            )
+            online = PresenceManager.online_user_ids_many(
+                {message.chat_room_id for message in messages}
+            )
+
+            events: list[tuple[str, dict[str, Any]]] = []
+            for chat_room_id, room_messages in groupby(
+                messages, key=lambda message: message.chat_room_id
+            ):
+                room_online = Q(user_id__in=online[str(chat_room_id)], active=True)
+                unread_before = cls.unread_counts(chat_room_id)
+                for message in room_messages:
+                    cls.update_read_state(message, room_online)
+                    events.append(
+                        (
+                            cls.group_name(chat_room_id),
+                            cls.group_event(
+                                {
+                                    "type": "chat_message",
+                                    "room_id": str(chat_room_id),
+                                    "data": ChatRoomMessageDetailSerializer(
+                                        message
+                                    ).data,
+                                }
+                            ),
+                        )
+                    )
+
+                events.extend(cls.unread_events(chat_room_id, unread_before))
+
+            cls.send_events(events)
+
+            _ = ChatRoomMessageOutbox.objects.filter(
+                pk__in=[entry.pk for entry in outbox]
+            ).delete()
+
+        return len(outbox)
+
+    @classmethod
+    def bulk_create_messages(
+        cls,
+        chat_room: ChatRoom,
+        sender: ChatRoomMember,
+        messages_data: list[dict[str, Any]],
+        batch_size: int = 1000,
+    ) -> list[ChatRoomMessage]:
+        """
+        Stores many messages from one sender in a single transaction and
+        returns the ones created. Messages repeating a `client_key` already
+        used by the sender, or earlier in `messages_data`, are skipped.
+
+        Instead of one outbox row and broadcast per message, read state is
+        updated once for the whole batch and the room gets a single
+        `chat_message_batch` event with the sequence range to `sync`.
+        """
+        with transaction.atomic():
+            # Single sends insert under the same room row lock, so once it is
+            # held the duplicate check below cannot race them.
+            _ = ChatRoom.objects.select_for_update().only("pk").get(pk=chat_room.pk)
+            client_keys = {
+                data["client_key"]
+                for data in messages_data
+                if data.get("client_key") is not None
+            }
+            seen_keys = (
+                set(
+                    ChatRoomMessage.objects.filter(
+                        chat_room=chat_room,
+                        sender=sender,
+                        client_key__in=client_keys,
+                    ).values_list("client_key", flat=True)
+                )
+                if client_keys
+                else set()
+            )
+            pending: list[dict[str, Any]] = []
+            for data in messages_data:
+                client_key = data.get("client_key")
+                if client_key is not None:
+                    if client_key in seen_keys:
+                        continue
+                    seen_keys.add(client_key)
+                pending.append(data)
+            if not pending:
+                return []
+
+            first_sequence = ChatRoom.allocate_sequence(chat_room.pk, len(pending))
+            messages = ChatRoomMessage.objects.bulk_create(
+                [
+                    ChatRoomMessage(
+                        **data,
+                        chat_room=chat_room,
+                        sender=sender,
+                        sequence=first_sequence + index,
+                        change_sequence=first_sequence + index,
+                    )
+                    for index, data in enumerate(pending)
+                ],
+                batch_size=batch_size,
+            )
+            ChatRoom.set_last_message(messages[-1])
+
+            unread_before = cls.unread_counts(chat_room.pk)
+            online = PresenceManager.online_user_ids(chat_room.pk)
+            cls.update_read_state(
+                messages[-1],
+                Q(user_id__in=online, active=True),
+                count=len(messages),
+            )
+            events = [
+                (
+                    cls.group_name(chat_room.pk),
+                    cls.group_event(
+                        {
+                            "type": "chat_message_batch",
+                            "room_id": str(chat_room.pk),
+                            "count": len(messages),
+                            "first_sequence": messages[0].sequence,
+                            "last_sequence": messages[-1].sequence,
+                        }
+                    ),
+                ),
+                *cls.unread_events(chat_room.pk, unread_before),
+            ]
+            transaction.on_commit(lambda: cls.send_events(events), robust=True)
+            RecentMessagesCache.invalidate(chat_room.pk)
+
+        return messages
+
+    @classmethod
+    def send_events(cls, events: list[tuple[str, dict[str, Any]]]):
+        channel_layer = cast(BaseChannelLayer, get_channel_layer())
+        for group_name, event in events:
+            async_to_sync(channel_layer.group_send)(group_name, event)
+
+    @classmethod
+    def unread_events(
+        cls, chat_room_id: Any, unread_before: dict[Any, int]
+    ) -> list[tuple[str, dict[str, Any]]]:
+        """
+        Builds `unread` events for the members whose count differs from
+        `unread_before`.
+        """
+        events: list[tuple[str, dict[str, Any]]] = []
+        for user_id, unread in cls.unread_counts(chat_room_id).items():
+            delta = unread - unread_before.get(user_id, 0)
+            if delta:
+                events.append(
+                    (
+                        cls.user_group_name(user_id),
+                        cls.group_event(cls.unread_event(chat_room_id, unread, delta)),
+                    )
+                )
+        return events
+
+    @classmethod
+    def unread_counts(cls, chat_room_id: Any) -> dict[Any, int]:
+        return dict(
+            ChatRoomMember.objects.filter(
+                chat_room=chat_room_id, user__isnull=False
+            ).values_list("user_id", "unread_count")
+        )
+
+    @classmethod
+    def update_read_state(cls, message: ChatRoomMessage, online: Q, count: int = 1):
+        """
+        Online members and the sender have read the message when they had
+        nothing unread before it; their watermark moves up to it. Everyone
+        else except the sender gets `count` unread messages, `message` being
+        the latest of them: a watermark cannot skip older unread messages, so
+        an online member who is behind stays behind. Members whose watermark
+        already covers the message (they cleared their unread messages before
+        this ran) are left as they are. All members' rooms move up to the
+        message's time in their activity order.
+        """
+        members = ChatRoomMember.objects.filter(chat_room=message.chat_room_id)
+
+        last_activity_at = Greatest(F("last_activity_at"), Value(message.date_added))
+        unread = Q(last_read_at__lt=message.date_added) | Q(last_read_at__isnull=True)
+        caught_up = unread & Q(unread_count=0) & (online | Q(pk=message.sender_id))
+
+        _ = members.filter(caught_up).update(
+            last_read_message=message,
+            last_read_at=message.date_added,
+            last_activity_at=last_activity_at,
+        )
+        _ = members.exclude(caught_up).update(
+            unread_count=F("unread_count")
+            + Case(
+                When(unread & ~Q(pk=message.sender_id), then=Value(count)),
+                default=Value(0),
+            ),
+            last_activity_at=last_activity_at,
+        )
@@ -0,0 +1,110 @@
+import time
+import uuid
+from typing import Any, Callable, Optional, cast
+from django.conf import settings
+
+
+class EphemeralCoalescer:
+    """
+    Per-connection throttle for ephemeral signals (typing, focus, seen).
+
+    Frames first pass a token bucket of `rate` frames per second with room for
+    `burst`. Each (room, kind) is then published at most once per `interval`:
+    a change inside the window replaces the pending value and goes out when
+    the window ends, and repeating the published value is only passed on
+    after `refresh` seconds so peers can expire stale typing indicators.
+    Nothing here touches the database or the channel layer.
+    """
+
+    kinds: dict[str, Callable[[Any], bool]] = {
+        "typing": lambda value: isinstance(value, bool),
+        "focus": lambda value: isinstance(value, bool),
+        "seen": lambda value: is_uuid(value),
+    }
+
+    def __init__(
+        self,
+        rate: float = 10,
+        burst: int = 20,
+        interval: float = 0.5,
+        refresh: float = 3.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.interval = interval
+        self.refresh = refresh
+        self.clock = clock
+        self.tokens = float(burst)
+        self.refilled_at = clock()
+        self.published: dict[tuple[str, str], tuple[Any, float]] = {}
+        self.pending: dict[tuple[str, str], Any] = {}
+
+    @classmethod
+    def from_settings(cls) -> "EphemeralCoalescer":
+        options = cast(dict[str, Any], getattr(settings, "EPHEMERAL_EVENTS", {}))
+        return cls(**{k.lower(): v for k, v in options.items()})
+
+    @classmethod
+    def is_valid(cls, kind: Any, value: Any) -> bool:
+        return kind in cls.kinds and cls.kinds[kind](value)
+
+    def allow(self) -> bool:
+        now = self.clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.refilled_at) * self.rate
+        )
+        self.refilled_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def offer(self, room_id: str, kind: str, value: Any) -> Optional[float]:
+        """
+        Returns 0 to publish `value` now, the seconds to wait before calling
+        `flush` when it was deferred, or None when it adds nothing.
+        """
+        key = (room_id, kind)
+        now = self.clock()
+        published = self.published.get(key)
+        if published is None:
+            self.published[key] = (value, now)
+            return 0
+
+        published_value, published_at = published
+        elapsed = now - published_at
+        if value == published_value and key not in self.pending:
+            if elapsed < self.refresh:
+                return None
+        if elapsed >= self.interval:
+            _ = self.pending.pop(key, None)
+            self.published[key] = (value, now)
+            return 0
+
+        already_waiting = key in self.pending
+        self.pending[key] = value
+        return None if already_waiting else self.interval - elapsed
+
+    def flush(self, room_id: str, kind: str) -> tuple[bool, Any]:
+        """
+        Takes the pending value of a deferred signal; returns whether it
+        should be published and the value.
+        """
+        key = (room_id, kind)
+        if key not in self.pending:
+            return False, None
+
+        value = self.pending.pop(key)
+        if value == self.published[key][0]:
+            return False, value
+        self.published[key] = (value, self.clock())
+        return True, value
+
+
+def is_uuid(value: Any) -> bool:
+    try:
+        _ = uuid.UUID(str(value))
+    except ValueError:
+        return False
+    return isinstance(value, str)
@@ -0,0 +1,120 @@
+import csv
+import orjson
+from datetime import datetime
+from typing import Any, AsyncIterator, Iterable, Iterator, Optional
+from asgiref.sync import sync_to_async
+
+from messaging.models.chat import ChatRoomMessage
+
+
+class EchoBuffer:
+    """
+    File-like object for `csv.writer` that hands each written row back
+    instead of storing it.
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+class ChatHistoryExporter:
+    """
+    Writes a room's history as NDJSON or CSV without loading it into memory.
+    Rows are read through a server-side cursor with the sender profile joined
+    in, encoded one by one and grouped into chunks of roughly `chunk_bytes`.
+    """
+
+    CONTENT_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+    columns = {
+        "id": "id",
+        "sequence": "sequence",
+        "date_added": "date_added",
+        "last_updated": "last_updated",
+        "sender_email": "sender__user__email",
+        "sender_username": "sender__user__profile__username",
+        "sender_first_name": "sender__user__profile__first_name",
+        "sender_last_name": "sender__user__profile__last_name",
+        "text": "text",
+        "url": "url",
+        "url_content_type": "url_content_type",
+    }
+
+    @classmethod
+    def rows(
+        cls,
+        chat_room_id: Any,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        chunk_size: int = 2000,
+    ) -> Iterator[tuple[Any, ...]]:
+        messages = ChatRoomMessage.objects.filter(chat_room__id=chat_room_id)
+        if since is not None:
+            messages = messages.filter(date_added__gte=since)
+        if until is not None:
+            messages = messages.filter(date_added__lt=until)
+
+        return (
+            messages.order_by("date_added", "id")
+            .values_list(*cls.columns.values())
+            .iterator(chunk_size=chunk_size)
+        )
+
+    @classmethod
+    def lines(
+        cls, rows: Iterable[tuple[Any, ...]], file_format: str
+    ) -> Iterator[bytes]:
+        names = list(cls.columns)
+        if file_format == "ndjson":
+            for row in rows:
+                yield orjson.dumps(dict(zip(names, row))) + b"\n"
+            return
+
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(names).encode()
+        for row in rows:
+            yield writer.writerow(
+                [
+                    value.isoformat() if isinstance(value, datetime) else value
+                    for value in row
+                ]
+            ).encode()
+
+    @classmethod
+    def chunks(
+        cls, lines: Iterable[bytes], chunk_bytes: int = 64 * 1024
+    ) -> Iterator[bytes]:
+        chunk: list[bytes] = []
+        size = 0
+        for line in lines:
+            chunk.append(line)
+            size += len(line)
+            if size >= chunk_bytes:
+                yield b"".join(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield b"".join(chunk)
+
+    @classmethod
+    def export(
+        cls,
+        chat_room_id: Any,
+        file_format: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        chunk_size: int = 2000,
+    ) -> Iterator[bytes]:
+        return cls.chunks(
+            cls.lines(cls.rows(chat_room_id, since, until, chunk_size), file_format)
+        )
+
+    @classmethod
+    async def astream(cls, chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+        """
+        Serves `chunks` to an ASGI response. Each chunk is read on the
+        request's sync thread so the server-side cursor stays on one
+        connection, and nothing is buffered beyond the current chunk.
+        """
+        read_chunk = sync_to_async(lambda: next(chunks, None))
+        while (chunk := await read_chunk()) is not None:
+            yield chunk
@@ -0,0 +1,230 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Iterable, cast
+from django.conf import settings
+from django.utils.module_loading import import_string
+from redis import Redis
+
+
+class PresenceStore(ABC):
+    """
+    Tracks which connections are live in which rooms. Every connection is an
+    entry that expires `ttl` seconds after its last heartbeat, so sockets on a
+    crashed worker drop out on their own.
+    """
+
+    def __init__(self, ttl: int = 60, **kwargs: Any):
+        self.ttl = ttl
+
+    def entry(self, user_id: Any, connection: str) -> str:
+        return f"{user_id}:{connection}"
+
+    def entry_user_id(self, entry: str) -> str:
+        return entry.split(":", 1)[0]
+
+    @abstractmethod
+    def connect(
+        self, room_ids: Iterable[str], user_id: Any, connection: str
+    ) -> list[str]:
+        """
+        Registers a connection and returns the rooms the user came online in.
+        """
+
+    @abstractmethod
+    def disconnect(
+        self, room_ids: Iterable[str], user_id: Any, connection: str
+    ) -> list[str]:
+        """
+        Removes a connection and returns the rooms the user went offline in.
+        """
+
+    @abstractmethod
+    def heartbeat(self, room_ids: Iterable[str], user_id: Any, connection: str): ...
+
+    @abstractmethod
+    def online_user_ids(self, room_ids: Iterable[str]) -> dict[str, set[str]]: ...
+
+
+class RedisPresenceStore(PresenceStore):
+    """
+    Keeps one sorted set per room in the channel layer Redis, scored by
+    expiry time.
+    """
+
+    key_prefix = "presence:room:"
+
+    def __init__(self, ttl: int = 60, hosts: Any = None, **kwargs: Any):
+        super().__init__(ttl)
+        if hosts is None:
+            hosts = settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"]
+        host = hosts[0]
+        if isinstance(host, str):
+            self.client = Redis.from_url(host, decode_responses=True)
+        else:
+            self.client = Redis(host=host[0], port=host[1], decode_responses=True)
+
+    def key(self, room_id: str) -> str:
+        return f"{self.key_prefix}{room_id}"
+
+    def connect(
+        self, room_ids: Iterable[str], user_id: Any, connection: str
+    ) -> list[str]:
+        room_ids = list(room_ids)
+        now = time.time()
+        entry = self.entry(user_id, connection)
+
+        pipeline = self.client.pipeline()
+        for room_id in room_ids:
+            _ = pipeline.zrangebyscore(self.key(room_id), now, "+inf")
+            _ = pipeline.zadd(self.key(room_id), {entry: now + self.ttl})
+            _ = pipeline.expire(self.key(room_id), self.ttl)
+        results = pipeline.execute()
+
+        user_id = str(user_id)
+        return [
+            room_id
+            for room_id, entries in zip(room_ids, results[::3])
+            if not any(self.entry_user_id(e) == user_id for e in entries)
+        ]
+
+    def disconnect(
+        self, room_ids: Iterable[str], user_id: Any, connection: str
+    ) -> list[str]:
+        room_ids = list(room_ids)
+        now = time.time()
+        entry = self.entry(user_id, connection)
+
+        pipeline = self.client.pipeline()
+        for room_id in room_ids:
+            _ = pipeline.zrem(self.key(room_id), entry)
+            _ = pipeline.zrangebyscore(self.key(room_id), now, "+inf")
+        results = pipeline.execute()
+
+        user_id = str(user_id)
+        return [
+            room_id
+            for room_id, entries in zip(room_ids, results[1::2])
+            if not any(self.entry_user_id(e) == user_id for e in entries)
+        ]
+
+    def heartbeat(self, room_ids: Iterable[str], user_id: Any, connection: str):
+        expires = time.time() + self.ttl
+        entry = self.entry(user_id, connection)
+
+        pipeline = self.client.pipeline()
+        for room_id in room_ids:
+            _ = pipeline.zadd(self.key(room_id), {entry: expires})
+            _ = pipeline.expire(self.key(room_id), self.ttl)
+        _ = pipeline.execute()
+
+    def online_user_ids(self, room_ids: Iterable[str]) -> dict[str, set[str]]:
+        room_ids = [str(room_id) for room_id in room_ids]
+        now = time.time()
+
+        pipeline = self.client.pipeline()
+        for room_id in room_ids:
+            _ = pipeline.zremrangebyscore(self.key(room_id), "-inf", now)
+            _ = pipeline.zrange(self.key(room_id), 0, -1)
+        results = pipeline.execute()
+
+        return {
+            room_id: {self.entry_user_id(e) for e in entries}
+            for room_id, entries in zip(room_ids, results[1::2])
+        }
+
+
+class MemoryPresenceStore(PresenceStore):
+    """
+    Process-local store for tests and single-process development servers.
+    """
+
+    def __init__(self, ttl: int = 60, **kwargs: Any):
+        super().__init__(ttl)
+        self.rooms: dict[str, dict[str, float]] = {}
+        self.lock = threading.Lock()
+
+    def live_user_ids(self, room_id: str, now: float) -> set[str]:
+        entries = self.rooms.get(room_id, {})
+        return {
+            self.entry_user_id(entry)
+            for entry, expires in entries.items()
+            if expires > now
+        }
+
+    def connect(
+        self, room_ids: Iterable[str], user_id: Any, connection: str
+    ) -> list[str]:
+        now = time.time()
+        entry = self.entry(user_id, connection)
+        came_online: list[str] = []
+        with self.lock:
+            for room_id in room_ids:
+                if str(user_id) not in self.live_user_ids(room_id, now):
+                    came_online.append(room_id)
+                self.rooms.setdefault(room_id, {})[entry] = now + self.ttl
+        return came_online
+
+    def disconnect(
+        self, room_ids: Iterable[str], user_id: Any, connection: str
+    ) -> list[str]:
+        now = time.time()
+        entry = self.entry(user_id, connection)
+        went_offline: list[str] = []
+        with self.lock:
+            for room_id in room_ids:
+                _ = self.rooms.get(room_id, {}).pop(entry, None)
+                if str(user_id) not in self.live_user_ids(room_id, now):
+                    went_offline.append(room_id)
+        return went_offline
+
+    def heartbeat(self, room_ids: Iterable[str], user_id: Any, connection: str):
+        expires = time.time() + self.ttl
+        entry = self.entry(user_id, connection)
+        with self.lock:
+            for room_id in room_ids:
+                self.rooms.setdefault(room_id, {})[entry] = expires
+
+    def online_user_ids(self, room_ids: Iterable[str]) -> dict[str, set[str]]:
+        now = time.time()
+        with self.lock:
+            return {
+                str(room_id): self.live_user_ids(str(room_id), now)
+                for room_id in room_ids
+            }
+
+
+class PresenceManager:
+    """
+    Entry point to the configured presence store. Online state never touches
+    Postgres; see `settings.PRESENCE`.
+    """
+
+    _stores: dict[tuple[Any, ...], PresenceStore] = {}
+
+    @classmethod
+    def store(cls) -> PresenceStore:
+        presence_settings = cast(dict[str, Any], settings.PRESENCE)
+        key = tuple(sorted((k, repr(v)) for k, v in presence_settings.items()))
+        if key not in cls._stores:
+            options = {k.lower(): v for k, v in presence_settings.items()}
+            backend = import_string(options.pop("backend"))
+            cls._stores[key] = backend(**options)
+        return cls._stores[key]
+
+    @classmethod
+    def group_event(cls, room_id: str, user_id: Any, online: bool) -> dict[str, Any]:
+        return {
+            "type": "presence",
+            "room_id": str(room_id),
+            "user_id": str(user_id),
+            "online": online,
+        }
+
+    @classmethod
+    def online_user_ids(cls, room_id: Any) -> set[str]:
+        return cls.store().online_user_ids([str(room_id)])[str(room_id)]
+
+    @classmethod
+    def online_user_ids_many(cls, room_ids: Iterable[Any]) -> dict[str, set[str]]:
+        return cls.store().online_user_ids(str(room_id) for room_id in room_ids)
@@ -0,0 +1,398 @@
+import logging
+import orjson
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Optional, cast
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from redis import Redis, RedisError
+
+from messaging.models.chat import ChatRoom, ChatRoomMember, ChatRoomMessage
+from messaging.serializers.chat import (
+    ChatRoomMemberDetailSerializer,
+    ChatRoomMessageDetailSerializer,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RecentMessagesStore(ABC):
+    """
+    Holds, per room, the newest `size` serialized messages as an entry:
+
+        {"version": <ChatRoom.sequence>, "has_older": bool, "messages": [...]}
+
+    Messages are in chronological order, with `sender` reduced to the member
+    id. `version` is the room sequence the entry was built at; every insert,
+    edit and delete bumps it, so readers can tell a stale entry from a current
+    one without trusting the writers.
+    """
+
+    def __init__(self, size: int = 50, ttl: int = 3600, **kwargs: Any):
+        self.size = size
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, room_id: str) -> Optional[dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def set(self, room_id: str, entry: dict[str, Any]):
+        pass
+
+    @abstractmethod
+    def delete(self, room_id: str):
+        pass
+
+    @abstractmethod
+    def record(self, hit: bool):
+        pass
+
+    @abstractmethod
+    def stats(self, reset: bool = False) -> dict[str, int]:
+        pass
+
+
+class RedisRecentMessagesStore(RecentMessagesStore):
+    """
+    Keeps one key per room in the channel layer Redis; cold rooms expire after
+    `ttl` seconds. Hit and miss counts are buffered in-process and flushed to a
+    shared hash with the next read, so counting costs no extra round trip.
+    """
+
+    key_prefix = "messages:recent:"
+    stats_key = "messages:recent:stats"
+
+    def __init__(
+        self, size: int = 50, ttl: int = 3600, hosts: Any = None, **kwargs: Any
+    ):
+        super().__init__(size, ttl)
+        if hosts is None:
+            hosts = settings.CHANNEL_LAYERS["default"]["CONFIG"]["hosts"]
+        host = hosts[0]
+        if isinstance(host, str):
+            self.client = Redis.from_url(host)
+        else:
+            self.client = Redis(host=host[0], port=host[1])
+        self.pending = {"hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+
+    def key(self, room_id: str) -> str:
+        return f"{self.key_prefix}{room_id}"
+
+    def flush_stats(self, pipeline: Any):
+        with self.lock:
+            pending, self.pending = self.pending, {"hits": 0, "misses": 0}
+        for field, count in pending.items():
+            if count:
+                _ = pipeline.hincrby(self.stats_key, field, count)
+
+    def get(self, room_id: str) -> Optional[dict[str, Any]]:
+        pipeline = self.client.pipeline(transaction=False)
+        _ = pipeline.get(self.key(room_id))
+        self.flush_stats(pipeline)
+        payload = pipeline.execute()[0]
+        return None if payload is None else orjson.loads(payload)
+
+    def set(self, room_id: str, entry: dict[str, Any]):
+        _ = self.client.set(self.key(room_id), orjson.dumps(entry), ex=self.ttl)
+
+    def delete(self, room_id: str):
+        _ = self.client.delete(self.key(room_id))
+
+    def record(self, hit: bool):
+        with self.lock:
+            self.pending["hits" if hit else "misses"] += 1
+
+    def stats(self, reset: bool = False) -> dict[str, int]:
+        pipeline = self.client.pipeline()
+        self.flush_stats(pipeline)
+        _ = pipeline.hgetall(self.stats_key)
+        if reset:
+            _ = pipeline.delete(self.stats_key)
+        counts = pipeline.execute()[-2 if reset else -1]
+        return {
+            "hits": int(counts.get(b"hits", 0)),
+            "misses": int(counts.get(b"misses", 0)),
+        }
+
+
+class MemoryRecentMessagesStore(RecentMessagesStore):
+    """
+    Process-local store holding at most `rooms` rooms, evicting the least
+    recently used. Each process keeps its own copy and its own counters.
+    """
+
+    def __init__(
+        self, size: int = 50, ttl: int = 3600, rooms: int = 1000, **kwargs: Any
+    ):
+        super().__init__(size, ttl)
+        self.max_rooms = rooms
+        self.rooms: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self.counts = {"hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+
+    def get(self, room_id: str) -> Optional[dict[str, Any]]:
+        with self.lock:
+            cached = self.rooms.get(room_id)
+            if cached is None:
+                return None
+            expires_at, entry = cached
+            if expires_at <= time.time():
+                del self.rooms[room_id]
+                return None
+            self.rooms.move_to_end(room_id)
+            return entry
+
+    def set(self, room_id: str, entry: dict[str, Any]):
+        with self.lock:
+            self.rooms[room_id] = (time.time() + self.ttl, entry)
+            self.rooms.move_to_end(room_id)
+            while len(self.rooms) > self.max_rooms:
+                _ = self.rooms.popitem(last=False)
+
+    def delete(self, room_id: str):
+        with self.lock:
+            _ = self.rooms.pop(room_id, None)
+
+    def record(self, hit: bool):
+        with self.lock:
+            self.counts["hits" if hit else "misses"] += 1
+
+    def stats(self, reset: bool = False) -> dict[str, int]:
+        with self.lock:
+            counts = dict(self.counts)
+            if reset:
+                self.counts = {"hits": 0, "misses": 0}
+        return counts
+
+
+class RecentMessagesCache:
+    """
+    Serves the newest page of a room from the configured store; see
+    `settings.MESSAGE_CACHE`. A `BACKEND` of None turns the cache off.
+
+    Writers update entries in place after commit when they hold the entry's
+    next version, and drop them otherwise. Readers only trust an entry whose
+    version matches the room's current sequence, so a lost or raced write
+    costs a refill, never a stale page. Senders are not cached: membership and
+    profile edits do not bump the sequence, so they are loaded on every read.
+    Redis errors fall back to Postgres.
+    """
+
+    _stores: dict[tuple[Any, ...], Optional[RecentMessagesStore]] = {}
+
+    @classmethod
+    def store(cls) -> Optional[RecentMessagesStore]:
+        cache_settings = cast(dict[str, Any], settings.MESSAGE_CACHE)
+        key = tuple(sorted((k, repr(v)) for k, v in cache_settings.items()))
+        if key not in cls._stores:
+            options = {k.lower(): v for k, v in cache_settings.items()}
+            backend = options.pop("backend")
+            cls._stores[key] = import_string(backend)(**options) if backend else None
+        return cls._stores[key]
+
+    @classmethod
+    def newest_page(
+        cls, chat_room_id: Any, page_size: int
+    ) -> Optional[tuple[list[dict[str, Any]], bool]]:
+        """
+        Returns the newest `page_size` messages of the room and whether older
+        ones exist, or None when the page has to come from Postgres.
+        """
+        store = cls.store()
+        if store is None or page_size > store.size:
+            return None
+
+        room_id = str(chat_room_id)
+        version = cls.room_version(room_id)
+        if version is None:
+            return None
+
+        try:
+            entry = store.get(room_id)
+            hit = (
+                entry is not None
+                and entry["version"] == version
+                # Deletes can leave fewer messages than a full page.
+                and (page_size <= len(entry["messages"]) or not entry["has_older"])
+            )
+            if entry is not None and not hit:
+                store.delete(room_id)
+            store.record(hit)
+            if not hit:
+                entry = cls.build_entry(room_id, version, store.size)
+                if entry is not None:
+                    store.set(room_id, entry)
+        except RedisError:
+            logger.warning("Recent messages cache unavailable", exc_info=True)
+            return None
+
+        if entry is None:
+            return None
+        messages = cast(list[dict[str, Any]], entry["messages"])
+        return (
+            cls.attach_senders(messages[-page_size:]),
+            entry["has_older"] or len(messages) > page_size,
+        )
+
+    @classmethod
+    def attach_senders(cls, messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """
+        Replaces the cached sender ids with the members as they are now.
+        """
+        members = ChatRoomMember.objects.filter(
+            pk__in={message["sender"] for message in messages}
+        ).select_related("user__profile")
+        senders = {
+            str(member.pk): ChatRoomMemberDetailSerializer(member).data
+            for member in members
+        }
+        return [
+            {**message, "sender": senders[message["sender"]]} for message in messages
+        ]
+
+    @classmethod
+    def strip_sender(cls, data: dict[str, Any]) -> dict[str, Any]:
+        return {**data, "sender": str(data["sender"]["id"])}
+
+    @classmethod
+    def build_entry(
+        cls, room_id: str, version: int, size: int
+    ) -> Optional[dict[str, Any]]:
+        newest = list(
+            ChatRoomMessage.objects.filter(chat_room__id=room_id)
+            .select_related("sender__user__profile")
+            .order_by("-date_added", "-id")[: size + 1]
+        )
+        # Only cache what was read at `version`; a write in between makes
+        # the entry stale before it is stored.
+        if cls.room_version(room_id) != version:
+            return None
+
+        return {
+            "version": version,
+            "has_older": len(newest) > size,
+            "messages": [
+                cls.strip_sender(data)
+                for data in ChatRoomMessageDetailSerializer(
+                    reversed(newest[:size]), many=True
+                ).data
+            ],
+        }
+
+    @classmethod
+    def room_version(cls, room_id: str) -> Optional[int]:
+        return (
+            ChatRoom.objects.filter(pk=room_id)
+            .values_list("sequence", flat=True)
+            .first()
+        )
+
+    @classmethod
+    def message_created(cls, chat_room_id: Any, data: dict[str, Any], sequence: int):
+        """
+        Writes an inserted message (`data` as serialized by
+        ChatRoomMessageDetailSerializer) through after commit. `sequence` is
+        the room sequence the write allocated.
+        """
+
+        def apply(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            messages = [*messages, cls.strip_sender(data)]
+            messages.sort(key=cls.sort_key)
+            return messages
+
+        cls.on_commit(chat_room_id, sequence, apply)
+
+    @classmethod
+    def message_edited(cls, chat_room_id: Any, data: dict[str, Any], sequence: int):
+        """
+        Like `message_created` for an edit. Only a message already in the entry
+        is replaced: an older one would leave a gap in the newest page.
+        """
+
+        def apply(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            return [
+                cls.strip_sender(data) if message["id"] == data["id"] else message
+                for message in messages
+            ]
+
+        cls.on_commit(chat_room_id, sequence, apply)
+
+    @classmethod
+    def message_deleted(cls, chat_room_id: Any, message_id: Any, sequence: int):
+        def apply(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            return [message for message in messages if message["id"] != str(message_id)]
+
+        cls.on_commit(chat_room_id, sequence, apply)
+
+    @classmethod
+    def invalidate(cls, chat_room_id: Any):
+        store = cls.store()
+        if store is None:
+            return
+
+        room_id = str(chat_room_id)
+
+        def delete():
+            try:
+                store.delete(room_id)
+            except RedisError:
+                logger.warning("Recent messages cache unavailable", exc_info=True)
+
+        transaction.on_commit(delete, robust=True)
+
+    @classmethod
+    def on_commit(
+        cls,
+        chat_room_id: Any,
+        sequence: int,
+        apply: Callable[[list[dict[str, Any]]], list[dict[str, Any]]],
+    ):
+        store = cls.store()
+        if store is None:
+            return
+
+        room_id = str(chat_room_id)
+
+        def update():
+            try:
+                entry = store.get(room_id)
+                if entry is None:
+                    return
+                if entry["version"] != sequence - 1:
+                    store.delete(room_id)
+                    return
+
+                messages = apply(entry["messages"])
+                has_older = entry["has_older"] or len(messages) > store.size
+                store.set(
+                    room_id,
+                    {
+                        "version": sequence,
+                        "has_older": has_older,
+                        "messages": messages[-store.size :],
+                    },
+                )
+            except RedisError:
+                logger.warning("Recent messages cache unavailable", exc_info=True)
+
+        transaction.on_commit(update, robust=True)
+
+    @classmethod
+    def sort_key(cls, message: dict[str, Any]) -> tuple[datetime, str]:
+        return datetime.fromisoformat(message["date_added"]), message["id"]
+
+    @classmethod
+    def stats(cls, reset: bool = False) -> Optional[dict[str, Any]]:
+        store = cls.store()
+        if store is None:
+            return None
+
+        counts = store.stats(reset)
+        reads = counts["hits"] + counts["misses"]
+        return {**counts, "hit_rate": counts["hits"] / reads if reads else None}
@@ -0,0 +1,177 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, cast
+from django.conf import settings
+from django.core.cache import cache
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class SendQueue:
+    """
+    Bounded queue of frames waiting to be written to one socket.
+
+    Each event type has a policy:
+
+        "keep"      queued until sent (the default)
+        "collapse"  replaces a queued event with the same collapse key
+        "drop"      collapses too, and is discarded instead of queued when
+                    the queue is full; queued ones make room for other events
+
+    `put` returns False once the connection cannot keep up: the queue is full
+    of events that may not be dropped, or its oldest frame has waited longer
+    than `max_lag` seconds.
+
+    Sockets that negotiated batching receive up to `batch_size` frames at a
+    time, collected for `batch_window` seconds after the first one arrives.
+    """
+
+    collapse_keys: dict[str, Callable[[dict[str, Any]], str]] = {
+        "chat_message_edit": lambda event: f"{event['room_id']}:{event['data']['id']}",
+        "presence": lambda event: f"{event['room_id']}:{event['user_id']}",
+        "ephemeral": lambda event: (
+            f"{event['room_id']}:{event['user_id']}:{event['kind']}"
+        ),
+    }
+
+    def __init__(
+        self,
+        max_size: int = 500,
+        max_lag: float = 30.0,
+        policies: Optional[dict[str, str]] = None,
+        batch_window: float = 0.005,
+        batch_size: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.max_lag = max_lag
+        self.policies = policies or {}
+        self.batch_window = batch_window
+        self.batch_size = batch_size
+        self.clock = clock
+        # key -> [queued_at, event type, frame]
+        self.frames: OrderedDict[Hashable, list[Any]] = OrderedDict()
+        self.counter = itertools.count()
+
+    @classmethod
+    def from_settings(cls) -> "SendQueue":
+        options = cast(dict[str, Any], getattr(settings, "SEND_QUEUE", {}))
+        return cls(**{k.lower(): v for k, v in options.items()})
+
+    @classmethod
+    def collapse_key(cls, event: dict[str, Any]) -> Optional[str]:
+        """
+        Returns the key under which `event` replaces an older event of the
+        same type, or None when it never does.
+        """
+        build = cls.collapse_keys.get(event["type"])
+        return None if build is None else build(event)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def lag(self) -> float:
+        if not self.frames:
+            return 0.0
+        return self.clock() - next(iter(self.frames.values()))[0]
+
+    def put(self, event_type: str, collapse_key: Optional[str], frame: Any) -> bool:
+        policy = self.policies.get(event_type, "keep")
+        if policy != "keep" and collapse_key is not None:
+            key: Hashable = (event_type, collapse_key)
+            if key in self.frames:
+                self.frames[key][2] = frame
+                SendQueueMetrics.record("collapsed")
+                return True
+        else:
+            key = next(self.counter)
+
+        if len(self.frames) >= self.max_size and not self.evict(policy):
+            if policy == "drop":
+                SendQueueMetrics.record("dropped")
+                return True
+            return False
+
+        self.frames[key] = [self.clock(), event_type, frame]
+        SendQueueMetrics.record("queued", depth=len(self.frames))
+        return self.lag() <= self.max_lag
+
+    def evict(self, policy: str) -> bool:
+        """
+        Drops the oldest droppable frame to make room for an event with
+        `policy`; droppable events never push each other out.
+        """
+        if policy == "drop":
+            return False
+        for key, (_, event_type, _) in self.frames.items():
+            if self.policies.get(event_type) == "drop":
+                del self.frames[key]
+                SendQueueMetrics.record("dropped")
+                return True
+        return False
+
+    def pop(self) -> Any:
+        return self.frames.popitem(last=False)[1][2]
+
+    def pop_batch(self) -> list[Any]:
+        return [self.pop() for _ in range(min(len(self.frames), self.batch_size))]
+
+
+class SendQueueMetrics:
+    """
+    Process-wide send queue counters. `flush` adds them to the default cache
+    at most every `interval` seconds, so `stats` can report totals across
+    workers when the cache is shared.
+    """
+
+    cache_prefix = "messaging:send_queue:"
+    names = ["queued", "collapsed", "dropped", "disconnected"]
+    interval = 10.0
+
+    counts = {name: 0 for name in names}
+    max_depth = 0
+    flushed_at = 0.0
+    lock = threading.Lock()
+
+    @classmethod
+    def record(cls, name: str, depth: int = 0):
+        with cls.lock:
+            cls.counts[name] += 1
+            if depth > cls.max_depth:
+                cls.max_depth = depth
+
+    @classmethod
+    def due(cls) -> bool:
+        return time.monotonic() - cls.flushed_at >= cls.interval
+
+    @classmethod
+    def flush(cls):
+        with cls.lock:
+            cls.flushed_at = time.monotonic()
+            counts, cls.counts = cls.counts, {name: 0 for name in cls.names}
+            max_depth, cls.max_depth = cls.max_depth, 0
+
+        try:
+            for name, count in counts.items():
+                if count:
+                    key = f"{cls.cache_prefix}{name}"
+                    _ = cache.add(key, 0, timeout=None)
+                    _ = cache.incr(key, count)
+            key = f"{cls.cache_prefix}max_depth"
+            if max_depth > (cache.get(key) or 0):
+                cache.set(key, max_depth, timeout=None)
+        except RedisError:
+            # Metrics are best effort; never let them stall a socket.
+            logger.warning("Send queue metrics unavailable", exc_info=True)
+
+    @classmethod
+    def stats(cls, reset: bool = False) -> dict[str, int]:
+        keys = [f"{cls.cache_prefix}{name}" for name in [*cls.names, "max_depth"]]
+        values = cache.get_many(keys)
+        if reset:
+            cache.delete_many(keys)
+        return {key.removeprefix(cls.cache_prefix): values.get(key, 0) for key in keys}
@@ -1,8 +1,7 @@
 from typing import Any, Optional, cast
-from asgiref.sync import async_to_sync
-from channels.layers import BaseChannelLayer, get_channel_layer
 from django.contrib.auth import get_user_model
-from django.db.models import Exists, OuterRef
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, permissions, filters
 from rest_framework.decorators import action
@@ -10,14 +9,23 @@ from rest_framework.generics import mixins
 from rest_framework.views import Request, Response, exceptions, status
 from drf_yasg.utils import swagger_auto_schema
 
-from messaging.filters.chat import ChatRoomMessageFilter
+from messaging.filters.chat import (
+    ChatRoomMessageFilter,
+    ChatRoomMessageSearchFilter,
+    search_messages,
+)
 from messaging.models.chat import (
     ChatRoom,
     ChatRoomMember,
     ChatRoomMessage,
-    ChatRoomMessageReadReciepts,
+    ChatRoomMessageTombstone,
+    ChatRoomType,
+)
+from messaging.pagination.chat import (
+    ChatMessagesPagination,
+    ChatMessagesSearchPagination,
+    ChatRoomsPagination,
 )
-from messaging.pagination.chat import ChatMessagesPagination
 from messaging.permissions.chat import (
     CanEditMessagePermission,
     CanSendMessagePermission,
@@ -29,9 +37,20 @@ from messaging.serializers.chat import (
     ChatRoomEditRequestSerializer,
     ChatRoomMemberDetailSerializer,
     ChatRoomMessageDetailSerializer,
+    ChatRoomMessageBulkCreateRequestSerializer,
+    ChatRoomMessageBulkCreateResponseSerializer,
+    ChatRoomMessageCreateRequestSerializer,
+    ChatRoomMessageExportRequestSerializer,
     ChatRoomMessageRequestSerializer,
+    ChatRoomMessageSearchRequestSerializer,
+    ChatRoomMessageSearchResponseSerializer,
     ChatRoomDetailsSerializer,
+    ChatRoomSyncRequestSerializer,
+    ChatRoomSyncResponseSerializer,
 )
+from messaging.utils.chat import ChatMessageManager
+from messaging.utils.export import ChatHistoryExporter
+from messaging.utils.recent import RecentMessagesCache
 
 User = get_user_model()
 
@@ -41,56 +60,88 @@ class ChatRoomMessageViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = ChatRoomMessageDetailSerializer
     pagination_class = ChatMessagesPagination
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [ChatRoomMessageSearchFilter, filters.OrderingFilter]
     filterset_class = ChatRoomMessageFilter
     search_fields = ["text"]
 
     def get_queryset(self):
-        return self.queryset.filter(chat_room__pk=self.kwargs.get("chat_pk"))
+        return self.queryset.filter(
+            chat_room__pk=self.kwargs.get("chat_pk")
+        ).select_related("sender__user__profile")
+
+    def list(self, request: Request, *args: Any, **kwargs: Any):
+        paginator = cast(ChatMessagesPagination, self.paginator)
+        # Only the plain newest page is cached; cursors, search and ordering
+        # go to Postgres.
+        if set(request.query_params) <= {paginator.page_size_query_param}:
+            cached = RecentMessagesCache.newest_page(
+                self.kwargs.get("chat_pk"), paginator.get_page_size(request)
+            )
+            if cached is not None:
+                return paginator.get_cached_paginated_response(*cached)
+
+        return super().list(request, *args, **kwargs)
 
     def get_serializer_class(self):
-        if self.action in ["create", "update", "partial_update"]:
+        if self.action == "create":
+            return ChatRoomMessageCreateRequestSerializer
+        if self.action == "bulk_create":
+            return ChatRoomMessageBulkCreateRequestSerializer
+        if self.action in ["update", "partial_update"]:
             return ChatRoomMessageRequestSerializer
         return ChatRoomMessageDetailSerializer
 
     def get_permissions(self):
         permission_classes = []
-        if self.action == "create":
+        if self.action in ["create", "bulk_create"]:
             permission_classes = [permissions.IsAuthenticated, CanSendMessagePermission]
         elif self.action in ["update", "partial_update"]:
             permission_classes = [permissions.IsAuthenticated, CanEditMessagePermission]
-        elif self.action in ["list", "retrieve"]:
+        elif self.action == "destroy":
+            permission_classes = [permissions.IsAuthenticated]
+        elif self.action in ["list", "retrieve", "read_by", "search", "export"]:
             permission_classes = [permissions.IsAuthenticated, CanViewMessagePermission]
 
         return [permission() for permission in permission_classes]
 
     def destroy(self, request: Request, *args: Any, **kwargs: Any):
         message = cast(ChatRoomMessage, self.get_object())
-        if message.sender != request.user:  # pyright: ignore[reportUnreachable]
+        if message.sender.user_id != request.user.pk:
             raise exceptions.PermissionDenied(
                 "You do not have permission to delete this message."
-            )  # pyright: ignore[reportUnreachable]
+            )
 
-        channel_layer = cast(BaseChannelLayer, get_channel_layer())
-        group_name = f"chat_{self.kwargs.get('chat_pk')}"
-        async_to_sync(channel_layer.group_send)(
-            group_name, {"type": "chat_message_delete", "data": str(message.id)}
+        message_id = message.pk
+        tombstone = ChatRoomMessageTombstone.create_for_message(message)
+        RecentMessagesCache.message_deleted(
+            message.chat_room_id, message_id, tombstone.sequence
         )
 
-        return super().destroy(request, *args, **kwargs)
+        ChatMessageManager.broadcast(
+            self.kwargs.get("chat_pk"),
+            {
+                "type": "chat_message_delete",
+                "room_id": str(self.kwargs.get("chat_pk")),
+                "data": str(message_id),
+                "sequence": tombstone.sequence,
+            },
+        )
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @swagger_auto_schema(
-        request_body=ChatRoomMessageRequestSerializer,
+        request_body=ChatRoomMessageCreateRequestSerializer,
         responses={
             status.HTTP_201_CREATED: ChatRoomMessageDetailSerializer,
+            status.HTTP_200_OK: ChatRoomMessageDetailSerializer,
         },
         operation_summary="Send Message",
-        operation_description="Sends a message to a specified chat room.",
+        operation_description="Sends a message to a specified chat room. Repeating a `client_key` returns the original message with a 200.",
     )
     def create(self, request: Request, *args: Any, **kwargs: Any):
         request_serializer = cast(
-            ChatRoomMessageRequestSerializer,
-            ChatRoomMessageRequestSerializer(data=request.data),
+            ChatRoomMessageCreateRequestSerializer,
+            ChatRoomMessageCreateRequestSerializer(data=request.data),
         )
         _ = request_serializer.is_valid(raise_exception=True)
         validated_data = cast(dict[str, Any], request_serializer.validated_data)
@@ -98,35 +149,63 @@ class ChatRoomMessageViewSet(viewsets.ModelViewSet):
         chat_room_id = self.kwargs.get("chat_pk")
         chat_room = get_object_or_404(ChatRoom, pk=chat_room_id)
 
-        sender = ChatRoomMember.objects.filter(
-            chat_room=chat_room, user=request.user
-        ).first()
-
-        message = ChatRoomMessage.objects.create(
-            **validated_data, chat_room=chat_room, sender=sender
+        sender = (
+            ChatRoomMember.objects.select_related("user__profile")
+            .filter(chat_room=chat_room, user=request.user)
+            .first()
         )
 
-        read_receipts = [
-            ChatRoomMessageReadReciepts(message=message, member=member)
-            for member in ChatRoomMember.objects.filter(
-                chat_room=chat_room, online=True, active=True
-            )
-        ]
-        _ = ChatRoomMessageReadReciepts.objects.bulk_create(read_receipts)
+        message, created = ChatMessageManager.create_message(
+            chat_room, sender, validated_data
+        )
 
         response_serializer = ChatRoomMessageDetailSerializer(message)
 
-        channel_layer = cast(BaseChannelLayer, get_channel_layer())
-        group_name = f"chat_{chat_room_id}"
-        async_to_sync(channel_layer.group_send)(
-            group_name, {"type": "chat_message", "data": response_serializer.data}
-        )
-
         return Response(
             response_serializer.data,
-            status=status.HTTP_201_CREATED,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
         )
 
+    @swagger_auto_schema(
+        request_body=ChatRoomMessageBulkCreateRequestSerializer,
+        responses={
+            status.HTTP_201_CREATED: ChatRoomMessageBulkCreateResponseSerializer,
+        },
+        operation_summary="Send messages in bulk",
+        operation_description="Stores up to 5000 messages from the requesting member in one transaction and broadcasts a single `chat_message_batch` event. Messages repeating a `client_key` are skipped.",
+    )
+    @action(methods=["POST"], detail=False, url_path="bulk", url_name="bulk")
+    def bulk_create(self, request: Request, *args: Any, **kwargs: Any):
+        request_serializer = ChatRoomMessageBulkCreateRequestSerializer(
+            data=request.data
+        )
+        _ = request_serializer.is_valid(raise_exception=True)
+        messages_data = cast(
+            list[dict[str, Any]],
+            cast(dict[str, Any], request_serializer.validated_data)["messages"],
+        )
+
+        sender = get_object_or_404(
+            ChatRoomMember.objects.select_related("chat_room"),
+            chat_room__pk=self.kwargs.get("chat_pk"),
+            user=request.user,
+        )
+        messages = ChatMessageManager.bulk_create_messages(
+            sender.chat_room, sender, messages_data
+        )
+
+        response_serializer = ChatRoomMessageBulkCreateResponseSerializer(
+            {
+                "created": len(messages),
+                "skipped": len(messages_data) - len(messages),
+                "ids": [message.id for message in messages],
+                "first_sequence": messages[0].sequence if messages else None,
+                "last_sequence": messages[-1].sequence if messages else None,
+            }
+        )
+
+        return Response(response_serializer.data, status=status.HTTP_201_CREATED)
+
     @swagger_auto_schema(
         request_body=ChatRoomMessageRequestSerializer,
         responses={
@@ -136,25 +215,33 @@ class ChatRoomMessageViewSet(viewsets.ModelViewSet):
         operation_description="Edit certain information of chat message.",
     )
     def update(self, request: Request, *args: Any, **kwargs: Any):
+        message = cast(ChatRoomMessage, self.get_object())
+        if message.sender.user_id != self.request.user.pk:
+            raise exceptions.PermissionDenied(
+                "You do not have permission to edit this message."
+            )
+
         request_serializer = cast(
             ChatRoomMessageRequestSerializer,
-            ChatRoomMessageRequestSerializer(data=request.data),
+            ChatRoomMessageRequestSerializer(
+                message, data=request.data, partial=kwargs.get("partial", False)
+            ),
         )
         _ = request_serializer.is_valid(raise_exception=True)
 
-        message = cast(ChatRoomMessage, self.get_object())
-        if message.sender != self.request.user:  # pyright: ignore[reportUnreachable]
-            return exceptions.PermissionDenied(
-                "You do not have permission to edit this message."
-            )  # pyright: ignore[reportUnreachable]
-
         message = request_serializer.save()
         response_serializer = ChatRoomMessageDetailSerializer(message)
+        RecentMessagesCache.message_edited(
+            message.chat_room_id, response_serializer.data, message.change_sequence
+        )
 
-        channel_layer = cast(BaseChannelLayer, get_channel_layer())
-        group_name = f"chat_{self.kwargs.get('chat_pk')}"
-        async_to_sync(channel_layer.group_send)(
-            group_name, {"type": "chat_message_edit", "data": response_serializer.data}
+        ChatMessageManager.broadcast(
+            self.kwargs.get("chat_pk"),
+            {
+                "type": "chat_message_edit",
+                "room_id": str(self.kwargs.get("chat_pk")),
+                "data": response_serializer.data,
+            },
         )
 
         return Response(
@@ -162,11 +249,87 @@ class ChatRoomMessageViewSet(viewsets.ModelViewSet):
             status=status.HTTP_200_OK,
         )
 
+    @swagger_auto_schema(
+        responses={
+            status.HTTP_200_OK: ChatRoomMemberDetailSerializer(many=True),
+        },
+        operation_summary="Message read by",
+        operation_description="Lists the chat room members that have read a message.",
+    )
+    @action(methods=["GET"], detail=True, url_path="read_by", url_name="read-by")
+    def read_by(self, request: Request, *args: Any, **kwargs: Any):
+        message = cast(ChatRoomMessage, self.get_object())
+        members = message.read_by().select_related("user__profile")
+
+        return Response(
+            ChatRoomMemberDetailSerializer(members, many=True).data,
+            status=status.HTTP_200_OK,
+        )
+
+    @swagger_auto_schema(
+        query_serializer=ChatRoomMessageSearchRequestSerializer,
+        responses={status.HTTP_200_OK: ChatRoomMessageSearchResponseSerializer},
+        operation_summary="Search messages",
+        operation_description="Full-text search of a chat room's messages, best match first.",
+    )
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="search",
+        url_name="search",
+        pagination_class=ChatMessagesSearchPagination,
+        filter_backends=[],
+    )
+    def search(self, request: Request, *args: Any, **kwargs: Any):
+        request_serializer = ChatRoomMessageSearchRequestSerializer(
+            data=request.query_params
+        )
+        _ = request_serializer.is_valid(raise_exception=True)
+        validated_data = cast(dict[str, Any], request_serializer.validated_data)
+
+        queryset = search_messages(self.get_queryset(), validated_data["q"])
+        page = self.paginate_queryset(queryset)
+
+        return self.get_paginated_response(
+            ChatRoomMessageDetailSerializer(page, many=True).data
+        )
+
+    @swagger_auto_schema(
+        query_serializer=ChatRoomMessageExportRequestSerializer,
+        responses={status.HTTP_200_OK: "NDJSON or CSV file"},
+        operation_summary="Export messages",
+        operation_description="Streams the room's messages, optionally within a date range, as NDJSON or CSV.",
+    )
+    @action(methods=["GET"], detail=False, url_path="export", url_name="export")
+    def export(self, request: Request, *args: Any, **kwargs: Any):
+        request_serializer = ChatRoomMessageExportRequestSerializer(
+            data=request.query_params
+        )
+        _ = request_serializer.is_valid(raise_exception=True)
+        validated_data = cast(dict[str, Any], request_serializer.validated_data)
+        file_format = cast(str, validated_data["file_format"])
+        chat_room = get_object_or_404(ChatRoom, pk=self.kwargs.get("chat_pk"))
+
+        chunks = ChatHistoryExporter.export(
+            chat_room.pk,
+            file_format,
+            since=validated_data.get("since"),
+            until=validated_data.get("until"),
+        )
+        return StreamingHttpResponse(
+            ChatHistoryExporter.astream(chunks),
+            content_type=ChatHistoryExporter.CONTENT_TYPES[file_format],
+            headers={
+                "Content-Disposition": f'attachment; filename="chat-{chat_room.pk}.{file_format}"'
+            },
+        )
+
 
 class ChatRoomViewSet(viewsets.ModelViewSet):
     serializer_class = ChatRoomDetailsSerializer
     queryset = ChatRoom.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ChatRoomsPagination
 
     def get_serializer_class(self):
         if self.action == "create":
@@ -177,7 +340,31 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            return self.queryset.filter(chatroommember__user=self.request.user)
+            return (
+                self.queryset.filter(chatroommember__user=self.request.user)
+                .annotate(
+                    # Read from the requesting user's member row joined above.
+                    unread=F("chatroommember__unread_count"),
+                    last_activity_at=F("chatroommember__last_activity_at"),
+                    activity_room_id=F("chatroommember__chat_room_id"),
+                    member_count=Subquery(
+                        ChatRoomMember.objects.filter(chat_room=OuterRef("pk"))
+                        .order_by()
+                        .values("chat_room")
+                        .annotate(count=Count("id"))
+                        .values("count")
+                    ),
+                )
+                .prefetch_related(
+                    Prefetch(
+                        "chatroommember_set",
+                        queryset=ChatRoomMember.objects.filter(
+                            chat_room__type=ChatRoomType.Pair
+                        ).select_related("user__profile"),
+                        to_attr="pair_members",
+                    )
+                )
+            )
         return self.queryset
 
     def perform_update(self, serializer: ChatRoomEditRequestSerializer):
@@ -221,7 +408,9 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         _ = ChatRoomMember.objects.create(user=self.request.user, chat_room=chat_room)
         _ = ChatRoomMember.objects.create(user=pair_user, chat_room=chat_room)
 
-        response_serializer = ChatRoomDetailsSerializer(request_serializer.instance)
+        response_serializer = ChatRoomDetailsSerializer(
+            chat_room, context=self.get_serializer_context()
+        )
 
         return Response(
             response_serializer.data,
@@ -268,38 +457,89 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     def clear_unread(self, request: Request, pk: Optional[str] = None):
         chat_room = get_object_or_404(ChatRoom, pk=pk)
         member = ChatRoomMember.objects.get(chat_room=chat_room, user=request.user)
+        unread_before = member.unread_count
 
-        unread_messages = (
+        member.mark_read(
             ChatRoomMessage.objects.filter(chat_room=chat_room)
-            .exclude(sender=member)
-            .filter(
-                ~Exists(
-                    ChatRoomMessageReadReciepts.objects.filter(
-                        message=OuterRef("id"), member=member
-                    )
-                )
-            )
+            .order_by("-date_added")
+            .first()
         )
 
-        read_receipts = [
-            ChatRoomMessageReadReciepts(message=message, member=member)
-            for message in unread_messages
-        ]
-
-        _ = ChatRoomMessageReadReciepts.objects.bulk_create(read_receipts)
-
-        channel_layer = cast(BaseChannelLayer, get_channel_layer())
-        group_name = f"chat_{self.kwargs.get('chat_pk')}"
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {"type": "clear_unread", "data": str(self.kwargs.get("chat_pk"))},
+        ChatMessageManager.broadcast(
+            chat_room.pk,
+            {
+                "type": "clear_unread",
+                "room_id": str(chat_room.pk),
+                "data": str(chat_room.pk),
+            },
         )
+        if unread_before:
+            ChatMessageManager.notify_user(
+                request.user.pk,
+                ChatMessageManager.unread_event(chat_room.pk, 0, -unread_before),
+            )
 
         return Response(
             None,
             status=status.HTTP_200_OK,
         )
 
+    @swagger_auto_schema(
+        query_serializer=ChatRoomSyncRequestSerializer,
+        responses={status.HTTP_200_OK: ChatRoomSyncResponseSerializer},
+        operation_summary="Sync chat room",
+        operation_description="Returns the message inserts, edits and deletes after a sequence number.",
+    )
+    @action(methods=["GET"], detail=True, url_path="sync", url_name="sync")
+    def sync(self, request: Request, pk: Optional[str] = None):
+        request_serializer = ChatRoomSyncRequestSerializer(data=request.query_params)
+        _ = request_serializer.is_valid(raise_exception=True)
+        validated_data = cast(dict[str, Any], request_serializer.validated_data)
+        since_seq = cast(int, validated_data["since_seq"])
+        limit = cast(int, validated_data["limit"])
+
+        chat_room = cast(ChatRoom, self.get_object())
+
+        messages = (
+            ChatRoomMessage.objects.filter(
+                chat_room=chat_room, change_sequence__gt=since_seq
+            )
+            .select_related("sender__user__profile")
+            .order_by("change_sequence")
+        )
+        tombstones = ChatRoomMessageTombstone.objects.filter(
+            chat_room=chat_room, sequence__gt=since_seq
+        ).order_by("sequence")
+
+        events = [
+            {
+                "type": "insert" if message.sequence > since_seq else "edit",
+                "sequence": message.change_sequence,
+                "message_id": message.id,
+                "message": message,
+            }
+            for message in messages[: limit + 1]
+        ] + [
+            {
+                "type": "delete",
+                "sequence": tombstone.sequence,
+                "message_id": tombstone.message_id,
+                "message": None,
+            }
+            for tombstone in tombstones[: limit + 1]
+        ]
+        events.sort(key=lambda event: event["sequence"])
+
+        response_serializer = ChatRoomSyncResponseSerializer(
+            {
+                "events": events[:limit],
+                "last_seq": events[:limit][-1]["sequence"] if events else since_seq,
+                "has_more": len(events) > limit,
+            }
+        )
+
+        return Response(response_serializer.data, status=status.HTTP_200_OK)
+
 
 class ChatRoomMembersViewSet(
     mixins.ListModelMixin,
@@ -307,7 +547,7 @@ class ChatRoomMembersViewSet(
     mixins.DestroyModelMixin,
     viewsets.GenericViewSet,
 ):
-    queryset = ChatRoomMember.objects.all()
+    queryset = ChatRoomMember.objects.select_related("user__profile")
     serializer_class = ChatRoomMemberDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
 
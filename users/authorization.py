@@ -1,13 +1,9 @@
-from django.contrib.auth import get_user_model
-import jwt
 from typing import Any, Optional, cast
-from rest_framework.views import Request, exceptions
+from rest_framework.request import Request
 from rest_framework import authentication
 from django.conf import settings
 
-from users.models.auth import TimedAuthTokenPair
-
-User = get_user_model()
+from users.utils.auth import AuthManager
 
 
 class JWTAuthorization(authentication.BaseAuthentication):
@@ -21,22 +17,12 @@ class JWTAuthorization(authentication.BaseAuthentication):
         if not authorization:
             return None
         token = authorization.split(" ").pop()
-        if not TimedAuthTokenPair.objects.filter(token=token).exists():
-            return None
-        try:
-            email = cast(
-                dict[str, Any],
-                jwt.decode(token, cast(str, settings.SECRET_KEY), algorithms="HS256"),
-            ).get("email")
-            user = User.objects.filter(email=email).first()
 
-            if user is None:
-                raise exceptions.AuthenticationFailed("Invalid Token")
-
-            return (user, None)
+        user = AuthManager.user_for_token(token)
+        if user is None:
+            return None
 
-        except jwt.ExpiredSignatureError:
-            raise exceptions.AuthenticationFailed("Token Expired")
+        return (user, None)
 
     def authenticate_header(self, request: Request):
         return cast(Any, 'Bearer realm="api"')
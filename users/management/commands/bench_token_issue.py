@@ -0,0 +1,109 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, cast
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from users.utils.auth import AuthManager
+from users.utils.hq_stub import StubHQServer
+from users.views.auth import AuthViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures HQ token verification and /users/auth/token/ throughput against "
+        "a local stub HQ server. Created users and tokens are rolled back."
+    )
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.005,
+            help="Seconds the stub HQ server waits before answering.",
+        )
+
+    def handle(self, *args: Any, **options: Any):
+        with StubHQServer(latency=options["latency"]) as hq:
+            auth_settings = {
+                **cast(dict[str, Any], settings.CUSTOM_AUTH),
+                **hq.auth_settings(),
+            }
+            with override_settings(CUSTOM_AUTH=auth_settings):
+                self.run(hq, auth_settings, options["requests"], options["concurrency"])
+
+    def run(
+        self,
+        hq: StubHQServer,
+        auth_settings: dict[str, Any],
+        request_count: int,
+        concurrency: int,
+    ):
+        url = f"{hq.url}{auth_settings['BASE_AUTH_SERVICE_VERIFICATION_ENDPOINT']}"
+        tokens = [f"bench-{i}" for i in range(request_count)]
+
+        self.report(
+            "verify, new connection per call",
+            hq,
+            lambda token: requests.post(url, {"token": token}).json(),
+            tokens,
+            concurrency,
+        )
+        cache.clear()
+        self.report(
+            "verify, pooled session",
+            hq,
+            AuthManager.verify_hq_token,
+            tokens,
+            concurrency,
+        )
+        self.report(
+            "verify, cached",
+            hq,
+            AuthManager.verify_hq_token,
+            tokens,
+            concurrency,
+        )
+
+        view = AuthViewSet.as_view({"post": "token_create"})
+        factory = APIRequestFactory()
+        with transaction.atomic():
+            self.report(
+                "token issue, cached verification",
+                hq,
+                lambda token: view(
+                    factory.post("/users/auth/token/", {"hq_token": token})
+                ),
+                tokens,
+                1,
+            )
+            transaction.set_rollback(True)
+
+    def report(
+        self,
+        label: str,
+        hq: StubHQServer,
+        call: Callable[[str], Any],
+        tokens: list[str],
+        concurrency: int,
+    ):
+        requests_before = hq.requests
+        hq.connections.clear()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            _ = list(executor.map(call, tokens))
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{label}: {len(tokens) / elapsed:.0f} req/s, "
+            f"{hq.requests - requests_before} upstream requests over "
+            f"{len(hq.connections)} connections"
+        )
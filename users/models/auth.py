@@ -24,6 +24,7 @@ class TimedAuthTokenPair(models.Model):
         encoded = jwt.encode(
             {
                 "email": user.email,
+                "jti": secrets.token_hex(8),
                 "iat": timezone.now(),
                 "exp": timezone.now()
                 + timedelta(hours=auth_settings.get("TOKEN_VALID_DURATION_HOURS") or 2),
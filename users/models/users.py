@@ -2,6 +2,7 @@
 from typing import Any, Optional
 import uuid
 from django.db import models
+from django.utils.functional import cached_property
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
@@ -57,6 +58,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     def get_username(self):
         return self.email
 
+    @cached_property
+    def hq_permissions(self) -> frozenset[str]:
+        """
+        The HQ permission names as a set, built once per user instance.
+        """
+        return frozenset((self.hq_user_data or {}).get("permissions") or [])
+
     def get_short_name(self):
         return self.email.split("@")[0]
 
@@ -29,10 +29,12 @@ class UserSerializer(serializers.ModelSerializer):
 
     @swagger_serializer_method(serializer_or_field=ProfileSerializer())
     def get_profile(self, user: User):
-        profile = Profile.objects.filter(user=user).first()
-        if profile:
-            return ProfileSerializer(profile).data
-        return None
+        # Reuses the profile when the queryset did select_related("user__profile").
+        try:
+            profile = user.profile
+        except Profile.DoesNotExist:
+            return None
+        return ProfileSerializer(profile).data
 
     @swagger_serializer_method(
         serializer_or_field=serializers.BooleanField(allow_null=True)
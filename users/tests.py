@@ -1,3 +1,152 @@
-from django.test import TestCase
+from typing import Any
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework import exceptions
+from rest_framework.test import APIClient, APIRequestFactory
 
-# Create your tests here.
+from includes.middleware.channels_auth_middleware import TokenAuthMiddleWare
+from users.authorization import JWTAuthorization
+from users.models.auth import TimedAuthTokenPair
+from users.models.users import User
+from users.utils.auth import AuthManager, AuthServiceUnavailable, AuthTokenCache
+from users.utils.hq_stub import StubHQServer
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class JWTAuthorizationCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        AuthTokenCache.clear_local()
+        self.user = User.objects.create_user(email="owner@example.com")
+        self.user.hq_user_data = {
+            "id": "hq-1",
+            "permissions": ["can_view_chat"],
+            "subscription_payment_paid": True,
+        }
+        self.user.save()
+        self.token = TimedAuthTokenPair.create_for_user(self.user)
+
+    def authenticate(self, token: str):
+        request = APIRequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return JWTAuthorization().authenticate(request)
+
+    def test_cached_token_needs_no_queries(self):
+        user, _ = self.authenticate(self.token.token)
+        self.assertEqual(user.pk, self.user.pk)
+
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate(self.token.token)
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.hq_user_data["permissions"], ["can_view_chat"])
+
+        AuthTokenCache.clear_local()
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate(self.token.token)
+        self.assertEqual(user.email, self.user.email)
+
+    def test_refresh_revokes_the_old_token(self):
+        _ = self.authenticate(self.token.token)
+
+        response = APIClient().post(
+            "/users/auth/refresh/", {"refresh_token": self.token.refresh_token}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.assertIsNone(self.authenticate(self.token.token))
+        self.assertIsNotNone(self.authenticate(response.json()["token"]))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class AuthManagerVerifyHQTokenTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.hq = StubHQServer().__enter__()
+        self.addCleanup(self.hq.__exit__)
+        settings_override = override_settings(
+            CUSTOM_AUTH={**settings.CUSTOM_AUTH, **self.hq.auth_settings()}
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_verifications_are_pooled_and_cached(self):
+        for i in range(5):
+            user_data = AuthManager.verify_hq_token(f"user{i}")
+            self.assertEqual(user_data["email"], f"user{i}@example.com")
+        self.assertEqual(len(self.hq.connections), 1)
+
+        _ = AuthManager.verify_hq_token("user0")
+        _ = async_to_sync(AuthManager.averify_hq_token)("user1")
+        self.assertEqual(self.hq.requests, 5)
+
+    def test_rejected_token(self):
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            _ = AuthManager.verify_hq_token("invalid")
+
+    def test_unreachable_service(self):
+        with override_settings(
+            CUSTOM_AUTH={
+                **settings.CUSTOM_AUTH,
+                "BASE_AUTH_SERVICE_URL": "http://127.0.0.1:9",
+            }
+        ):
+            with self.assertRaises(AuthServiceUnavailable):
+                _ = AuthManager.verify_hq_token("user0")
+
+    def test_token_create(self):
+        response = APIClient().post("/users/auth/token/", {"hq_token": "alice"})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["user"]["email"], "alice@example.com")
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+class TokenAuthMiddleWareTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        AuthTokenCache.clear_local()
+        self.user = User.objects.create_user(email="socket@example.com")
+        self.token = TimedAuthTokenPair.create_for_user(self.user)
+
+    def connect(self, **scope: Any) -> dict[str, Any]:
+        scopes: list[dict[str, Any]] = []
+
+        async def inner(scope: dict[str, Any], receive: Any, send: Any):
+            scopes.append(scope)
+
+        middleware = TokenAuthMiddleWare(inner)
+        async_to_sync(middleware)(
+            {"type": "websocket", "query_string": b"", **scope}, None, None
+        )
+        return scopes[0]
+
+    def test_query_string_token(self):
+        scope = self.connect(query_string=f"room=1&token={self.token.token}".encode())
+        self.assertEqual(scope["user"].pk, self.user.pk)
+        self.assertIsNone(scope["auth_subprotocol"])
+
+        with self.assertNumQueries(0):
+            scope = self.connect(query_string=f"token={self.token.token}".encode())
+        self.assertEqual(scope["user"].pk, self.user.pk)
+
+    def test_subprotocol_token(self):
+        scope = self.connect(subprotocols=["Bearer", self.token.token])
+
+        self.assertEqual(scope["user"].pk, self.user.pk)
+        self.assertEqual(scope["auth_subprotocol"], "Bearer")
+
+    def test_revoked_and_missing_tokens(self):
+        _ = self.connect(query_string=f"token={self.token.token}".encode())
+        AuthTokenCache.revoke([self.token.token])
+        _ = self.token.delete()
+
+        scope = self.connect(query_string=f"token={self.token.token}".encode())
+        self.assertFalse(scope["user"].is_authenticated)
+        self.assertFalse(self.connect()["user"].is_authenticated)
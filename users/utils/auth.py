@@ -1,22 +1,259 @@
+import copy
+import hashlib
+import jwt
 import requests
-from typing import Any, cast
+import requests.adapters
+import threading
+import time
+from asgiref.sync import sync_to_async
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, cast
 from django.conf import settings
-from rest_framework.views import exceptions
+from django.core.cache import cache
+from rest_framework import exceptions
+
+from users.models.auth import TimedAuthTokenPair
+from users.models.users import User
+
+
+class AuthServiceUnavailable(exceptions.APIException):
+    status_code = 503
+    default_detail = "Authentication service unavailable"
+    default_code = "auth_service_unavailable"
 
 
 class AuthManager:
+    """
+    Verifies HQ tokens against the upstream auth service over a pooled
+    keep-alive session. Successful verifications are cached briefly, keyed by a
+    hash of the token.
+    """
+
+    verification_key_prefix = "auth:hq:"
+
+    _session: Optional[requests.Session] = None
+    _session_lock = threading.Lock()
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    pool_size = cast(dict[str, Any], settings.CUSTOM_AUTH).get(
+                        "BASE_AUTH_SERVICE_POOL_SIZE", 20
+                    )
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=pool_size, pool_maxsize=pool_size
+                    )
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    cls._session = session
+        return cls._session
+
     @classmethod
     def verify_hq_token(cls, token: str) -> dict[str, Any]:
         auth_settings = cast(dict[str, Any], settings.CUSTOM_AUTH)
+        cache_key = (
+            f"{cls.verification_key_prefix}{hashlib.sha256(token.encode()).hexdigest()}"
+        )
+        user_data = cache.get(cache_key)
+        if user_data is not None:
+            return user_data
+
         url = f"{auth_settings.get('BASE_AUTH_SERVICE_URL')}{auth_settings.get('BASE_AUTH_SERVICE_VERIFICATION_ENDPOINT')}"
         data = {"token": token}
 
         headers = {
             "X-Service-Api-Key": f"{auth_settings.get('BASE_AUTH_ISSUED_SERVICE_NAME')} {auth_settings.get('BASE_AUTH_ISSUED_API_KEY')}"
         }
-        response = requests.post(url, data, headers=headers)
+        try:
+            response = cls.session().post(
+                url,
+                data,
+                headers=headers,
+                timeout=(
+                    auth_settings.get("BASE_AUTH_SERVICE_CONNECT_TIMEOUT_SECONDS", 3),
+                    auth_settings.get("BASE_AUTH_SERVICE_READ_TIMEOUT_SECONDS", 5),
+                ),
+            )
+        except requests.RequestException:
+            raise AuthServiceUnavailable()
 
         if response.status_code != 200:
             raise exceptions.AuthenticationFailed(response.text)
 
-        return response.json()
+        user_data = response.json()
+        cache.set(cache_key, user_data, auth_settings.get("HQ_TOKEN_CACHE_SECONDS", 30))
+        return user_data
+
+    @classmethod
+    def user_for_token(cls, token: str) -> Optional[User]:
+        """
+        Resolves an access token to its user, from AuthTokenCache when possible.
+        Returns None for unknown or revoked tokens and raises AuthenticationFailed
+        for expired or mismatched ones.
+        """
+        user = AuthTokenCache.get_user(token)
+        if user is not None:
+            return user
+
+        token_pair = (
+            TimedAuthTokenPair.objects.select_related("user")
+            .filter(token=token)
+            .first()
+        )
+        if token_pair is None:
+            return None
+        try:
+            decoded = cast(
+                dict[str, Any],
+                jwt.decode(token, cast(str, settings.SECRET_KEY), algorithms="HS256"),
+            )
+        except jwt.ExpiredSignatureError:
+            raise exceptions.AuthenticationFailed("Token Expired")
+
+        user = token_pair.user
+        if user.email != decoded.get("email"):
+            raise exceptions.AuthenticationFailed("Invalid Token")
+
+        AuthTokenCache.set_user(token, user, decoded["exp"])
+        return user
+
+    @classmethod
+    async def averify_hq_token(cls, token: str) -> dict[str, Any]:
+        """
+        Async variant for ASGI callers; the pooled request runs in a worker
+        thread so the event loop is never blocked.
+        """
+        return await sync_to_async(cls.verify_hq_token, thread_sensitive=False)(token)
+
+
+class AuthTokenCache:
+    """
+    Caches the user behind a validated access token so authenticated requests
+    skip the token and user lookups.
+
+    Snapshots live in a bounded in-process LRU backed by the shared cache.
+    Revoked tokens are recorded in the shared cache until they would have
+    expired, so a revoked token is never cached again. Other processes may keep
+    serving a revoked token from their LRU for at most
+    `TOKEN_LOCAL_CACHE_TTL_SECONDS`.
+    """
+
+    key_prefix = "auth:token:"
+    revoked_key_prefix = "auth:revoked:"
+
+    _local: OrderedDict[str, tuple[float, float, dict[str, Any]]] = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def settings(cls) -> dict[str, Any]:
+        return cast(dict[str, Any], settings.CUSTOM_AUTH)
+
+    @classmethod
+    def token_hash(cls, token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def get_local_user(cls, token: str) -> Optional[User]:
+        """
+        Looks the token up in the in-process LRU only; safe to call from async
+        code.
+        """
+        token_hash = cls.token_hash(token)
+        now = time.time()
+
+        with cls._lock:
+            entry = cls._local.get(token_hash)
+            if entry is None:
+                return None
+            fresh_until, expires_at, snapshot = entry
+            if now < fresh_until and now < expires_at:
+                cls._local.move_to_end(token_hash)
+                return cls.user_from_snapshot(snapshot)
+            del cls._local[token_hash]
+        return None
+
+    @classmethod
+    def get_user(cls, token: str) -> Optional[User]:
+        user = cls.get_local_user(token)
+        if user is not None:
+            return user
+
+        token_hash = cls.token_hash(token)
+        now = time.time()
+        cached = cache.get_many(
+            [cls.key_prefix + token_hash, cls.revoked_key_prefix + token_hash]
+        )
+        if cls.revoked_key_prefix + token_hash in cached:
+            return None
+        entry = cached.get(cls.key_prefix + token_hash)
+        if entry is None:
+            return None
+
+        expires_at, snapshot = entry
+        if now >= expires_at:
+            return None
+        cls.remember_locally(token_hash, expires_at, snapshot)
+        return cls.user_from_snapshot(snapshot)
+
+    @classmethod
+    def set_user(cls, token: str, user: User, expires_at: float):
+        """
+        Caches `user` for `token` until the token's `exp` (`expires_at`) or the
+        configured TTL, whichever comes first.
+        """
+        token_hash = cls.token_hash(token)
+        timeout = min(
+            expires_at - time.time(), cls.settings().get("TOKEN_CACHE_TTL_SECONDS", 300)
+        )
+        if timeout <= 0 or cache.get(cls.revoked_key_prefix + token_hash):
+            return
+
+        snapshot = {
+            field.attname: getattr(user, field.attname)
+            for field in User._meta.concrete_fields
+            if field.attname != "password"
+        }
+        cache.set(cls.key_prefix + token_hash, (expires_at, snapshot), timeout)
+        cls.remember_locally(token_hash, expires_at, snapshot)
+
+    @classmethod
+    def revoke(cls, tokens: Iterable[str]):
+        token_hashes = [cls.token_hash(token) for token in tokens]
+        if not token_hashes:
+            return
+
+        with cls._lock:
+            for token_hash in token_hashes:
+                _ = cls._local.pop(token_hash, None)
+
+        cache.set_many(
+            {cls.revoked_key_prefix + token_hash: True for token_hash in token_hashes},
+            cls.settings().get("TOKEN_VALID_DURATION_HOURS", 2) * 3600,
+        )
+        cache.delete_many([cls.key_prefix + token_hash for token_hash in token_hashes])
+
+    @classmethod
+    def remember_locally(
+        cls, token_hash: str, expires_at: float, snapshot: dict[str, Any]
+    ):
+        fresh_until = time.time() + cls.settings().get(
+            "TOKEN_LOCAL_CACHE_TTL_SECONDS", 5
+        )
+        with cls._lock:
+            cls._local[token_hash] = (fresh_until, expires_at, snapshot)
+            cls._local.move_to_end(token_hash)
+            while len(cls._local) > cls.settings().get("TOKEN_LOCAL_CACHE_SIZE", 10000):
+                _ = cls._local.popitem(last=False)
+
+    @classmethod
+    def clear_local(cls):
+        with cls._lock:
+            cls._local.clear()
+
+    @classmethod
+    def user_from_snapshot(cls, snapshot: dict[str, Any]) -> User:
+        values = copy.deepcopy(list(snapshot.values()))
+        return User.from_db("default", list(snapshot), values)
@@ -0,0 +1,95 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs
+
+VERIFICATION_ENDPOINT = "/auth/verify/"
+
+
+class StubHQServer:
+    """
+    Local stand-in for the HQ auth service, used by the tests and the token
+    issue benchmark. Every token verifies as `<token>@example.com`, except
+    tokens starting with "invalid" which get a 401.
+
+        with StubHQServer(latency=0.01) as hq:
+            with override_settings(CUSTOM_AUTH={**auth, **hq.auth_settings()}):
+                ...
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.connections: set[tuple[str, int]] = set()
+        self.lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        assert self.server is not None
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def auth_settings(self) -> dict[str, Any]:
+        return {
+            "BASE_AUTH_SERVICE_URL": self.url,
+            "BASE_AUTH_SERVICE_VERIFICATION_ENDPOINT": VERIFICATION_ENDPOINT,
+        }
+
+    def __enter__(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = parse_qs(self.rfile.read(length).decode())
+                token = body.get("token", [""])[0]
+
+                with stub.lock:
+                    stub.requests += 1
+                    stub.connections.add(self.client_address)
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                if self.path != VERIFICATION_ENDPOINT or token.startswith("invalid"):
+                    self.respond(401, {"detail": "Invalid token"})
+                    return
+
+                self.respond(
+                    200,
+                    {
+                        "id": token,
+                        "email": f"{token}@example.com",
+                        "permissions": ["can_view_chat", "can_send_message"],
+                        "subscription_payment_paid": True,
+                    },
+                )
+
+            def respond(self, status: int, data: dict[str, Any]):
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                _ = self.wfile.write(payload)
+
+            def log_message(self, format: str, *args: Any):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args: Any):
+        assert self.server is not None and self.thread is not None
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -1,7 +1,5 @@
 from django.utils import timezone
 import jwt
-import base64
-import os
 from typing import Any, cast
 from rest_framework import viewsets
 from rest_framework.decorators import action
@@ -21,7 +19,7 @@ from users.serializers.auth import (
     TokenCreateRequestSerializer,
     VerifyTokenRequestSerializer,
 )
-from users.utils.auth import AuthManager
+from users.utils.auth import AuthManager, AuthTokenCache
 
 
 class AuthViewSet(viewsets.ViewSet):
@@ -44,9 +42,8 @@ class AuthViewSet(viewsets.ViewSet):
         user = User.objects.filter(email=email).first()
 
         if user is None:
-            user = User.objects.create_user(
-                email=email, password=base64.urlsafe_b64encode(os.urandom(15)).decode()
-            )
+            # HQ users never log in with a password; an unusable one skips hashing.
+            user = User.objects.create_user(email=email)
         user.hq_user_data = user_data
         user.save()
 
@@ -93,6 +90,8 @@ class AuthViewSet(viewsets.ViewSet):
             TimedAuthTokenPair, refresh_token=validated_data.get("refresh_token")
         )
 
+        AuthTokenCache.revoke([token.token])
+
         if timezone.now() > token.expires_at:
             _ = token.delete()
             raise exceptions.AuthenticationFailed("Refresh Token Expired")
@@ -129,7 +128,9 @@ class AuthViewSet(viewsets.ViewSet):
         if user is None:
             raise exceptions.NotFound("User not found")
 
-        _ = TimedAuthTokenPair.objects.filter(user=user).delete()
+        tokens = TimedAuthTokenPair.objects.filter(user=user)
+        AuthTokenCache.revoke(tokens.values_list("token", flat=True))
+        _ = tokens.delete()
         serializer = MessageResponseSerializer(
             data={"message": "User Authentication Revoked"}
         )